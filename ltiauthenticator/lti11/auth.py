@@ -1,14 +1,28 @@
 from textwrap import dedent
+from typing import Any, Dict, Optional
 
 from jupyterhub.app import JupyterHub  # type: ignore
 from jupyterhub.auth import Authenticator  # type: ignore
 from jupyterhub.handlers import BaseHandler  # type: ignore
 from jupyterhub.utils import url_path_join  # type: ignore
 from tornado.web import HTTPError
-from traitlets import CaselessStrEnum, Dict, Unicode
+from traitlets import CaselessStrEnum
+from traitlets import Dict as TraitletsDict
+from traitlets import Float, Instance, Int, Type, Unicode, default, observe
 
-from ..utils import convert_request_to_dict, get_browser_protocol
+from ..utils import (
+    AuthStateDigests,
+    LaunchCache,
+    ResponseCache,
+    call_store,
+    convert_request_to_dict,
+    digest_auth_state,
+    get_browser_protocol,
+)
+from .consumers import ConsumerRegistry
 from .handlers import LTI11AuthenticateHandler, LTI11ConfigHandler
+from .replay import MemoryReplayStore, ReplayStore
+from .signer import HMACSHA1Signer
 from .validator import LTI11LaunchValidator
 
 
@@ -53,7 +67,33 @@ class LTI11Authenticator(Authenticator):
         """,
     )
 
-    consumers = Dict(
+    config_cache_max_age = Int(
+        300,
+        config=True,
+        help="""
+        Time in seconds that clients may cache the LTI 1.1 XML config. Clients can
+        revalidate it afterwards with its ETag. Set to 0 to require revalidation on
+        every request.
+        """,
+    )
+
+    config_cache = Instance(
+        ResponseCache,
+        help="""
+        Rendered LTI 1.1 XML configs, keyed by the scheme, host and base URL of the
+        requests they were rendered for.
+        """,
+    )
+
+    @default("config_cache")
+    def _default_config_cache(self) -> ResponseCache:
+        return ResponseCache()
+
+    @observe("config_description", "config_icon", "config_title")
+    def _clear_config_cache(self, change) -> None:
+        self.config_cache.clear()
+
+    consumers = TraitletsDict(
         config=True,
         help="""
         A dict of consumer keys mapped to consumer secrets for those keys.
@@ -102,6 +142,141 @@ class LTI11Authenticator(Authenticator):
         """,
     )
 
+    replay_store_class = Type(
+        MemoryReplayStore,
+        klass=ReplayStore,
+        config=True,
+        help="""
+        Class of the store remembering the oauth_nonce values of launches, to reject
+        replayed launch requests.
+
+        The default `MemoryReplayStore` keeps nonces in the memory of the hub process.
+        Use `ltiauthenticator.lti11.replay.SQLiteReplayStore` to share them between
+        several hubs on the same node, or across restarts.
+        """,
+    )
+
+    replay_store = Instance(
+        ReplayStore,
+        help="""
+        Store remembering the oauth_nonce values of launches, an instance of
+        `replay_store_class`.
+        """,
+    )
+
+    @default("replay_store")
+    def _default_replay_store(self) -> ReplayStore:
+        return self.replay_store_class(parent=self)
+
+    duplicate_launch_ttl = Float(
+        10,
+        config=True,
+        help="""
+        Time in seconds during which a duplicate of a successful launch, e.g. from a
+        double click or a reloaded iframe, is redirected like the original launch
+        without logging the user in again, if the browser is logged in as the same
+        user. Set to 0 to handle every launch in full.
+        """,
+    )
+
+    launch_cache = Instance(
+        LaunchCache,
+        help="""
+        Recent successful launches, keyed by the digest of the launch request.
+        """,
+    )
+
+    @default("launch_cache")
+    def _default_launch_cache(self) -> LaunchCache:
+        return LaunchCache(self.duplicate_launch_ttl)
+
+    @observe("duplicate_launch_ttl")
+    def _update_launch_cache_ttl(self, change) -> None:
+        self.launch_cache.ttl = change.new
+
+    auth_state_digest_cache_size = Int(
+        10000,
+        config=True,
+        help="""
+        Number of users for whom the digest of the auth_state saved at their last login
+        is kept. A login with an unchanged auth_state does not save it
+        again. Set to 0 to save the auth_state at every login.
+        """,
+    )
+
+    auth_state_digests = Instance(
+        AuthStateDigests,
+        help="""
+        Digests of the auth_state last saved for each user.
+        """,
+    )
+
+    @default("auth_state_digests")
+    def _default_auth_state_digests(self) -> AuthStateDigests:
+        return AuthStateDigests(self.auth_state_digest_cache_size)
+
+    @observe("auth_state_digest_cache_size")
+    def _update_auth_state_digests_size(self, change) -> None:
+        self.auth_state_digests.max_size = change.new
+
+    consumer_registry_class = Type(
+        None,
+        klass=ConsumerRegistry,
+        allow_none=True,
+        config=True,
+        help="""
+        Class of a registry providing the consumer keys and shared secrets instead of
+        `consumers`, e.g. `ltiauthenticator.lti11.consumers.FileConsumerRegistry` or
+        `ltiauthenticator.lti11.consumers.SQLiteConsumerRegistry`. Consumers are reloaded
+        from the registry when it changes, without restarting the hub.
+        """,
+    )
+
+    consumer_registry = Instance(
+        ConsumerRegistry,
+        allow_none=True,
+        help="""
+        Registry providing the consumers, an instance of `consumer_registry_class`.
+        """,
+    )
+
+    @default("consumer_registry")
+    def _default_consumer_registry(self) -> Optional[ConsumerRegistry]:
+        if self.consumer_registry_class is None:
+            return None
+        return self.consumer_registry_class(parent=self)
+
+    _signer: Optional[HMACSHA1Signer] = None
+    _validator: Optional[LTI11LaunchValidator] = None
+
+    def get_consumers(self) -> Dict[str, str]:
+        """Return the consumer keys mapped to their shared secrets."""
+        if self.consumer_registry is None:
+            return self.consumers
+        return self.consumer_registry.get_consumers()
+
+    def get_signer(self, consumers: Dict[str, str]) -> HMACSHA1Signer:
+        """Return the signer of `consumers`, reused as long as they do not change."""
+        if self._signer is None or self._signer.consumers is not consumers:
+            self._signer = HMACSHA1Signer(consumers)
+        return self._signer
+
+    @observe("config", "replay_store")
+    def _reset_validator(self, change) -> None:
+        self._validator = None
+
+    def get_validator(self) -> LTI11LaunchValidator:
+        """
+        Return the validator of launch requests. It is created once and reused until
+        the consumers, the replay store or the configuration change.
+        """
+        consumers = self.get_consumers()
+        if self._validator is None or self._validator.consumers is not consumers:
+            self._validator = LTI11LaunchValidator(
+                consumers, self.replay_store, self.get_signer(consumers)
+            )
+        return self._validator
+
     def login_url(self, base_url: str) -> str:
         return url_path_join(base_url, "/lti/launch")
 
@@ -136,7 +311,7 @@ class LTI11Authenticator(Authenticator):
                 """
                 )
             )
-        validator = LTI11LaunchValidator(self.consumers)
+        validator = self.get_validator()
 
         self.log.debug(
             f"Original arguments received in request: {handler.request.arguments}"
@@ -154,7 +329,15 @@ class LTI11Authenticator(Authenticator):
         launch_url = f"{protocol}://{handler.request.host}{handler.request.uri}"
         self.log.debug(f"Launch url is: {launch_url}")
 
-        if validator.validate_launch_request(launch_url, handler.request.headers, args):
+        # the nonce is checked in a thread if the replay store may block
+        is_valid = await call_store(
+            self.replay_store,
+            validator.validate_launch_request,
+            launch_url,
+            handler.request.headers,
+            args,
+        )
+        if is_valid:
             # raise an http error if the username_key is not in the request's arguments.
             if self.username_key not in args.keys():
                 self.log.warning(
@@ -182,6 +365,10 @@ class LTI11Authenticator(Authenticator):
                 },
             }
 
+    def digest_auth_state(self, auth_state: Any) -> str:
+        """Return a stable digest of an auth_state returned by `authenticate`."""
+        return digest_auth_state(auth_state)
+
     def get_uri_scheme(self, request) -> str:
         """Return scheme to use for endpoint URLs of this authenticator."""
         if self.uri_scheme == "auto":
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Optional
+
+from traitlets import Float, Unicode
+from traitlets.config import LoggingConfigurable
+
+
+class ConsumerRegistry(LoggingConfigurable):
+    """
+    Base class of registries providing the consumer keys and shared secrets of
+    LTI 1.1 tool consumers from an external source.
+
+    The consumers are loaded into memory and reloaded when the source changes.
+    The source is checked for changes at most once per `reload_interval`, so that
+    launches are not slowed down by I/O. A reload replaces the consumers at once,
+    launches never see a partially loaded registry.
+    """
+
+    reload_interval = Float(
+        5,
+        config=True,
+        help="""
+        Minimum interval in seconds between two checks whether the consumers have changed.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._consumers: dict[str, str] = {}
+        self._version: Any = None
+        self._next_check = 0.0
+
+    def get_consumers(self) -> dict[str, str]:
+        """Return the consumer keys mapped to their shared secrets."""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.reload_interval
+            self.reload()
+        return self._consumers
+
+    def reload(self) -> None:
+        """
+        Load the consumers if the source has changed. If they cannot be loaded, the
+        previously loaded consumers are kept.
+        """
+        try:
+            version = self.get_version()
+            if version == self._version:
+                return
+            consumers = self.load()
+        except (OSError, ValueError, sqlite3.Error) as e:
+            self.log.warning(f"Unable to load LTI 1.1 consumers: {e}")
+            return
+        self._consumers, self._version = consumers, version
+        self.log.info(f"Loaded {len(consumers)} LTI 1.1 consumers")
+
+    def get_version(self) -> Any:
+        """Return a value that changes whenever the source is modified."""
+        raise NotImplementedError()
+
+    def load(self) -> dict[str, str]:
+        """Return the consumer keys mapped to their shared secrets read from the source."""
+        raise NotImplementedError()
+
+
+class FileConsumerRegistry(ConsumerRegistry):
+    """
+    Registry loading consumers from a JSON file holding an object that maps consumer
+    keys to shared secrets.
+
+    To update the file without exposing a partially written version, write a new
+    file and move it to `path`.
+    """
+
+    path = Unicode(
+        "",
+        config=True,
+        help="""
+        Path of the JSON file holding the consumer keys mapped to their shared secrets.
+        """,
+    )
+
+    def get_version(self) -> tuple[int, int, int]:
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def load(self) -> dict[str, str]:
+        with open(self.path) as f:
+            consumers = json.load(f)
+        if not isinstance(consumers, dict) or not all(
+            isinstance(key, str) and isinstance(secret, str)
+            for key, secret in consumers.items()
+        ):
+            raise ValueError(
+                f"{self.path} must map consumer keys to shared secrets (strings)"
+            )
+        return consumers
+
+
+class SQLiteConsumerRegistry(ConsumerRegistry):
+    """
+    Registry loading consumers from the table `lti11_consumers` of an SQLite database,
+    with the columns `consumer_key` and `secret`. The database may be updated by
+    other processes.
+    """
+
+    path = Unicode(
+        "",
+        config=True,
+        help="""
+        Path of the SQLite database holding the consumers.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        self._connection: Optional[sqlite3.Connection] = None
+        super().__init__(**kwargs)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return self._connection
+
+    def get_version(self) -> int:
+        # data_version changes whenever another connection commits a change
+        (data_version,) = self._connect().execute("PRAGMA data_version").fetchone()
+        return data_version
+
+    def load(self) -> dict[str, str]:
+        return dict(
+            self._connect().execute("SELECT consumer_key, secret FROM lti11_consumers")
+        )
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
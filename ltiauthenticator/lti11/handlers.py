@@ -1,10 +1,17 @@
 from jupyterhub.handlers import BaseHandler  # type: ignore
 from tornado import gen
 
+from ..utils import (
+    AuthStateDigestMixin,
+    CoalescedLoginMixin,
+    digest_launch_request,
+    redirect_duplicate_launch,
+    write_cached_response,
+)
 from .templates import LTI11_CONFIG_TEMPLATE
 
 
-class LTI11AuthenticateHandler(BaseHandler):
+class LTI11AuthenticateHandler(CoalescedLoginMixin, AuthStateDigestMixin, BaseHandler):
     """
     Implements v1.1 of the LTI protocol for passing authentication information
     through.
@@ -43,17 +50,23 @@ class LTI11AuthenticateHandler(BaseHandler):
            - get_next_url: https://github.com/jupyterhub/jupyterhub/blob/abb93ad799865a4b27f677e126ab917241e1af72/jupyterhub/handlers/base.py#L587
            - get_body_argument: https://www.tornadoweb.org/en/stable/web.html#tornado.web.RequestHandler.get_body_argument
         """
+        # duplicates of a successful launch are redirected without another login
+        launch_digest = digest_launch_request(self.request.arguments)
+        redirected = yield redirect_duplicate_launch(self, launch_digest)
+        if redirected:
+            return
+
         # FIXME: Figure out if we want to pass the user returned from
-        #        self.login_user() to self.get_next_url(). It is named
-        #        _ for now as pyflakes is fine about having an unused
-        #        variable named _.
-        _ = yield self.login_user()
+        #        self.login_user() to self.get_next_url().
+        user = yield self.login_user()
         next_url = self.get_next_url()
         body_argument = self.get_body_argument(
             name="custom_next",
             default=next_url,
         )
 
+        if user is not None:
+            self.authenticator.launch_cache.put(launch_digest, user.name, body_argument)
         self.redirect(body_argument)
 
 
@@ -72,20 +85,30 @@ class LTI11ConfigHandler(BaseHandler):
     def get(self) -> None:
         """
         Renders the XML config which is used by LTI consumers to install the external tool.
+
+        The rendered config is cached per scheme, host and base URL and served with an
+        ETag, so that repeated requests are answered with 304 Not Modified.
         """
         self.set_header("Content-Type", "application/xml")
 
         # get the launch url from the client request
         protocol = self.authenticator.get_uri_scheme(self.request)
-        launch_url = f"{protocol}://{self.request.host}{self.application.settings['base_url']}hub/lti/launch"
+        base_url = self.application.settings["base_url"]
+        response = self.authenticator.config_cache.get(
+            (protocol, self.request.host, base_url),
+            lambda: self._render_config(
+                f"{protocol}://{self.request.host}{base_url}hub/lti/launch"
+            ),
+        )
+        write_cached_response(self, response, self.authenticator.config_cache_max_age)
+
+    def _render_config(self, launch_url: str) -> str:
         self.log.debug(f"Calculated launch URL is: {launch_url}")
 
         # build the configuration XML
-        config_xml = LTI11_CONFIG_TEMPLATE.format(
+        return LTI11_CONFIG_TEMPLATE.format(
             description=self.authenticator.config_description,
             icon=self.authenticator.config_icon,
             launch_url=launch_url,
             title=self.authenticator.config_title,
         )
-
-        self.write(config_xml)
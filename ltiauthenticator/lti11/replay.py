@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from traitlets import Float, Int, Unicode
+from traitlets.config import LoggingConfigurable
+
+
+class ReplayStoreError(Exception):
+    """Raised if a replay store cannot check a nonce."""
+
+
+class ReplayStoreFull(ReplayStoreError):
+    """Raised if a nonce cannot be recorded because the store reached its capacity."""
+
+
+class NonceRing:
+    """
+    Replay store remembering the oauth_nonce values of LTI 1.1 launches.
+
+    Nonces are kept in a fixed ring of per-second buckets covering the acceptance
+    window of oauth_timestamp on both sides of the current time. The bucket of a
+    timestamp is reused once it falls out of the window, so lookups and inserts
+    are O(1) and memory is bounded by `max_nonces_per_second` nonces per bucket.
+    Nonces arriving after their bucket is full are rejected rather than forgotten.
+
+    The store is thread safe.
+
+    Args:
+      window: accepted difference in seconds between oauth_timestamp and the current time
+      max_nonces_per_second: maximum number of nonces recorded per timestamp
+    """
+
+    def __init__(self, window: int = 30, max_nonces_per_second: int = 10000):
+        self.window = window
+        self.max_nonces_per_second = max_nonces_per_second
+        size = 2 * window + 1
+        self._seconds: list[Optional[int]] = [None] * size
+        self._buckets: list[set] = [set() for _ in range(size)]
+        self._lock = threading.Lock()
+
+    def check_and_add(
+        self, timestamp: int, nonce: str, now: Optional[float] = None
+    ) -> bool:
+        """
+        Record `nonce` for `timestamp`.
+
+        Returns:
+          False if the nonce has already been used with this timestamp, True otherwise.
+
+        Raises:
+          ValueError if `timestamp` is outside of the window.
+          ReplayStoreFull if the bucket of `timestamp` is full.
+        """
+        if now is None:
+            now = time.time()
+        if abs(now - timestamp) > self.window:
+            raise ValueError(f"Timestamp {timestamp} is outside of the window")
+
+        index = timestamp % len(self._buckets)
+        with self._lock:
+            bucket = self._buckets[index]
+            if self._seconds[index] != timestamp:
+                # the bucket belongs to a timestamp that left the window
+                self._seconds[index] = timestamp
+                bucket.clear()
+            elif nonce in bucket:
+                return False
+            if len(bucket) >= self.max_nonces_per_second:
+                raise ReplayStoreFull(
+                    f"Too many nonces with timestamp {timestamp}, "
+                    f"limit is {self.max_nonces_per_second}"
+                )
+            bucket.add(nonce)
+        return True
+
+    def clear(self) -> None:
+        """Forget all nonces."""
+        with self._lock:
+            for index, bucket in enumerate(self._buckets):
+                self._seconds[index] = None
+                bucket.clear()
+
+
+class ReplayStore(LoggingConfigurable):
+    """
+    Base class of the stores remembering the oauth_nonce values of LTI 1.1 launches.
+
+    A nonce is remembered together with its oauth_timestamp until the timestamp
+    leaves the acceptance window, i.e. for `window` seconds after the timestamp.
+    """
+
+    # whether calls may block on I/O, so that they have to be run outside of the
+    # event loop
+    blocking = False
+
+    window = Int(
+        30,
+        config=True,
+        help="""
+        Accepted difference in seconds between oauth_timestamp and the current time.
+        """,
+    )
+
+    def check_and_insert(
+        self, timestamp: int, nonce: str, now: Optional[float] = None
+    ) -> bool:
+        """
+        Atomically check whether `nonce` has already been used with `timestamp` and
+        record it otherwise.
+
+        Returns:
+          False if the nonce has already been used with this timestamp, True otherwise.
+
+        Raises:
+          ReplayStoreError if the nonce cannot be checked.
+        """
+        raise NotImplementedError()
+
+
+class MemoryReplayStore(ReplayStore):
+    """
+    Replay store keeping nonces in the memory of the hub process, see `NonceRing`.
+    """
+
+    max_nonces_per_second = Int(
+        10000,
+        config=True,
+        help="""
+        Maximum number of nonces remembered per timestamp. Launches beyond this limit are
+        rejected.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._ring = NonceRing(self.window, self.max_nonces_per_second)
+
+    def check_and_insert(
+        self, timestamp: int, nonce: str, now: Optional[float] = None
+    ) -> bool:
+        return self._ring.check_and_add(timestamp, nonce, now)
+
+
+class SQLiteReplayStore(ReplayStore):
+    """
+    Replay store keeping nonces in an SQLite database, which can be shared by several
+    hub processes on the same node.
+
+    Every check is a single upsert, which only succeeds if the nonce is unknown or
+    its record has expired. Launch requests are validated in a thread when this store
+    is used, since a check may wait for a lock held by another process.
+    """
+
+    blocking = True
+
+    path = Unicode(
+        "jupyterhub-lti11-nonces.sqlite",
+        config=True,
+        help="""
+        Path of the SQLite database holding the nonces.
+        """,
+    )
+
+    timeout = Float(
+        5,
+        config=True,
+        help="""
+        Time in seconds to wait for a lock on the database held by another process.
+        """,
+    )
+
+    cleanup_interval = Float(
+        60,
+        config=True,
+        help="""
+        Interval in seconds between two deletions of expired nonces.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS nonces "
+            "(nonce TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+        self._next_cleanup = 0.0
+
+    def check_and_insert(
+        self, timestamp: int, nonce: str, now: Optional[float] = None
+    ) -> bool:
+        if now is None:
+            now = time.time()
+        try:
+            with self._lock:
+                if now >= self._next_cleanup:
+                    self._next_cleanup = now + self.cleanup_interval
+                    self._connection.execute(
+                        "DELETE FROM nonces WHERE expires_at <= ?", (now,)
+                    )
+                cursor = self._connection.execute(
+                    "INSERT INTO nonces (nonce, expires_at) VALUES (?, ?) "
+                    "ON CONFLICT (nonce) DO UPDATE SET expires_at = excluded.expires_at "
+                    "WHERE nonces.expires_at <= ?",
+                    (f"{timestamp}:{nonce}", timestamp + self.window, now),
+                )
+        except sqlite3.Error as e:
+            raise ReplayStoreError(f"Unable to check oauth_nonce: {e}")
+        return cursor.rowcount == 1
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        self._connection.close()
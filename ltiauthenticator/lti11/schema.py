@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, NamedTuple, Optional
+
+from .constants import LTI11_LAUNCH_PARAMS_REQUIRED, LTI11_OAUTH_ARGS
+
+
+class SchemaResult(NamedTuple):
+    """
+    Outcome of the validation of LTI 1.1 launch arguments against a `LaunchArgsSchema`.
+
+    Attributes:
+      missing_oauth: required oauth_* arguments not included in the request
+      empty_oauth: required oauth_* arguments without a value
+      missing: other required arguments not included in the request
+      empty: other required arguments without a value
+      timestamp: the parsed oauth_timestamp, or None if it is missing or invalid
+      timestamp_error: reason why oauth_timestamp is invalid, if it is
+    """
+
+    missing_oauth: tuple[str, ...]
+    empty_oauth: tuple[str, ...]
+    missing: tuple[str, ...]
+    empty: tuple[str, ...]
+    timestamp: Optional[int]
+    timestamp_error: Optional[str]
+
+    @property
+    def is_valid(self) -> bool:
+        return not (
+            self.missing_oauth
+            or self.empty_oauth
+            or self.missing
+            or self.empty
+            or self.timestamp_error
+        )
+
+
+class LaunchArgsSchema:
+    """
+    Required arguments of an LTI 1.1 launch request, compiled once.
+
+    Checks the presence and value of every required argument and the format of
+    oauth_timestamp in a single pass over the schema. It does not verify the
+    signature, nonce or consumer key, so it can also be used to check recorded
+    launches offline.
+
+    Args:
+      oauth_args: required oauth_* arguments
+      required_args: required LTI 1.1 arguments. oauth_args contained in them are
+        only checked once.
+    """
+
+    def __init__(self, oauth_args: Iterable[str], required_args: Iterable[str]):
+        self.oauth_args = frozenset(oauth_args)
+        self.required_args = frozenset(required_args) | self.oauth_args
+        # arguments in the order in which they are reported
+        self._fields = tuple(
+            (name, name in self.oauth_args)
+            for name in dict.fromkeys([*oauth_args, *required_args])
+        )
+
+    def validate(self, args: dict[str, Any]) -> SchemaResult:
+        """Validate the arguments of a launch request."""
+        missing_oauth, empty_oauth, missing, empty = [], [], [], []
+        for name, is_oauth in self._fields:
+            if name not in args:
+                (missing_oauth if is_oauth else missing).append(name)
+            elif not args[name]:
+                (empty_oauth if is_oauth else empty).append(name)
+
+        timestamp = None
+        timestamp_error = None
+        if args.get("oauth_timestamp"):
+            # Inspiration to validate nonces/timestamps from OAuthlib
+            # https://github.com/oauthlib/oauthlib/blob/HEAD/oauthlib/oauth1/rfc5849/endpoints/base.py#L147
+            try:
+                timestamp = int(args["oauth_timestamp"])
+            except ValueError:
+                timestamp_error = "Timestamp must be an integer."
+            else:
+                if len(str(timestamp)) != 10:
+                    timestamp, timestamp_error = None, "Invalid timestamp format."
+
+        return SchemaResult(
+            tuple(missing_oauth),
+            tuple(empty_oauth),
+            tuple(missing),
+            tuple(empty),
+            timestamp,
+            timestamp_error,
+        )
+
+
+LTI11_LAUNCH_ARGS_SCHEMA = LaunchArgsSchema(
+    LTI11_OAUTH_ARGS, LTI11_LAUNCH_PARAMS_REQUIRED
+)
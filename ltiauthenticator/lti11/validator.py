@@ -1,15 +1,20 @@
 from __future__ import annotations
 
 import time
-from typing import Any
+from typing import Any, Optional
 
-from cachetools import TTLCache
 from oauthlib.common import safe_string_equals  # type: ignore
-from oauthlib.oauth1.rfc5849 import Client, signature  # type: ignore
 from tornado.web import HTTPError
 from traitlets.config import LoggingConfigurable
 
-from .constants import LTI11_LAUNCH_PARAMS_REQUIRED, LTI11_OAUTH_ARGS
+from .replay import (
+    MemoryReplayStore,
+    ReplayStore,
+    ReplayStoreError,
+    ReplayStoreFull,
+)
+from .schema import LTI11_LAUNCH_ARGS_SCHEMA
+from .signer import HMACSHA1Signer
 
 
 class LTI11LaunchValidator(LoggingConfigurable):
@@ -29,15 +34,19 @@ class LTI11LaunchValidator(LoggingConfigurable):
       consumers: consumer key and shared secret key/value pair(s)
     """
 
-    # Keep a class-wide, global list of nonces so we can detect & reject
-    # replay attacks. This possibly makes this non-threadsafe, however.
-    # The key is an integer timestamp, and value is set of nonces issued at that
-    # timestamp. Since we only accept keys for the last 30s, we set maxsize to 35
-    # and the TTL cache to expire after 35s (to give us some grace time).
-    nonces: TTLCache[int, set] = TTLCache(35, 35.0)
+    # Keep a class-wide, global store of nonces so we can detect & reject
+    # replay attacks if no replay store is given.
+    nonces = MemoryReplayStore()
 
-    def __init__(self, consumers):
+    def __init__(
+        self,
+        consumers,
+        replay_store: Optional[ReplayStore] = None,
+        signer: Optional[HMACSHA1Signer] = None,
+    ):
         self.consumers = consumers
+        self.replay_store = replay_store or LTI11LaunchValidator.nonces
+        self.signer = signer or HMACSHA1Signer(consumers)
 
     def validate_launch_request(
         self,
@@ -62,16 +71,18 @@ class LTI11LaunchValidator(LoggingConfigurable):
         Raises:
           HTTPError if a required argument is not inclued in the POST request.
         """
+        result = LTI11_LAUNCH_ARGS_SCHEMA.validate(args)
+
         # Ensure that required oauth_* body arguments are included in the request
-        for param in LTI11_OAUTH_ARGS:
-            if param not in args.keys():
-                raise HTTPError(
-                    400, f"Required oauth arg {param} not included in request"
-                )
-            if not args.get(param):
-                raise HTTPError(
-                    400, f"Required oauth arg {param} does not have a value"
-                )
+        if result.missing_oauth:
+            raise HTTPError(
+                400,
+                f"Required oauth arg {result.missing_oauth[0]} not included in request",
+            )
+        if result.empty_oauth:
+            raise HTTPError(
+                400, f"Required oauth arg {result.empty_oauth[0]} does not have a value"
+            )
 
         # Ensure that consumer key is registered in in jupyterhub_config.py
         # LTI11Authenticator.consumers defined in parent class
@@ -79,60 +90,43 @@ class LTI11LaunchValidator(LoggingConfigurable):
             raise HTTPError(401, "unknown oauth_consumer_key")
 
         # Ensure that required LTI 1.1 body arguments are included in the request
-        for param in LTI11_LAUNCH_PARAMS_REQUIRED:
-            if param not in args.keys():
-                raise HTTPError(
-                    400, f"Required LTI 1.1 arg arg {param} not included in request"
-                )
-            if not args.get(param):
-                raise HTTPError(
-                    400, f"Required LTI 1.1 arg {param} does not have a value"
-                )
-
-        # Inspiration to validate nonces/timestamps from OAuthlib
-        # https://github.com/oauthlib/oauthlib/blob/HEAD/oauthlib/oauth1/rfc5849/endpoints/base.py#L147
-        if len(str(int(args["oauth_timestamp"]))) != 10:
-            raise HTTPError(401, "Invalid timestamp format.")
-        try:
-            ts = int(args["oauth_timestamp"])
-        except ValueError:
-            raise HTTPError(401, "Timestamp must be an integer.")
-        else:
-            # Reject timestamps that are older than 30 seconds
-            if abs(time.time() - ts) > 30:
-                raise HTTPError(
-                    401,
-                    "Timestamp given is invalid, differ from "
-                    f"allowed by over {int(time.time() - ts)} seconds.",
-                )
-            if (
-                ts in LTI11LaunchValidator.nonces
-                and args["oauth_nonce"] in LTI11LaunchValidator.nonces[ts]
-            ):
-                raise HTTPError(401, "oauth_nonce + oauth_timestamp already used")
-            LTI11LaunchValidator.nonces.setdefault(ts, set()).add(args["oauth_nonce"])
-
-        # convert arguments dict back to a list of tuples for signature
-        args_list = [(k, v) for k, v in args.items()]
-
-        base_string = signature.signature_base_string(
-            "POST",
-            signature.base_string_uri(launch_url),
-            signature.normalize_parameters(
-                signature.collect_parameters(body=args_list, headers=headers)
-            ),
-        )
-        consumer_secret = self.consumers[args["oauth_consumer_key"]]
-        sign = signature.sign_hmac_sha1_with_client(
-            base_string,
-            Client(
-                client_key=args["oauth_consumer_key"], client_secret=consumer_secret
-            ),
-        )
+        if result.missing:
+            raise HTTPError(
+                400,
+                f"Required LTI 1.1 arg arg {result.missing[0]} not included in request",
+            )
+        if result.empty:
+            raise HTTPError(
+                400, f"Required LTI 1.1 arg {result.empty[0]} does not have a value"
+            )
+
+        if result.timestamp_error:
+            raise HTTPError(401, result.timestamp_error)
+        ts = result.timestamp
+
+        # Reject timestamps outside of the window in which nonces are remembered
+        now = time.time()
+        if abs(now - ts) > self.replay_store.window:
+            raise HTTPError(
+                401,
+                "Timestamp given is invalid, differ from "
+                f"allowed by over {int(now - ts)} seconds.",
+            )
+        sign = self.signer.sign(args["oauth_consumer_key"], launch_url, headers, args)
         is_valid = safe_string_equals(sign, args["oauth_signature"])
         self.log.debug(f"signature in request: {args['oauth_signature']}")
         self.log.debug(f"calculated signature: {sign}")
         if not is_valid:
             raise HTTPError(401, "Invalid oauth_signature")
 
+        # only validly signed requests use up a nonce
+        try:
+            is_new = self.replay_store.check_and_insert(ts, args["oauth_nonce"], now)
+        except ReplayStoreFull as e:
+            raise HTTPError(429, str(e))
+        except ReplayStoreError as e:
+            raise HTTPError(503, str(e))
+        if not is_new:
+            raise HTTPError(401, "oauth_nonce + oauth_timestamp already used")
+
         return True
@@ -1,19 +1,30 @@
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from jupyterhub.app import JupyterHub  # type: ignore
 from jupyterhub.auth import Authenticator  # type: ignore
 from jupyterhub.handlers import BaseHandler  # type: ignore
 from jupyterhub.utils import url_path_join  # type: ignore
-from traitlets import CaselessStrEnum
+from traitlets import Bool, CaselessStrEnum, Float, Instance, Int
 from traitlets import List as TraitletsList
 from traitlets import Set as TraitletsSet
-from traitlets import Unicode
-
-from ..utils import get_browser_protocol
-from .constants import LTI13_CUSTOM_CLAIM
+from traitlets import Type, Unicode, default, observe
+
+from ..utils import (
+    AuthStateDigests,
+    LaunchCache,
+    ResponseCache,
+    digest_auth_state,
+    get_browser_protocol,
+)
+from .constants import LTI13_CUSTOM_CLAIM, LTI13_VOLATILE_CLAIMS
 from .error import LoginError
+from .executor import BoundedExecutor
 from .handlers import LTI13CallbackHandler, LTI13ConfigHandler, LTI13LoginInitHandler
+from .jwks import JWKSCache
+from .replay import IdTokenReplayCache
+from .state import StateStore
+from .validator import LTI13LaunchValidator
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -149,6 +160,221 @@ class LTI13Authenticator(Authenticator):
         """,
     )
 
+    compact_state_cookie = Bool(
+        False,
+        config=True,
+        help="""
+        Keep the state id, nonce and next_url of the OIDC login in a single compact
+        cookie instead of separate state and nonce cookies. Halves the cookies set
+        and verified per launch. The OAuth state sent to the platform is then a short
+        id instead of the serialized next_url.
+        """,
+    )
+
+    state_cookie_max_size = Int(
+        2048,
+        config=True,
+        help="""
+        Maximum size in bytes of the encoded state if `compact_state_cookie` is enabled.
+        If the next_url of a launch does not fit, it is dropped and the user is sent to
+        the default URL after the launch.
+        """,
+    )
+
+    state_store_class = Type(
+        None,
+        klass=StateStore,
+        allow_none=True,
+        config=True,
+        help="""
+        Class of a server-side store of the state id, nonce and next_url of OIDC logins,
+        e.g. `ltiauthenticator.lti13.state.MemoryStateStore` or
+        `ltiauthenticator.lti13.state.SQLiteStateStore`. If set, no state cookies are
+        used, so that launches also succeed in LMS iframes where browsers block
+        third-party cookies. The login is then not bound to the browser that initiated
+        it.
+        """,
+    )
+
+    state_store = Instance(
+        StateStore,
+        allow_none=True,
+        help="""
+        Server-side store of login states, an instance of `state_store_class`.
+        """,
+    )
+
+    @default("state_store")
+    def _default_state_store(self) -> Optional[StateStore]:
+        if self.state_store_class is None:
+            return None
+        return self.state_store_class(parent=self)
+
+    duplicate_launch_ttl = Float(
+        10,
+        config=True,
+        help="""
+        Time in seconds during which a duplicate of a successful launch, e.g. from a
+        double click or a reloaded iframe, is redirected like the original launch
+        without logging the user in again, if the browser is logged in as the same
+        user. Set to 0 to handle every launch in full.
+        """,
+    )
+
+    launch_cache = Instance(
+        LaunchCache,
+        help="""
+        Recent successful launches, keyed by the digest of the launch request.
+        """,
+    )
+
+    @default("launch_cache")
+    def _default_launch_cache(self) -> LaunchCache:
+        return LaunchCache(self.duplicate_launch_ttl)
+
+    @observe("duplicate_launch_ttl")
+    def _update_launch_cache_ttl(self, change) -> None:
+        self.launch_cache.ttl = change.new
+
+    auth_state_digest_cache_size = Int(
+        10000,
+        config=True,
+        help="""
+        Number of users for whom the digest of the auth_state saved at their last login
+        is kept. A login with an unchanged auth_state, apart from claims that
+        change with every launch such as `nonce` and `iat`, does not save it
+        again. Set to 0 to save the auth_state at every login.
+        """,
+    )
+
+    auth_state_digests = Instance(
+        AuthStateDigests,
+        help="""
+        Digests of the auth_state last saved for each user.
+        """,
+    )
+
+    @default("auth_state_digests")
+    def _default_auth_state_digests(self) -> AuthStateDigests:
+        return AuthStateDigests(self.auth_state_digest_cache_size)
+
+    @observe("auth_state_digest_cache_size")
+    def _update_auth_state_digests_size(self, change) -> None:
+        self.auth_state_digests.max_size = change.new
+
+    config_cache_max_age = Int(
+        300,
+        config=True,
+        help="""
+        Time in seconds that clients may cache the LTI 1.3 JSON config. Clients can
+        revalidate it afterwards with its ETag. Set to 0 to require revalidation on
+        every request.
+        """,
+    )
+
+    config_cache = Instance(
+        ResponseCache,
+        help="""
+        Serialized LTI 1.3 JSON configs, keyed by the scheme, host and hub base URL of
+        the requests they were rendered for.
+        """,
+    )
+
+    @default("config_cache")
+    def _default_config_cache(self) -> ResponseCache:
+        return ResponseCache()
+
+    @observe("tool_name", "tool_description")
+    def _clear_config_cache(self, change) -> None:
+        self.config_cache.clear()
+
+    jwks_cache = Instance(
+        JWKSCache,
+        help="""
+        Process-wide cache of the platform's signing keys. It is configured via the
+        `JWKSCache` class.
+        """,
+    )
+
+    @default("jwks_cache")
+    def _default_jwks_cache(self) -> JWKSCache:
+        return JWKSCache(parent=self)
+
+    replay_cache = Instance(
+        IdTokenReplayCache,
+        help="""
+        Consumed id_tokens, kept when the validator is recreated after a configuration
+        change. Its limits are configured via `LTI13LaunchValidator.max_age`,
+        `LTI13LaunchValidator.time_leeway` and `LTI13LaunchValidator.replay_cache_size`.
+        """,
+    )
+
+    @default("replay_cache")
+    def _default_replay_cache(self) -> IdTokenReplayCache:
+        return self.get_validator().replay_cache
+
+    verify_in_executor = Bool(
+        False,
+        config=True,
+        help="""
+        Verify the signature of id_tokens in a thread pool instead of on the hub's event
+        loop. Reduces the latency of the hub when many launches arrive at the same time.
+        """,
+    )
+
+    verify_executor_workers = Int(
+        4,
+        config=True,
+        help="""
+        Number of threads verifying id_token signatures if `verify_in_executor` is enabled.
+        """,
+    )
+
+    verify_executor_queue_depth = Int(
+        64,
+        config=True,
+        help="""
+        Maximum number of id_tokens waiting for a thread if `verify_in_executor` is enabled.
+        Further id_tokens are verified on the event loop.
+        """,
+    )
+
+    verify_executor = Instance(
+        BoundedExecutor,
+        allow_none=True,
+        help="""
+        Thread pool verifying id_token signatures, or None if `verify_in_executor` is
+        disabled.
+        """,
+    )
+
+    @default("verify_executor")
+    def _default_verify_executor(self) -> Optional[BoundedExecutor]:
+        if not self.verify_in_executor:
+            return None
+        return BoundedExecutor(
+            self.verify_executor_workers, self.verify_executor_queue_depth
+        )
+
+    _validator: Optional[LTI13LaunchValidator] = None
+
+    @observe("config")
+    def _reset_validator(self, change) -> None:
+        self._validator = None
+
+    def get_validator(self) -> LTI13LaunchValidator:
+        """
+        Return the validator of launch requests. It is created once and reused until
+        the configuration changes.
+        """
+        if self._validator is None:
+            self._validator = LTI13LaunchValidator(parent=self)
+            if self.trait_has_value("replay_cache"):
+                # keep the consumed id_tokens, only the limits follow the configuration
+                self.replay_cache.ttl = self._validator.replay_cache_ttl
+                self.replay_cache.max_size = self._validator.replay_cache_size
+        return self._validator
+
     def login_url(self, base_url):
         return url_path_join(base_url, "lti13", "oauth_login")
 
@@ -159,6 +385,8 @@ class LTI13Authenticator(Authenticator):
         return url_path_join(base_url, "lti13", "config")
 
     def get_handlers(self, app: JupyterHub) -> List[BaseHandler]:
+        # warm up the key cache so that the first launch does not have to wait for it
+        self.jwks_cache.start_background_refresh(self.jwks_endpoint)
         return [
             (self.login_url(""), self.login_handler),
             (self.callback_url(""), self.callback_handler),
@@ -188,6 +416,13 @@ class LTI13Authenticator(Authenticator):
             "auth_state": data,
         }
 
+    def digest_auth_state(self, auth_state: Any) -> str:
+        """
+        Return a stable digest of an auth_state returned by `authenticate`, leaving
+        out the claims of the id_token that change with every launch.
+        """
+        return digest_auth_state(auth_state, LTI13_VOLATILE_CLAIMS)
+
     def get_username(self, token: Dict[str, Any]) -> str:
         """
         Infer the username from the ID token.
@@ -4,6 +4,10 @@
 from typing import Any, Dict
 
 LTI13_CUSTOM_CLAIM = "https://purl.imsglobal.org/spec/lti/claim/custom"
+LTI13_MESSAGE_TYPE_CLAIM = "https://purl.imsglobal.org/spec/lti/claim/message_type"
+
+# id_token claims that change with every launch
+LTI13_VOLATILE_CLAIMS = {"exp", "iat", "jti", "nbf", "nonce"}
 
 LTI13_INIT_LOGIN_REQUEST_ARGS = [
     "iss",
@@ -23,12 +23,26 @@ class TokenError(ValidationError):
     pass
 
 
+class ReplayedTokenError(TokenError):
+    """Exception raised for an id_token that has already been used."""
+
+    pass
+
+
 class InvalidAudienceError(ValidationError):
     """Exception raised for invalid audience."""
 
     pass
 
 
+class ClaimsValidationError(ValidationError):
+    """Exception raised for an id_token with several invalid claims."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(str(e) for e in errors))
+        self.errors = errors
+
+
 class LoginError(Exception):
     """Lookup of username in ID token failed"""
 
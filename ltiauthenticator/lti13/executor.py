@@ -0,0 +1,36 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class BoundedExecutor:
+    """
+    Thread pool running CPU-bound work, such as the verification of id_token
+    signatures, outside of the event loop.
+
+    At most `max_workers + queue_depth` calls are pending at any time. Further calls
+    are run inline, so that a burst of launches cannot build up an unbounded backlog.
+    """
+
+    def __init__(self, max_workers: int, queue_depth: int):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ltiauthenticator"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + queue_depth)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `func` in the pool, or inline if the pool is saturated."""
+        if not self._slots.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        """Stop the worker threads once the pending calls are done."""
+        self._executor.shutdown(wait=False)
@@ -3,7 +3,7 @@ import hashlib
 import json
 import re
 import uuid
-from typing import Any, Dict, Optional, cast
+from typing import Any, Dict, Optional, Tuple, cast
 from urllib.parse import quote, unquote, urlparse
 
 from jupyterhub.handlers import BaseHandler  # type: ignore
@@ -13,12 +13,22 @@ from tornado.httputil import url_concat
 from tornado.log import app_log
 from tornado.web import HTTPError, MissingArgumentError, RequestHandler
 
-from ..utils import convert_request_to_dict
+from ..utils import (
+    AuthStateDigestMixin,
+    CoalescedLoginMixin,
+    call_store,
+    convert_request_to_dict,
+    digest_launch_request,
+    redirect_duplicate_launch,
+    write_cached_response,
+)
 from .error import InvalidAudienceError, LoginError, ValidationError
-from .validator import LTI13LaunchValidator
+from .replay import ReplayCacheFull
+from .state import LaunchState, StateStoreError
 
 STATE_COOKIE_NAME = "lti13authenticator-state"
 NONCE_STATE_COOKIE_NAME = "lti13authenticator-nonce-state"
+LAUNCH_STATE_COOKIE_NAME = "lti13authenticator-launch-state"
 
 
 def make_nonce_state() -> str:
@@ -79,11 +89,22 @@ class LTI13ConfigHandler(BaseHandler):
         - Usernames are obtained by first attempting to get and normalize values sent when
         tools are installed with public settings. If private, the username is set using the
         anonumized user data when requests are sent with private installation settings.
+
+        The serialized config is cached per scheme, host and hub base URL and served
+        with an ETag, so that repeated requests are answered with 304 Not Modified.
         """
         self.set_header("Content-Type", "application/json")
 
         # get the origin protocol
         protocol = self.authenticator.get_uri_scheme(self.request)
+        base_url = self.hub.server.base_url
+        response = self.authenticator.config_cache.get(
+            (protocol, self.request.host, base_url),
+            lambda: self._render_config(protocol, base_url),
+        )
+        write_cached_response(self, response, self.authenticator.config_cache_max_age)
+
+    def _render_config(self, protocol: str, base_url: str) -> str:
         self.log.debug(f"Origin protocol is: {protocol}")
         # build the full target link url value required for the jwks endpoint
         target_link_url = f"{protocol}://{self.request.host}"
@@ -139,10 +160,10 @@ class LTI13ConfigHandler(BaseHandler):
             },
             "target_link_uri": target_link_url,
             "oidc_initiation_url": self.authenticator.login_url(
-                url_path_join(target_link_url, self.hub.server.base_url)
+                url_path_join(target_link_url, base_url)
             ),
         }
-        self.write(json.dumps(keys))
+        return json.dumps(keys)
 
 
 class LTI13LoginInitHandler(BaseHandler):
@@ -215,6 +236,14 @@ class LTI13LoginInitHandler(BaseHandler):
         handler.redirect(url_concat(url, args))
 
     def get_state(self):
+        if self._state is None:
+            self._state = _serialize_state(
+                {"state_id": uuid.uuid4().hex, "next_url": self._get_login_next_url()}
+            )
+        return self._state
+
+    def _get_login_next_url(self) -> Optional[str]:
+        """Get the URL to redirect to after the launch from the login request."""
         next_url = original_next_url = self.get_argument("next", None)
         if not next_url:
             # try with the target_link_uri arg
@@ -243,18 +272,14 @@ class LTI13LoginInitHandler(BaseHandler):
                 self.log.warning(
                     "Ignoring next_url %r, using %r", original_next_url, next_url
                 )
-        if self._state is None:
-            self._state = _serialize_state(
-                {"state_id": uuid.uuid4().hex, "next_url": next_url}
-            )
-        return self._state
+        return next_url
 
-    def post(self):
+    async def post(self):
         """
         Validates required login arguments sent from platform and then uses the authorize_redirect() method
         to redirect users to the authorization url.
         """
-        validator = LTI13LaunchValidator(parent=self.app)
+        validator = self.authenticator.get_validator()
         args = convert_request_to_dict(self.request.arguments)
         self.log.debug(f"Initial login request args are {args}")
 
@@ -278,11 +303,16 @@ class LTI13LoginInitHandler(BaseHandler):
         redirect_uri = self.get_redirect_uri()
         self.log.debug(f"redirect_uri is: {redirect_uri}")
 
-        # to prevent CSRF
-        state = self.generate_state()
+        if self.authenticator.state_store is not None:
+            state, nonce = await self.store_launch_state()
+        elif self.authenticator.compact_state_cookie:
+            state, nonce = self.generate_launch_state()
+        else:
+            # to prevent CSRF
+            state = self.generate_state()
 
-        # to prevent replay attacks
-        nonce = self.generate_nonce()
+            # to prevent replay attacks
+            nonce = self.generate_nonce()
         self.log.debug(f"nonce value: {nonce}")
 
         self.authorize_redirect(
@@ -316,6 +346,39 @@ class LTI13LoginInitHandler(BaseHandler):
         nonce = get_nonce(nonce_state)
         return nonce
 
+    async def store_launch_state(self) -> Tuple[str, str]:
+        """Produce a state and a nonce kept in the authenticator's state store.
+
+        Returns:
+          The OAuth state and the nonce.
+        """
+        launch_state = LaunchState.create(self._get_login_next_url())
+        state_store = self.authenticator.state_store
+        try:
+            await call_store(state_store, state_store.put, launch_state)
+        except StateStoreError as e:
+            self.log.error(str(e))
+            raise HTTPError(503, "Unable to store OAuth state")
+        return launch_state.state, get_nonce(launch_state.nonce_state)
+
+    def generate_launch_state(self) -> Tuple[str, str]:
+        """Produce a state and a nonce kept in a single compact cookie.
+
+        Returns:
+          The OAuth state and the nonce.
+        """
+        launch_state = LaunchState.create(self._get_login_next_url())
+        encoded = launch_state.encode()
+        if len(encoded) > self.authenticator.state_cookie_max_size:
+            self.log.warning(
+                f"Ignoring next_url {launch_state.next_url!r}, "
+                "it does not fit into the state cookie"
+            )
+            launch_state = launch_state._replace(next_url=None)
+            encoded = launch_state.encode()
+        self._set_oauth_cookie(LAUNCH_STATE_COOKIE_NAME, encoded)
+        return launch_state.state, get_nonce(launch_state.nonce_state)
+
     def get_redirect_uri(self) -> str:
         """Create uri to redirect user agent to after successful authorization by the LMS platform."""
         return "{proto}://{host}{path}".format(
@@ -351,7 +414,7 @@ class LTI13LoginInitHandler(BaseHandler):
         )
 
 
-class LTI13CallbackHandler(BaseHandler):
+class LTI13CallbackHandler(CoalescedLoginMixin, AuthStateDigestMixin, BaseHandler):
     """
     Handles JupyterHub authentication requests responses according to the
     LTI 1.3 standard.
@@ -363,6 +426,7 @@ class LTI13CallbackHandler(BaseHandler):
 
     _state_cookie = None
     _nonce_state_cookie = None
+    _launch_state = None
 
     def check_xsrf_cookie(self):
         """
@@ -378,13 +442,23 @@ class LTI13CallbackHandler(BaseHandler):
     async def post(self):
         """
         Overrides the upstream post handler.
+
+        Duplicates of a successful launch are redirected like the original launch
+        without validating them and logging the user in again.
         """
+        launch_digest = digest_launch_request(self.request.arguments)
+        if await redirect_duplicate_launch(self, launch_digest):
+            return
+
         try:
-            id_token = self.decode_and_validate_launch_request()
+            id_token = await self.decode_and_validate_launch_request()
         except InvalidAudienceError as e:
             raise HTTPError(401, str(e))
         except ValidationError as e:
             raise HTTPError(400, str(e))
+        except ReplayCacheFull as e:
+            self.log.warning(str(e))
+            raise HTTPError(429, "Too many launch requests")
 
         try:
             user = await self.login_user(id_token)
@@ -393,15 +467,21 @@ class LTI13CallbackHandler(BaseHandler):
         self.log.debug(f"user logged in: {user}")
         if user is None:
             raise HTTPError(403, "User missing or null")
-        await self.redirect_to_next_url(user)
+        next_url = await self.redirect_to_next_url(user)
+        self.authenticator.launch_cache.put(launch_digest, user.name, next_url)
 
-    async def redirect_to_next_url(self, user):
-        """Redirect user agent to next url that has been received in the login initiation request."""
+    async def redirect_to_next_url(self, user) -> str:
+        """Redirect user agent to next url that has been received in the login initiation request.
+
+        Returns:
+          The next url.
+        """
         next_url = self.get_next_url(user)
         self.redirect(next_url)
         self.log.debug(f"Redirecting user {user.id} to {next_url}")
+        return next_url
 
-    def decode_and_validate_launch_request(self) -> Dict[str, Any]:
+    async def decode_and_validate_launch_request(self) -> Dict[str, Any]:
         """Decrypt, verify and validate launch request parameters.
 
         Raises subclasses of `ValidationError` of `HTTPError` if anything fails.
@@ -410,7 +490,7 @@ class LTI13CallbackHandler(BaseHandler):
         https://openid.net/specs/openid-connect-core-1_0.html#IDToken
         https://openid.net/specs/openid-connect-core-1_0.html#ImplicitIDTValidation
         """
-        validator = LTI13LaunchValidator(parent=self.app)
+        validator = self.authenticator.get_validator()
 
         args = convert_request_to_dict(self.request.arguments)
         self.log.debug(f"Initial launch request args are {args}")
@@ -419,14 +499,18 @@ class LTI13CallbackHandler(BaseHandler):
 
         # Check is state is the same as in the authorization request issued
         # constructed in `LTI13LoginInitHandler.post`, prevents CSRF
+        await self.load_launch_state()
         self.check_state()
 
-        id_token = validator.verify_and_decode_jwt(
+        id_token = await validator.verify_and_decode_jwt(
             encoded_jwt=args.get("id_token"),
             issuer=self.authenticator.issuer,
             audience=self.authenticator.client_id,
             jwks_endpoint=self.authenticator.jwks_endpoint,
             jwks_algorithms=self.authenticator.jwks_algorithms,
+            jwks_cache=self.authenticator.jwks_cache,
+            executor=self.authenticator.verify_executor,
+            replay_cache=self.authenticator.replay_cache,
         )
         validator.validate_id_token(id_token)
         validator.validate_azp_claim(id_token, self.authenticator.client_id)
@@ -449,6 +533,8 @@ class LTI13CallbackHandler(BaseHandler):
         """
         cookie_state = self._get_state_cookie()
         if not cookie_state:
+            if self.authenticator.state_store is not None:
+                raise HTTPError(400, "OAuth state unknown or expired")
             raise HTTPError(400, "OAuth state missing from cookies")
         url_state = self._get_state_from_url()
         if cookie_state != url_state:
@@ -471,8 +557,12 @@ class LTI13CallbackHandler(BaseHandler):
 
     def get_next_url(self, user=None):
         """Get the redirect target from the state field"""
-        state = self._get_state_from_url()
-        next_url = _deserialize_state(state).get("next_url")
+        if self._uses_launch_state():
+            launch_state = self._get_launch_state()
+            next_url = launch_state.next_url if launch_state else None
+        else:
+            state = self._get_state_from_url()
+            next_url = _deserialize_state(state).get("next_url")
         if next_url:
             return next_url
         # JupyterHub 0.8 adds default .get_next_url for a fallback
@@ -493,6 +583,9 @@ class LTI13CallbackHandler(BaseHandler):
 
         To be compared with the value in id_token
         """
+        if self._uses_launch_state():
+            launch_state = self._get_launch_state()
+            return launch_state.nonce_state if launch_state else ""
         if self._nonce_state_cookie is None:
             self._nonce_state_cookie = self._get_oauth_cookie(NONCE_STATE_COOKIE_NAME)
         return self._nonce_state_cookie
@@ -502,10 +595,67 @@ class LTI13CallbackHandler(BaseHandler):
 
         To be compared with the value in redirect URL
         """
+        if self._uses_launch_state():
+            launch_state = self._get_launch_state()
+            return launch_state.state if launch_state else ""
         if self._state_cookie is None:
             self._state_cookie = self._get_oauth_cookie(STATE_COOKIE_NAME)
         return self._state_cookie
 
+    def _uses_launch_state(self) -> bool:
+        return (
+            self.authenticator.state_store is not None
+            or self.authenticator.compact_state_cookie
+        )
+
+    def _get_launch_state(self) -> Optional[LaunchState]:
+        """Get the OAuth state, nonce state and next_url
+
+        They are taken from the authenticator's state store if there is one, or from
+        the compact state cookie otherwise.
+        """
+        if self._launch_state is None:
+            self._launch_state = (
+                self._pop_stored_launch_state(self._get_state_from_url())
+                if self.authenticator.state_store is not None
+                else self._get_launch_state_cookie()
+            ) or False
+        return self._launch_state or None
+
+    async def load_launch_state(self) -> None:
+        """Look up the launch state in the authenticator's state store, if there is one.
+
+        The lookup runs in a thread if the store may block, otherwise the launch state
+        is looked up when it is first needed.
+        """
+        state_store = self.authenticator.state_store
+        if state_store is not None and self._launch_state is None:
+            self._launch_state = (
+                await call_store(
+                    state_store,
+                    self._pop_stored_launch_state,
+                    self._get_state_from_url(),
+                )
+                or False
+            )
+
+    def _pop_stored_launch_state(self, state: str) -> Optional[LaunchState]:
+        try:
+            return self.authenticator.state_store.pop(state)
+        except StateStoreError as e:
+            self.log.error(str(e))
+            raise HTTPError(503, "Unable to look up OAuth state")
+
+    def _get_launch_state_cookie(self) -> Optional[LaunchState]:
+        encoded = self._get_oauth_cookie(LAUNCH_STATE_COOKIE_NAME)
+        if not encoded:
+            return None
+        try:
+            return LaunchState.decode(encoded)
+        except ValueError as e:
+            self.log.warning(f"Invalid launch state cookie: {e}")
+            return None
+
     def _get_oauth_cookie(self, name: str):
         """Get OAuth state cookie."""
         cookie = (self.get_secure_cookie(name) or b"").decode("utf8", "replace")
@@ -0,0 +1,80 @@
+import base64
+import binascii
+import json
+from typing import Any, Dict
+
+import jwt
+
+from .error import TokenError
+
+
+def _decode_segment(segment: bytes, name: str) -> bytes:
+    segment = segment.rstrip(b"=")
+    try:
+        return base64.b64decode(
+            segment + b"=" * (-len(segment) % 4), altchars=b"-_", validate=True
+        )
+    except (binascii.Error, ValueError):
+        raise TokenError(f"Invalid {name} padding")
+
+
+def _decode_json_segment(segment: bytes, name: str) -> Dict[str, Any]:
+    try:
+        data = json.loads(_decode_segment(segment, name))
+    except (ValueError, RecursionError) as e:
+        raise TokenError(f"Invalid {name} string: {e}")
+    if not isinstance(data, dict):
+        raise TokenError(f"Invalid {name} string: must be a json object")
+    return data
+
+
+class EncodedIdToken:
+    """
+    An id_token in JWS compact serialization, parsed once.
+
+    The header and the claims are decoded on construction, so that they can be
+    checked before the comparatively expensive signature verification.
+
+    Raises:
+      TokenError if the token is malformed.
+    """
+
+    def __init__(self, encoded_jwt):
+        if isinstance(encoded_jwt, str):
+            encoded_jwt = encoded_jwt.encode("utf-8")
+        if not isinstance(encoded_jwt, bytes):
+            raise TokenError("Invalid token type. Token must be a <class 'bytes'>")
+        try:
+            self.signing_input, crypto_segment = encoded_jwt.rsplit(b".", 1)
+            header_segment, payload_segment = self.signing_input.split(b".", 1)
+        except ValueError:
+            raise TokenError("Not enough segments")
+
+        self.header = _decode_json_segment(header_segment, "header")
+        if not isinstance(self.header.get("kid", ""), str):
+            raise TokenError("Key ID header parameter must be a string")
+        self.claims = _decode_json_segment(payload_segment, "payload")
+        self.signature = _decode_segment(crypto_segment, "crypto")
+
+    @property
+    def alg(self) -> Any:
+        return self.header.get("alg")
+
+    @property
+    def kid(self) -> Any:
+        return self.header.get("kid")
+
+    def verify_signature(self, key: Any) -> None:
+        """
+        Verify the signature with the public `key` and the algorithm declared in the
+        header, which must have been checked against the allowed algorithms before.
+
+        Raises:
+          TokenError if the signature is invalid.
+        """
+        try:
+            algorithm = jwt.get_algorithm_by_name(self.alg)
+        except NotImplementedError:
+            raise TokenError("Algorithm not supported")
+        if not algorithm.verify(self.signing_input, key, self.signature):
+            raise TokenError("Signature verification failed")
@@ -0,0 +1,672 @@
+"""Caching of the JSON Web Key Sets (JWKS) published by LTI 1.3 platforms."""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import jwt
+from cachetools import LRUCache, TTLCache
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from traitlets import Bool, Float, Int, Unicode
+from traitlets.config import LoggingConfigurable
+
+from .error import TokenError
+
+_MAX_AGE_DIRECTIVE = re.compile(r"^(?:s-)?max-age\s*=\s*\"?(\d+)\"?$", re.IGNORECASE)
+
+
+def get_cache_lifetime(headers: Mapping[str, str]) -> Optional[int]:
+    """
+    Derive the lifetime in seconds of a JWKS response from its HTTP caching headers.
+
+    `Cache-Control` takes precedence over `Expires`, as mandated by RFC 9111.
+
+    Args:
+      headers: the HTTP response headers
+
+    Returns:
+      Lifetime in seconds or None if the response does not carry any caching hint.
+    """
+    cache_control = headers.get("Cache-Control")
+    if cache_control:
+        directives = [d.strip() for d in cache_control.split(",")]
+        if any(d.lower() in ("no-store", "no-cache") for d in directives):
+            return 0
+        for directive in directives:
+            match = _MAX_AGE_DIRECTIVE.match(directive)
+            if match:
+                return int(match.group(1))
+
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            expires_at = parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            # an invalid Expires header means "already expired"
+            return 0
+        date = headers.get("Date")
+        try:
+            now = parsedate_to_datetime(date).timestamp() if date else time.time()
+        except (TypeError, ValueError):
+            now = time.time()
+        return max(0, int(expires_at - now))
+
+    return None
+
+
+# Required members of a JWK by key type, see RFC 7638 section 3.2
+_THUMBPRINT_MEMBERS = {
+    "EC": ("crv", "kty", "x", "y"),
+    "OKP": ("crv", "kty", "x"),
+    "RSA": ("e", "kty", "n"),
+    "oct": ("k", "kty"),
+}
+
+
+def _is_signing_jwk(jwk: Any) -> bool:
+    """Return whether `jwk` is a key of a supported type to verify signatures."""
+    return (
+        isinstance(jwk, dict)
+        and isinstance(jwk.get("kid"), str)
+        and bool(jwk["kid"])
+        and isinstance(jwk.get("kty"), str)
+        and jwk["kty"] in _THUMBPRINT_MEMBERS
+        and jwk.get("use", "sig") == "sig"
+    )
+
+
+def get_jwk_thumbprint(jwk: Dict[str, Any]) -> str:
+    """
+    Compute the RFC 7638 SHA-256 thumbprint of a JSON Web Key.
+
+    JWKs of unknown key types are hashed as a whole.
+    """
+    members = _THUMBPRINT_MEMBERS.get(jwk.get("kty"), sorted(jwk))
+    canonical = json.dumps(
+        {m: jwk.get(m) for m in members}, separators=(",", ":"), sort_keys=True
+    )
+    digest = hashlib.sha256(canonical.encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+class CachedKeySet:
+    """
+    A JSON Web Key Set fetched from a platform, indexed by key id (`kid`).
+
+    Only keys of supported types suitable to verify signatures are kept, like
+    `jwt.PyJWKSet` skips unusable keys.
+    """
+
+    def __init__(self, jwks: Dict[str, Any], fetched_at: float, expires_at: float):
+        self.keys: Dict[str, Dict[str, Any]] = {
+            jwk["kid"]: jwk for jwk in jwks.get("keys", []) if _is_signing_jwk(jwk)
+        }
+        self.thumbprints: Dict[str, str] = {
+            kid: get_jwk_thumbprint(jwk) for kid, jwk in self.keys.items()
+        }
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) >= self.expires_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "jwks": {"keys": list(self.keys.values())},
+            "fetched_at": self.fetched_at,
+            "expires_at": self.expires_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CachedKeySet":
+        return cls(data["jwks"], data["fetched_at"], data["expires_at"])
+
+
+class JWKSCache(LoggingConfigurable):
+    """
+    Process-wide cache of the signing keys published by LTI 1.3 platforms.
+
+    Key sets are cached per JWKS endpoint and indexed by key id (`kid`). A lookup
+    for a `kid` which is present in a key set that has not expired yet does not
+    perform any network I/O. The lifetime of a key set follows the `Cache-Control`
+    and `Expires` headers of the JWKS endpoint's response, bounded by `min_ttl`
+    and `max_ttl`.
+
+    An instance is owned by the `LTI13Authenticator`.
+    """
+
+    default_ttl = Int(
+        300,
+        config=True,
+        help="""
+        Lifetime in seconds of a cached key set if the JWKS endpoint's response does
+        not carry any `Cache-Control` or `Expires` header.
+        """,
+    )
+
+    min_ttl = Int(
+        60,
+        config=True,
+        help="""
+        Minimum lifetime in seconds of a cached key set. Applies also if the JWKS endpoint
+        forbids caching, to protect the platform from being queried for every launch.
+        """,
+    )
+
+    max_ttl = Int(
+        86400,
+        config=True,
+        help="""
+        Maximum lifetime in seconds of a cached key set, regardless of the caching headers
+        sent by the JWKS endpoint.
+        """,
+    )
+
+    connect_timeout = Float(
+        5,
+        config=True,
+        help="""
+        Timeout in seconds for establishing the connection to the JWKS endpoint.
+        """,
+    )
+
+    request_timeout = Float(
+        10,
+        config=True,
+        help="""
+        Timeout in seconds for the whole request to the JWKS endpoint.
+        """,
+    )
+
+    max_pending_refreshes = Int(
+        100,
+        config=True,
+        help="""
+        Maximum number of launches per JWKS endpoint that may wait for the same in-flight
+        refresh of a key set. Further launches are rejected until the refresh completes.
+        Set to 0 to disable the limit.
+        """,
+    )
+
+    background_refresh = Bool(
+        True,
+        config=True,
+        help="""
+        Prefetch the platform's key set when the hub starts and refresh it in the background
+        shortly before it expires, so that launches always find the keys already cached.
+        """,
+    )
+
+    refresh_interval = Float(
+        0,
+        config=True,
+        help="""
+        Maximum interval in seconds between two background refreshes of a key set. By
+        default (0), key sets are refreshed `refresh_before_expiry` seconds before they expire.
+        """,
+    )
+
+    refresh_before_expiry = Float(
+        30,
+        config=True,
+        help="""
+        Time in seconds before the expiry of a cached key set when it is refreshed in the
+        background.
+        """,
+    )
+
+    refresh_jitter = Float(
+        10,
+        config=True,
+        help="""
+        Maximum random delay in seconds by which a background refresh is brought forward,
+        to spread the refreshes of several hubs sharing the same platform.
+        """,
+    )
+
+    snapshot_path = Unicode(
+        "",
+        config=True,
+        help="""
+        Path of a JSON file holding a snapshot of the cached key sets. If set, the snapshot
+        is written atomically after every successful fetch and fresh key sets are loaded
+        from it at startup and before querying a JWKS endpoint. Several hubs on the same
+        node can share a snapshot. It can be prepared with the `ltiauthenticator-prefetch-jwks`
+        command.
+        """,
+    )
+
+    key_cache_size = Int(
+        32,
+        config=True,
+        help="""
+        Maximum number of parsed public keys kept in memory. Public keys are cached by their
+        RFC 7638 thumbprint, so that the key material of a JWK is only parsed once.
+        """,
+    )
+
+    min_refresh_interval = Float(
+        60,
+        config=True,
+        help="""
+        Minimum time in seconds between two refreshes of a key set triggered by an unknown
+        key id (`kid`). Launches with an unknown `kid` within this interval are rejected
+        without querying the JWKS endpoint.
+        """,
+    )
+
+    unknown_kid_ttl = Float(
+        60,
+        config=True,
+        help="""
+        Time in seconds for which a key id (`kid`) that could not be found in a freshly
+        fetched key set is remembered as unknown. Launches using it are rejected without
+        any I/O.
+        """,
+    )
+
+    unknown_kid_cache_size = Int(
+        1024,
+        config=True,
+        help="""
+        Maximum number of unknown key ids (`kid`) remembered.
+        """,
+    )
+
+    max_stale = Float(
+        300,
+        config=True,
+        help="""
+        Time in seconds after its expiry during which a key set is still used to verify
+        launches while it is refreshed in the background. Keeps launches working when the
+        JWKS endpoint is slow or unavailable for a short time. Set to 0 to always wait for
+        the refresh of an expired key set.
+        """,
+    )
+
+    backoff_base = Float(
+        1,
+        config=True,
+        help="""
+        Time in seconds during which a JWKS endpoint is not queried again after a failed
+        fetch. The delay doubles with every consecutive failure, up to `backoff_max`.
+        """,
+    )
+
+    backoff_max = Float(
+        300,
+        config=True,
+        help="""
+        Maximum time in seconds during which a failing JWKS endpoint is not queried.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._key_sets: Dict[str, CachedKeySet] = {}
+        # parsed public keys by (thumbprint, alg)
+        self._public_keys: LRUCache = LRUCache(maxsize=self.key_cache_size)
+        # (endpoint, kid) pairs not found in a fresh key set
+        self._unknown_kids: TTLCache = TTLCache(
+            maxsize=self.unknown_kid_cache_size, ttl=self.unknown_kid_ttl
+        )
+        # in-flight refreshes and the number of launches waiting for them, by endpoint
+        self._pending_refreshes: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+        self._snapshot_mtime: Optional[float] = None
+        # consecutive fetch failures and the earliest time of the next fetch, by endpoint
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._key_sets.update(self.read_snapshot())
+
+    async def get_signing_key(
+        self, jwks_endpoint: str, kid: Optional[str]
+    ) -> jwt.PyJWK:
+        """
+        Return the parsed key with id `kid` published at `jwks_endpoint`.
+
+        The key set is only fetched if it is not cached yet, has expired or does not
+        contain `kid`, e.g. after the platform rotated its keys. Unknown key ids trigger
+        at most one refresh per `min_refresh_interval` and are then remembered for
+        `unknown_kid_ttl` seconds, so that forged tokens cannot be used to flood the
+        JWKS endpoint. Key sets that expired less than `max_stale` seconds ago are still
+        used while they are refreshed in the background.
+
+        Raises:
+          TokenError if no matching key can be found.
+        """
+        if not kid:
+            raise TokenError("id_token header does not specify a key id (kid)")
+        if not isinstance(kid, str):
+            raise TokenError("Key ID header parameter must be a string")
+
+        now = time.time()
+        key_set = self._key_sets.get(jwks_endpoint)
+        if key_set is None or now >= key_set.expires_at + self.max_stale:
+            key_set = await self.refresh(jwks_endpoint, kid)
+        else:
+            if key_set.is_expired(now):
+                self.revalidate(jwks_endpoint)
+            if kid not in key_set.keys:
+                if (jwks_endpoint, kid) in self._unknown_kids:
+                    raise TokenError(
+                        f"Unable to find a signing key that matches: {kid}"
+                    )
+                if now - key_set.fetched_at >= self.min_refresh_interval:
+                    key_set = await self.refresh(jwks_endpoint, kid)
+
+        jwk = key_set.keys.get(kid)
+        if jwk is None:
+            self._unknown_kids[(jwks_endpoint, kid)] = True
+            raise TokenError(f"Unable to find a signing key that matches: {kid}")
+
+        cache_key = (key_set.thumbprints[kid], jwk.get("alg"))
+        signing_key = self._public_keys.get(cache_key)
+        if signing_key is None:
+            try:
+                signing_key = jwt.PyJWK(jwk)
+            except jwt.PyJWTError as e:
+                raise TokenError(f"Unable to use the signing key {kid}: {e}")
+            self._public_keys[cache_key] = signing_key
+        return signing_key
+
+    async def refresh(
+        self, jwks_endpoint: str, kid: Optional[str] = None
+    ) -> CachedKeySet:
+        """
+        Fetch the key set published at `jwks_endpoint` and cache it.
+
+        Concurrent refreshes of the same endpoint are coalesced into a single request,
+        whose result (or error) is shared by all callers.
+
+        A newer key set written to the snapshot by another hub is used instead of
+        fetching it, unless it lacks `kid`, the key id a refresh was requested for.
+        Then the platform may have rotated its keys since and the endpoint is queried.
+
+        After a failed fetch, the endpoint is not queried again for an exponentially
+        growing delay, during which refreshes fail immediately.
+
+        Raises:
+          TokenError if the key set cannot be retrieved or too many launches are
+          already waiting for the endpoint.
+        """
+        requested_at = time.time()
+        key_set = await self._join_refresh(jwks_endpoint, kid)
+        if kid and kid not in key_set.keys and key_set.fetched_at < requested_at:
+            # the shared refresh was started for another key id and took an older key
+            # set from the snapshot
+            key_set = await self._join_refresh(jwks_endpoint, kid)
+        return key_set
+
+    async def _join_refresh(
+        self, jwks_endpoint: str, kid: Optional[str]
+    ) -> CachedKeySet:
+        pending = self._pending_refreshes.get(jwks_endpoint)
+        if pending is None:
+            pending = asyncio.ensure_future(self._refresh(jwks_endpoint, kid))
+            self._pending_refreshes[jwks_endpoint] = pending
+            pending.add_done_callback(
+                lambda _: self._pending_refreshes.pop(jwks_endpoint, None)
+            )
+        elif 0 < self.max_pending_refreshes <= self._waiters.get(jwks_endpoint, 0):
+            raise TokenError(f"Too many pending refreshes of JWKS from {jwks_endpoint}")
+
+        self._waiters[jwks_endpoint] = self._waiters.get(jwks_endpoint, 0) + 1
+        try:
+            # shield the shared refresh from the cancellation of a single waiter
+            return await asyncio.shield(pending)
+        finally:
+            self._waiters[jwks_endpoint] -= 1
+            if not self._waiters[jwks_endpoint]:
+                del self._waiters[jwks_endpoint]
+
+    def revalidate(self, jwks_endpoint: str) -> None:
+        """
+        Refresh the key set published at `jwks_endpoint` in the background, unless a
+        refresh is already in flight or the endpoint is backing off after failures.
+        """
+        if jwks_endpoint in self._pending_refreshes:
+            return
+        if time.time() < self._retry_at.get(jwks_endpoint, 0):
+            return
+        task = asyncio.ensure_future(self.refresh(jwks_endpoint))
+        task.add_done_callback(self._log_revalidation)
+
+    def _log_revalidation(self, task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.log.warning(f"Refresh of stale JWKS failed: {task.exception()}")
+
+    async def _refresh(self, jwks_endpoint: str, kid: Optional[str]) -> CachedKeySet:
+        # another hub may have fetched a newer key set in the meantime
+        key_set = self.read_snapshot().get(jwks_endpoint)
+        current = self._key_sets.get(jwks_endpoint)
+        if (
+            key_set
+            and (current is None or key_set.fetched_at > current.fetched_at)
+            and (not kid or kid in key_set.keys)
+        ):
+            self.log.debug(f"Using JWKS of {jwks_endpoint} from {self.snapshot_path}")
+            self._key_sets[jwks_endpoint] = key_set
+            return key_set
+
+        retry_in = self._retry_at.get(jwks_endpoint, 0) - time.time()
+        if retry_in > 0:
+            raise TokenError(
+                f"JWKS endpoint {jwks_endpoint} is unavailable, retrying in {retry_in:.0f}s"
+            )
+        try:
+            jwks, headers = await self.fetch(jwks_endpoint)
+        except TokenError:
+            failures = self._failures[jwks_endpoint] = (
+                self._failures.get(jwks_endpoint, 0) + 1
+            )
+            backoff = min(self.backoff_base * 2 ** (failures - 1), self.backoff_max)
+            self._retry_at[jwks_endpoint] = time.time() + backoff
+            raise
+        self._failures.pop(jwks_endpoint, None)
+        self._retry_at.pop(jwks_endpoint, None)
+
+        lifetime = get_cache_lifetime(headers)
+        if lifetime is None:
+            lifetime = self.default_ttl
+        ttl = min(max(lifetime, self.min_ttl), self.max_ttl)
+
+        fetched_at = time.time()
+        key_set = CachedKeySet(jwks, fetched_at, fetched_at + ttl)
+        self._key_sets[jwks_endpoint] = key_set
+        self.log.debug(
+            f"Cached {len(key_set.keys)} keys from {jwks_endpoint} for {ttl} seconds"
+        )
+        self.write_snapshot()
+        return key_set
+
+    def read_snapshot(self) -> Dict[str, CachedKeySet]:
+        """
+        Return the key sets of the snapshot file that have not expired yet.
+
+        The file is only parsed if it has been modified since it was last read.
+        """
+        if not self.snapshot_path:
+            return {}
+        try:
+            mtime = os.stat(self.snapshot_path).st_mtime
+            if mtime == self._snapshot_mtime:
+                return {}
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            key_sets = {
+                endpoint: CachedKeySet.from_dict(data)
+                for endpoint, data in snapshot.get("key_sets", {}).items()
+            }
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            self.log.warning(f"Ignoring JWKS snapshot {self.snapshot_path}: {e}")
+            return {}
+        self._snapshot_mtime = mtime
+        now = time.time()
+        return {
+            endpoint: key_set
+            for endpoint, key_set in key_sets.items()
+            if not key_set.is_expired(now)
+        }
+
+    def write_snapshot(self) -> None:
+        """
+        Atomically replace the snapshot file with the cached key sets.
+
+        Key sets of other endpoints in the existing snapshot, e.g. written by other
+        hubs, are preserved as long as they have not expired.
+        """
+        if not self.snapshot_path:
+            return
+        self._snapshot_mtime = None
+        key_sets = {**self.read_snapshot(), **self._key_sets}
+        snapshot = {
+            "key_sets": {
+                endpoint: key_set.to_dict() for endpoint, key_set in key_sets.items()
+            }
+        }
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=directory, prefix=".jwks-", suffix=".tmp"
+            )
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+            self._snapshot_mtime = os.stat(self.snapshot_path).st_mtime
+        except OSError as e:
+            self.log.warning(f"Failed to write JWKS snapshot {self.snapshot_path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def start_background_refresh(self, jwks_endpoint: str) -> None:
+        """
+        Start prefetching and periodically refreshing the key set of `jwks_endpoint`.
+
+        Does nothing if `background_refresh` is disabled, no endpoint is given, a
+        refresh task is already running for the endpoint or no event loop is running.
+        """
+        if not self.background_refresh or not jwks_endpoint:
+            return
+        if jwks_endpoint in self._refresh_tasks:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.log.debug(f"No running event loop, not prefetching {jwks_endpoint}")
+            return
+        self._refresh_tasks[jwks_endpoint] = loop.create_task(
+            self._refresh_periodically(jwks_endpoint)
+        )
+
+    def stop_background_refresh(self) -> None:
+        """Cancel all background refresh tasks."""
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        self._refresh_tasks.clear()
+
+    def get_refresh_delay(self, key_set: CachedKeySet) -> float:
+        """Return the delay in seconds until the next background refresh of `key_set`."""
+        delay = key_set.expires_at - time.time() - self.refresh_before_expiry
+        if self.refresh_interval:
+            delay = min(delay, self.refresh_interval)
+        delay -= random.uniform(0, self.refresh_jitter)
+        return max(delay, 1)
+
+    async def _refresh_periodically(self, jwks_endpoint: str) -> None:
+        while True:
+            try:
+                key_set = await self.refresh(jwks_endpoint)
+            except TokenError as e:
+                self.log.warning(f"Background refresh of JWKS failed: {e}")
+                delay = max(self._retry_at.get(jwks_endpoint, 0) - time.time(), 1)
+            else:
+                delay = self.get_refresh_delay(key_set)
+            await asyncio.sleep(delay)
+
+    async def fetch(
+        self, jwks_endpoint: str
+    ) -> Tuple[Dict[str, Any], Mapping[str, str]]:
+        """
+        Download the key set published at `jwks_endpoint`.
+
+        The request is issued with tornado's `AsyncHTTPClient`, so that a slow
+        platform does not block the hub's event loop.
+
+        Returns:
+          Tuple of the decoded key set and the response headers.
+
+        Raises:
+          TokenError if the key set cannot be retrieved.
+        """
+        self.log.debug(f"Fetching JWKS from {jwks_endpoint}")
+        try:
+            response = await AsyncHTTPClient().fetch(
+                jwks_endpoint,
+                headers={"User-Agent": "jupyterhub-ltiauthenticator"},
+                connect_timeout=self.connect_timeout,
+                request_timeout=self.request_timeout,
+            )
+            return json.loads(response.body), response.headers
+        except (HTTPClientError, OSError, ValueError) as e:
+            raise TokenError(f'Fail to fetch data from the url, err: "{e}"') from e
+
+    def clear(self) -> None:
+        """Drop all cached key sets and parsed keys."""
+        self._key_sets.clear()
+        self._public_keys.clear()
+        self._unknown_kids.clear()
+        self._failures.clear()
+        self._retry_at.clear()
+
+
+def main(argv=None) -> int:
+    """
+    Fetch the key sets of one or more JWKS endpoints and store them in a snapshot file.
+
+    Meant to pre-warm `JWKSCache.snapshot_path` during an image build or from an init
+    container.
+    """
+    parser = argparse.ArgumentParser(
+        prog="ltiauthenticator-prefetch-jwks",
+        description="Prefetch the JSON Web Key Sets of LTI 1.3 platforms into a snapshot file.",
+    )
+    parser.add_argument("jwks_endpoint", nargs="+", help="JWKS endpoint to prefetch")
+    parser.add_argument(
+        "--snapshot-path",
+        required=True,
+        help="Snapshot file, as configured with JWKSCache.snapshot_path",
+    )
+    args = parser.parse_args(argv)
+
+    cache = JWKSCache(snapshot_path=args.snapshot_path)
+
+    async def prefetch():
+        for jwks_endpoint in args.jwks_endpoint:
+            key_set = await cache.refresh(jwks_endpoint)
+            print(f"{jwks_endpoint}: {len(key_set.keys)} keys")
+
+    try:
+        asyncio.run(prefetch())
+    except TokenError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
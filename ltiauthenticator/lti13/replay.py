@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class ReplayCacheFull(Exception):
+    """Raised if a consumed id_token cannot be recorded because the cache is full."""
+
+
+class IdTokenReplayCache:
+    """
+    Remembers the (iss, nonce) pairs of consumed id_tokens, so that a launch request
+    cannot be replayed.
+
+    A pair is remembered for `ttl` seconds, after which the id_token is rejected as
+    too old anyway. Since all pairs live equally long, they expire in the order in
+    which they were recorded and expired pairs are dropped from the front. At most
+    `max_size` pairs are remembered; further id_tokens are rejected rather than
+    forgetting pairs that have not expired yet.
+
+    The cache is thread safe.
+
+    Args:
+      ttl: time in seconds a consumed id_token is remembered
+      max_size: maximum number of consumed id_tokens remembered
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires_at: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_consumed(self, issuer: str, nonce: str, now: Optional[float] = None) -> bool:
+        """Return whether the id_token with `issuer` and `nonce` has been consumed."""
+        if now is None:
+            now = time.time()
+        return self._expires_at.get((issuer, nonce), 0) > now
+
+    def consume(self, issuer: str, nonce: str, now: Optional[float] = None) -> bool:
+        """
+        Record the id_token with `issuer` and `nonce` as consumed.
+
+        Returns:
+          False if it has already been consumed, True otherwise.
+
+        Raises:
+          ReplayCacheFull if the cache is full.
+        """
+        if now is None:
+            now = time.time()
+        key = (issuer, nonce)
+        with self._lock:
+            while self._expires_at:
+                oldest_key, expires_at = next(iter(self._expires_at.items()))
+                if expires_at > now:
+                    break
+                del self._expires_at[oldest_key]
+            if key in self._expires_at:
+                return False
+            if len(self._expires_at) >= self.max_size:
+                raise ReplayCacheFull(
+                    f"Too many id_tokens consumed in {self.ttl}s, "
+                    f"limit is {self.max_size}"
+                )
+            self._expires_at[key] = now + self.ttl
+        return True
+
+    def clear(self) -> None:
+        """Forget all consumed id_tokens."""
+        with self._lock:
+            self._expires_at.clear()
@@ -0,0 +1,267 @@
+import base64
+import binascii
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from traitlets import Float, Int, Unicode
+from traitlets.config import LoggingConfigurable
+
+_VERSION = b"\x01"
+_STATE_ID_SIZE = 16
+_NONCE_SEED_SIZE = 32
+_HEADER_SIZE = len(_VERSION) + _STATE_ID_SIZE + _NONCE_SEED_SIZE
+
+
+class LaunchState(NamedTuple):
+    """
+    State of an LTI 1.3 OIDC login, kept in a single cookie between the login
+    initiation and the launch.
+
+    It is encoded as a version byte, the raw state id and nonce seed, and the
+    UTF-8 encoded next_url, in URL-safe base64. The cookie is signed when it is set,
+    so the encoding itself is not authenticated.
+
+    Attributes:
+      state_id: random id sent as the OAuth state parameter
+      nonce_seed: random value whose hash is sent as the nonce
+      next_url: URL to redirect the user to after the launch, if any
+    """
+
+    state_id: bytes
+    nonce_seed: bytes
+    next_url: Optional[str] = None
+
+    @classmethod
+    def create(cls, next_url: Optional[str] = None) -> "LaunchState":
+        """Create the state of a new login with a random state id and nonce seed."""
+        return cls(
+            secrets.token_bytes(_STATE_ID_SIZE),
+            secrets.token_bytes(_NONCE_SEED_SIZE),
+            next_url or None,
+        )
+
+    @property
+    def state(self) -> str:
+        """The OAuth state parameter."""
+        return self.state_id.hex()
+
+    @property
+    def nonce_state(self) -> str:
+        """The nonce state the nonce is derived from, see `get_nonce`."""
+        return self.nonce_seed.hex()
+
+    def encode(self) -> str:
+        value = _VERSION + self.state_id + self.nonce_seed
+        if self.next_url:
+            value += self.next_url.encode("utf-8")
+        return base64.urlsafe_b64encode(value).rstrip(b"=").decode("ascii")
+
+    @classmethod
+    def decode(cls, encoded: str) -> "LaunchState":
+        """
+        Decode a state encoded with `encode`.
+
+        Raises:
+          ValueError if `encoded` is not a valid state.
+        """
+        try:
+            value = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        except (binascii.Error, ValueError):
+            raise ValueError("Invalid launch state encoding")
+        if len(value) < _HEADER_SIZE or value[:1] != _VERSION:
+            raise ValueError("Invalid launch state")
+        state_id = value[1 : 1 + _STATE_ID_SIZE]
+        nonce_seed = value[1 + _STATE_ID_SIZE : _HEADER_SIZE]
+        next_url = value[_HEADER_SIZE:].decode("utf-8") or None
+        return cls(state_id, nonce_seed, next_url)
+
+
+class StateStoreError(Exception):
+    """Raised if a state store cannot store or look up a launch state."""
+
+
+class StateStore(LoggingConfigurable):
+    """
+    Base class of the server-side stores of LTI 1.3 launch states, keyed by the
+    OAuth state parameter. A state is removed when it is looked up, so it can be
+    used by a single launch only.
+    """
+
+    # whether calls may block on I/O, so that they have to be run outside of the
+    # event loop
+    blocking = False
+
+    ttl = Float(
+        600,
+        config=True,
+        help="""
+        Time in seconds a launch state is kept, i.e. the maximum time between the login
+        initiation and the launch.
+        """,
+    )
+
+    def put(self, launch_state: LaunchState, now: Optional[float] = None) -> None:
+        """
+        Store `launch_state` under its OAuth state.
+
+        Raises:
+          StateStoreError if the state cannot be stored.
+        """
+        raise NotImplementedError()
+
+    def pop(self, state: str, now: Optional[float] = None) -> Optional[LaunchState]:
+        """
+        Remove and return the launch state stored under the OAuth `state`.
+
+        Returns:
+          The launch state, or None if it is unknown or expired.
+
+        Raises:
+          StateStoreError if the state cannot be looked up.
+        """
+        raise NotImplementedError()
+
+
+class MemoryStateStore(StateStore):
+    """
+    State store keeping launch states in the memory of the hub process. If it is
+    full, the oldest states are evicted.
+    """
+
+    max_size = Int(
+        100000,
+        config=True,
+        help="""
+        Maximum number of launch states kept. The oldest states are evicted beyond it.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._states: "OrderedDict[str, Tuple[LaunchState, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, launch_state: LaunchState, now: Optional[float] = None) -> None:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            # states are inserted in order of expiry, so expired ones are in front
+            while self._states:
+                _, expires_at = next(iter(self._states.values()))
+                if expires_at > now and len(self._states) < self.max_size:
+                    break
+                self._states.popitem(last=False)
+            self._states[launch_state.state] = (launch_state, now + self.ttl)
+
+    def pop(self, state: str, now: Optional[float] = None) -> Optional[LaunchState]:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            launch_state, expires_at = self._states.pop(state, (None, 0.0))
+        return launch_state if expires_at > now else None
+
+
+class SQLiteStateStore(StateStore):
+    """
+    State store keeping launch states in an SQLite database, which can be shared by
+    several hub processes on the same node. It is accessed in a thread, since a call
+    may wait for a lock held by another process.
+    """
+
+    blocking = True
+
+    path = Unicode(
+        "jupyterhub-lti13-states.sqlite",
+        config=True,
+        help="""
+        Path of the SQLite database holding the launch states.
+        """,
+    )
+
+    timeout = Float(
+        5,
+        config=True,
+        help="""
+        Time in seconds to wait for a lock on the database held by another process.
+        """,
+    )
+
+    cleanup_interval = Float(
+        60,
+        config=True,
+        help="""
+        Interval in seconds between two deletions of expired launch states.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS states "
+            "(state TEXT PRIMARY KEY, launch_state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._next_cleanup = 0.0
+
+    def put(self, launch_state: LaunchState, now: Optional[float] = None) -> None:
+        if now is None:
+            now = time.time()
+        try:
+            with self._lock:
+                if now >= self._next_cleanup:
+                    self._next_cleanup = now + self.cleanup_interval
+                    self._connection.execute(
+                        "DELETE FROM states WHERE expires_at <= ?", (now,)
+                    )
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO states VALUES (?, ?, ?)",
+                    (launch_state.state, launch_state.encode(), now + self.ttl),
+                )
+        except sqlite3.Error as e:
+            raise StateStoreError(f"Unable to store OAuth state: {e}")
+
+    def pop(self, state: str, now: Optional[float] = None) -> Optional[LaunchState]:
+        if now is None:
+            now = time.time()
+        try:
+            with self._lock:
+                # the lookup and deletion are one transaction, so that a state is only
+                # returned to one of several hubs sharing the database
+                self._connection.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._connection.execute(
+                        "SELECT launch_state, expires_at FROM states WHERE state = ?",
+                        (state,),
+                    ).fetchone()
+                    if row is not None:
+                        self._connection.execute(
+                            "DELETE FROM states WHERE state = ?", (state,)
+                        )
+                    self._connection.execute("COMMIT")
+                except BaseException:
+                    self._connection.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            raise StateStoreError(f"Unable to look up OAuth state: {e}")
+        if row is None or row[1] <= now:
+            return None
+        try:
+            return LaunchState.decode(row[0])
+        except ValueError as e:
+            self.log.warning(f"Invalid launch state in {self.path}: {e}")
+            return None
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        self._connection.close()
@@ -1,8 +1,7 @@
 from calendar import timegm
 from datetime import datetime, timezone
-from typing import Any, Dict, Iterable
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
-import jwt
 from traitlets import Int
 from traitlets.config import LoggingConfigurable
 
@@ -11,20 +10,108 @@ from .constants import (
     LTI13_DEEP_LINKING_REQUIRED_CLAIMS,
     LTI13_GENERAL_REQUIRED_CLAIMS,
     LTI13_INIT_LOGIN_REQUEST_ARGS,
+    LTI13_MESSAGE_TYPE_CLAIM,
     LTI13_RESOURCE_LINK_REQUEST_REQUIRED_CLAIMS,
 )
 from .error import (
+    ClaimsValidationError,
     IncorrectValueError,
     InvalidAudienceError,
     MissingRequiredArgumentError,
+    ReplayedTokenError,
     TokenError,
+    ValidationError,
 )
+from .executor import BoundedExecutor
+from .id_token import EncodedIdToken
+from .jwks import JWKSCache
+from .replay import IdTokenReplayCache
 
 
 def now() -> int:
     return timegm(datetime.now(tz=timezone.utc).utctimetuple())
 
 
+def _get_numeric_date(claims: Dict[str, Any], claim: str, description: str) -> int:
+    try:
+        return int(claims[claim])
+    except (ValueError, TypeError, OverflowError):
+        raise TokenError(f"{description} must be an integer.")
+
+
+def _check_lti_version(
+    validator: "LTI13LaunchValidator", lti_version: Any
+) -> Optional[ValidationError]:
+    """Check version claim."""
+    if lti_version != "1.3.0":
+        return IncorrectValueError(f"Incorrect value {lti_version} for version claim")
+
+
+def _check_context_label(
+    validator: "LTI13LaunchValidator", context_claim: Any
+) -> Optional[ValidationError]:
+    """Validate context label."""
+    if isinstance(context_claim, dict) and context_claim.get("label") == "":
+        return MissingRequiredArgumentError(
+            "Claim https://purl.imsglobal.org/spec/lti/claim/context present, but context label is missing."
+        )
+
+
+def _check_resource_link_id(
+    validator: "LTI13LaunchValidator", resource_link: Any
+) -> Optional[ValidationError]:
+    """Check if resource_link claim has id set."""
+    if not isinstance(resource_link, dict) or not resource_link.get("id"):
+        return MissingRequiredArgumentError("resource_link claim's id can't be empty")
+
+
+def _check_if_iat_is_too_old(
+    validator: "LTI13LaunchValidator", iat: Any
+) -> Optional[ValidationError]:
+    """Check if iat is too old."""
+    if iat < now() - validator.max_age - validator.time_leeway:
+        return TokenError("id_token issued too long ago.")
+
+
+# (claim, required, check) triples validating the claims of an id_token
+ValidationPlan = Tuple[
+    Tuple[str, bool, Optional[Callable[[Any, Any], Optional[ValidationError]]]], ...
+]
+
+_REQUIRED_CLAIM_CHECKS = {
+    "https://purl.imsglobal.org/spec/lti/claim/version": _check_lti_version,
+    "https://purl.imsglobal.org/spec/lti/claim/resource_link": _check_resource_link_id,
+    "iat": _check_if_iat_is_too_old,
+}
+
+_OPTIONAL_CLAIM_CHECKS = {
+    "https://purl.imsglobal.org/spec/lti/claim/context": _check_context_label,
+}
+
+
+def _compile_validation_plan(required_claims: Iterable[str]) -> ValidationPlan:
+    """Return the validation plan of the given required claims."""
+    required = dict.fromkeys([*LTI13_GENERAL_REQUIRED_CLAIMS, *required_claims])
+    return tuple(
+        (claim, True, _REQUIRED_CLAIM_CHECKS.get(claim)) for claim in required
+    ) + tuple(
+        (claim, False, check)
+        for claim, check in _OPTIONAL_CLAIM_CHECKS.items()
+        if claim not in required
+    )
+
+
+# validation plans by message_type, compiled once
+_GENERAL_VALIDATION_PLAN = _compile_validation_plan(())
+_VALIDATION_PLANS: Dict[str, ValidationPlan] = {
+    claims[LTI13_MESSAGE_TYPE_CLAIM]: _compile_validation_plan(claims)
+    for claims in (
+        LTI13_RESOURCE_LINK_REQUEST_REQUIRED_CLAIMS,
+        LTI13_DEEP_LINKING_REQUIRED_CLAIMS,
+    )
+}
+
+
 class LTI13LaunchValidator(LoggingConfigurable):
     """
     Allows JupyterHub to verify LTI 1.3 compatible requests as a tool (known as a tool
@@ -49,6 +136,37 @@ class LTI13LaunchValidator(LoggingConfigurable):
         """,
     )
 
+    replay_cache_size = Int(
+        100000,
+        config=True,
+        help="""
+        Maximum number of consumed id_tokens remembered to reject replayed launches.
+        id_tokens are remembered for `max_age` plus twice `time_leeway` seconds.
+        Launches beyond this limit are rejected.
+        """,
+    )
+
+    _jwks_cache: Optional[JWKSCache] = None
+    _replay_cache: Optional[IdTokenReplayCache] = None
+
+    @property
+    def replay_cache_ttl(self) -> int:
+        """
+        Time in seconds a consumed id_token has to be remembered. Its `iat` may be up
+        to `time_leeway` seconds in the future when it is consumed, and it is accepted
+        until `iat` is `max_age` plus `time_leeway` seconds old.
+        """
+        return self.max_age + 2 * self.time_leeway
+
+    @property
+    def replay_cache(self) -> IdTokenReplayCache:
+        """Consumed id_tokens, remembered until they are too old to be accepted."""
+        if self._replay_cache is None:
+            self._replay_cache = IdTokenReplayCache(
+                self.replay_cache_ttl, self.replay_cache_size
+            )
+        return self._replay_cache
+
     def validate_login_request(self, args: Dict[str, Any]) -> None:
         """
         Validates the initial authentication request and ensures the required
@@ -93,95 +211,143 @@ class LTI13LaunchValidator(LoggingConfigurable):
         self._check_arg_not_missing(args, required)
         self._check_arg_not_empty(args, required)
 
-    def verify_and_decode_jwt(
-        self, encoded_jwt, issuer, audience, jwks_endpoint, jwks_algorithms, **kwargs
+    async def verify_and_decode_jwt(
+        self,
+        encoded_jwt,
+        issuer,
+        audience,
+        jwks_endpoint,
+        jwks_algorithms,
+        jwks_cache: Optional[JWKSCache] = None,
+        executor: Optional[BoundedExecutor] = None,
+        replay_cache: Optional[IdTokenReplayCache] = None,
+        options: Optional[Dict[str, bool]] = None,
     ):
         """
         Verify the JWT against the public keys provided in a JSON Web Key Set
         endpoint provided by the platform, and then return the payload in the
         jwt.
+
+        The JWT is parsed once. Its algorithm and registered claims are checked
+        before the signing key is looked up and the signature is verified, so that
+        malformed, expired or misdirected tokens are rejected without any I/O or
+        cryptographic work.
+
+        The public keys are looked up in `jwks_cache`. If no cache is given, they are
+        looked up in a cache owned by the validator, which fetches the key set from
+        `jwks_endpoint`. Fetching the key set does not block the event loop. If an
+        `executor` is given, the signature is verified in its thread pool instead of
+        on the event loop.
+
+        An id_token is only accepted once: its issuer and nonce are recorded in
+        `replay_cache` after its signature has been verified, and a replayed
+        id_token is rejected before its signature is verified. If no cache is given,
+        they are recorded in a cache owned by the validator.
+
+        Like with `jwt.decode`, the claims are not checked if `options` disables
+        `verify_signature`, unless enabled individually with `verify_exp`,
+        `verify_iat`, `verify_nbf`, `verify_iss` or `verify_aud`.
         """
         if not issuer:
             self.log.warning("No issuer identifyer configured")
 
         # reject unsigned id_token if encription is negotiated
-        verification_options = kwargs.pop("options", {})
-        verification_options["verify_signature"] = (
-            verification_options.get("verify_signature", True) or jwks_endpoint != ""
-        )
-
-        try:
-            if verification_options["verify_signature"]:
-                jwks_client = jwt.PyJWKClient(jwks_endpoint)
-                signing_key = jwks_client.get_signing_key_from_jwt(encoded_jwt)
-                key = signing_key.key
+        options = dict(options or {})
+        verify_signature = options.get("verify_signature", True) or jwks_endpoint != ""
+        for option in (
+            "verify_exp",
+            "verify_iat",
+            "verify_nbf",
+            "verify_iss",
+            "verify_aud",
+        ):
+            options.setdefault(option, verify_signature)
+
+        token = EncodedIdToken(encoded_jwt)
+        if verify_signature and (not token.alg or token.alg not in jwks_algorithms):
+            raise TokenError("The specified alg value is not allowed")
+        self._check_registered_claims(token.claims, issuer, audience, options)
+
+        if replay_cache is None:
+            replay_cache = self.replay_cache
+        replay_key = None
+        if verify_signature:
+            iss, nonce = token.claims.get("iss"), token.claims.get("nonce")
+            if isinstance(iss, str) and isinstance(nonce, str):
+                replay_key = (iss, nonce)
+        if replay_key and replay_cache.is_consumed(*replay_key):
+            raise ReplayedTokenError("The id_token has already been used")
+
+        if verify_signature:
+            if jwks_cache is None:
+                if self._jwks_cache is None:
+                    self._jwks_cache = JWKSCache(parent=self)
+                jwks_cache = self._jwks_cache
+            signing_key = await jwks_cache.get_signing_key(jwks_endpoint, token.kid)
+            if executor is None:
+                token.verify_signature(signing_key.key)
             else:
-                key = ""
-
-            id_token = jwt.decode(
-                encoded_jwt,
-                key,
-                algorithms=jwks_algorithms,
-                audience=audience,
-                issuer=issuer,
-                options=verification_options,
-                leeway=self.time_leeway,
-                **kwargs,
-            )
-        except jwt.InvalidAudienceError as e:
-            raise InvalidAudienceError(str(e))
-        except jwt.PyJWTError as e:
-            raise TokenError(str(e))
+                await executor.run(token.verify_signature, signing_key.key)
 
-        return id_token
+        # record the id_token only once its signature is known to be valid, so that
+        # forged id_tokens cannot block genuine ones
+        if replay_key and not replay_cache.consume(*replay_key):
+            raise ReplayedTokenError("The id_token has already been used")
 
-    def _check_message_type(self, id_token: Dict[str, Any]) -> None:
-        """Validate message type value"""
-        message_type = id_token.get(
-            "https://purl.imsglobal.org/spec/lti/claim/message_type"
-        )
-        if (
-            message_type
-            != LTI13_RESOURCE_LINK_REQUEST_REQUIRED_CLAIMS[
-                "https://purl.imsglobal.org/spec/lti/claim/message_type"
-            ]
-            and message_type
-            != LTI13_DEEP_LINKING_REQUIRED_CLAIMS[
-                "https://purl.imsglobal.org/spec/lti/claim/message_type"
-            ]
-        ):
-            raise IncorrectValueError(
-                f"Incorrect value {message_type} for message_type claim"
-            )
+        return token.claims
 
-    def _check_context_label(self, id_token: Dict[str, Any]) -> None:
-        """Validate context label."""
-        context_claim = id_token.get(
-            "https://purl.imsglobal.org/spec/lti/claim/context"
-        )
-        context_label = context_claim.get("label") if context_claim else None
-        if context_label == "":
-            raise MissingRequiredArgumentError(
-                "Claim https://purl.imsglobal.org/spec/lti/claim/context present, but context label is missing."
-            )
-
-    def _check_lti_version(self, id_token: Dict[str, Any]) -> None:
-        """Check version claim."""
-        lti_version = id_token.get("https://purl.imsglobal.org/spec/lti/claim/version")
-        if lti_version != "1.3.0":
-            raise IncorrectValueError(
-                f"Incorrect value {lti_version} for version claim"
-            )
+    def _check_registered_claims(
+        self,
+        claims: Dict[str, Any],
+        issuer: Optional[str],
+        audience: Optional[Iterable[str]],
+        options: Dict[str, bool],
+    ) -> None:
+        """
+        Validate the registered claims of an id_token like `jwt.decode` does.
 
-    def _check_resource_link_id(self, id_token: Dict[str, Any]) -> None:
-        """Check if resource_link claim has id set."""
-        id = id_token.get(
-            "https://purl.imsglobal.org/spec/lti/claim/resource_link", {}
-        ).get("id")
-        if not id:
-            raise MissingRequiredArgumentError(
-                "resource_link claim's id can't be empty"
-            )
+        Raises:
+          TokenError or InvalidAudienceError
+        """
+        timestamp = now()
+        leeway = self.time_leeway
+        if "iat" in claims and options["verify_iat"]:
+            iat = _get_numeric_date(claims, "iat", "Issued At claim (iat)")
+            if iat > timestamp + leeway:
+                raise TokenError("The token is not yet valid (iat)")
+            if iat < timestamp - self.max_age - leeway:
+                raise TokenError("id_token issued too long ago.")
+        if "nbf" in claims and options["verify_nbf"]:
+            nbf = _get_numeric_date(claims, "nbf", "Not Before claim (nbf)")
+            if nbf > timestamp + leeway:
+                raise TokenError("The token is not yet valid (nbf)")
+        if "exp" in claims and options["verify_exp"]:
+            exp = _get_numeric_date(claims, "exp", "Expiration Time claim (exp)")
+            if exp <= timestamp - leeway:
+                raise TokenError("Signature has expired")
+
+        if options["verify_iss"] and issuer is not None:
+            if "iss" not in claims:
+                raise TokenError('Token is missing the "iss" claim')
+            if claims["iss"] != issuer:
+                raise TokenError("Invalid issuer")
+
+        if options["verify_aud"]:
+            aud = claims.get("aud")
+            if audience is None:
+                if aud:
+                    raise InvalidAudienceError("Invalid audience")
+                return
+            if not aud:
+                raise InvalidAudienceError('Token is missing the "aud" claim')
+            if isinstance(aud, str):
+                aud = [aud]
+            if not isinstance(aud, list) or not all(isinstance(a, str) for a in aud):
+                raise InvalidAudienceError("Invalid claim format in token")
+            if isinstance(audience, str):
+                audience = [audience]
+            if all(a not in aud for a in audience):
+                raise InvalidAudienceError("Audience doesn't match")
 
     def validate_azp_claim(
         self, id_token: Dict[str, Any], client_id: Iterable[str]
@@ -199,12 +365,6 @@ class LTI13LaunchValidator(LoggingConfigurable):
         if azp not in client_id:
             raise InvalidAudienceError("azp claim does not match client_id.")
 
-    def _check_if_iat_is_too_old(self, id_token: Dict[str, Any]) -> None:
-        """Raise TokenError if iat is too old."""
-        iat = id_token["iat"]
-        if iat < now() - self.max_age - self.time_leeway:
-            raise TokenError("id_token issued too long ago.")
-
     def validate_id_token(self, id_token: Dict[str, Any]) -> None:
         """
         Validates that a LTI 1.3 launch request's decoded JWT has required
@@ -213,30 +373,42 @@ class LTI13LaunchValidator(LoggingConfigurable):
         The required claims are defined by the LTI 1.3 standard, see
         https://www.imsglobal.org/spec/lti/v1p3#required-message-claims.
 
+        The id_token is checked in a single pass against the validation plan of its
+        message type, collecting all violations.
+
         Args:
           id_token: decoded JWT payload of a launch request
 
         Raises:
-          Subclass of ValidationError.
+          Subclass of ValidationError. If several claims are invalid, a
+          ClaimsValidationError holding all of them.
         """
-        self._check_arg_not_missing(id_token, LTI13_GENERAL_REQUIRED_CLAIMS.keys())
-        self._check_lti_version(id_token)
-        self._check_context_label(id_token)
-        self._check_message_type(id_token)
-        self._check_if_iat_is_too_old(id_token)
-
-        # message_type influences what claims are required
-        message_type = id_token[
-            "https://purl.imsglobal.org/spec/lti/claim/message_type"
-        ]
-        is_deep_linking = message_type == "LtiDeepLinkingRequest"
-
-        if is_deep_linking:
-            self._check_arg_not_missing(
-                id_token, LTI13_DEEP_LINKING_REQUIRED_CLAIMS.keys()
-            )
-        else:
-            self._check_arg_not_missing(
-                id_token, LTI13_RESOURCE_LINK_REQUEST_REQUIRED_CLAIMS.keys()
+        message_type = id_token.get(LTI13_MESSAGE_TYPE_CLAIM)
+        plan = _VALIDATION_PLANS.get(message_type)
+        errors: List[ValidationError] = []
+        if plan is None:
+            errors.append(
+                IncorrectValueError(
+                    f"Incorrect value {message_type} for message_type claim"
+                )
             )
-            self._check_resource_link_id(id_token)
+            plan = _GENERAL_VALIDATION_PLAN
+
+        for claim, required, check in plan:
+            if claim not in id_token:
+                if required:
+                    errors.append(
+                        MissingRequiredArgumentError(
+                            f"Required LTI 1.3 arg {claim} not in request"
+                        )
+                    )
+                continue
+            if check is not None:
+                error = check(self, id_token[claim])
+                if error is not None:
+                    errors.append(error)
+
+        if len(errors) == 1:
+            raise errors[0]
+        if errors:
+            raise ClaimsValidationError(errors)
@@ -1,8 +1,25 @@
+import asyncio
+import hashlib
+import json
 import logging
 import os
-from typing import Any, Dict, List
+import threading
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 from tornado.httputil import HTTPServerRequest
+from tornado.web import RequestHandler
 
 from .lti13.constants import (
     DEFAULT_ROLE_NAMES_FOR_INSTRUCTOR,
@@ -43,6 +60,14 @@ except ImportError:
         return request.protocol
 
 
+try:
+    from jupyterhub.roles import assign_default_roles  # type: ignore
+
+# jupyterhub < 2.0 has no roles
+except ImportError:
+    assign_default_roles = None
+
+
 def convert_request_to_dict(arguments: Dict[str, List[bytes]]) -> Dict[str, Any]:
     """
     Converts the arguments obtained from a request to a dict.
@@ -90,3 +115,355 @@ def user_is_an_instructor(user_role: str) -> bool:
         extra_roles = extra_roles.lower().split(",")
         DEFAULT_ROLE_NAMES_FOR_INSTRUCTOR.extend(extra_roles)
     return user_role.lower() in DEFAULT_ROLE_NAMES_FOR_INSTRUCTOR
+
+
+class CachedResponse(NamedTuple):
+    """A rendered response body and its strong ETag."""
+
+    body: bytes
+    etag: str
+
+
+class ResponseCache:
+    """
+    Bounded cache of rendered responses, keyed by the values they are rendered from.
+
+    Keys usually include request headers such as the host, which are chosen by the
+    client, so the least recently used responses are evicted beyond `maxsize`.
+
+    Args:
+        maxsize: maximum number of cached responses
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._responses: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+
+    def get(self, key: Hashable, render: Callable[[], str]) -> CachedResponse:
+        """
+        Return the cached response for `key`, rendering it with `render` if it is not
+        cached.
+        """
+        response = self._responses.get(key)
+        if response is None:
+            body = render().encode("utf-8")
+            etag = f'"{hashlib.sha256(body).hexdigest()}"'
+            response = self._responses[key] = CachedResponse(body, etag)
+            if len(self._responses) > self.maxsize:
+                self._responses.popitem(last=False)
+        else:
+            self._responses.move_to_end(key)
+        return response
+
+    def clear(self) -> None:
+        """Forget all cached responses."""
+        self._responses.clear()
+
+
+def write_cached_response(
+    handler: RequestHandler, response: CachedResponse, max_age: int
+) -> None:
+    """
+    Write a cached response with its ETag and a Cache-Control header allowing clients
+    to cache it for `max_age` seconds. Responds with 304 Not Modified instead if the
+    request's If-None-Match header matches the ETag.
+
+    Args:
+        handler: a tornado.web.RequestHandler object
+        response: the cached response
+        max_age: seconds the response may be cached by clients, 0 to require revalidation
+    """
+    handler.set_header("Etag", response.etag)
+    handler.set_header(
+        "Cache-Control", f"max-age={max_age}" if max_age > 0 else "no-cache"
+    )
+    if handler.check_etag_header():
+        handler.set_status(304)
+        return
+    handler.write(response.body)
+
+
+def digest_launch_request(arguments: Dict[str, List[bytes]]) -> str:
+    """
+    Compute a digest of the arguments of a launch request, which identifies
+    duplicates of the request.
+
+    Args:
+        arguments: the arguments of a tornado.httputil.HTTPServerRequest
+
+    Returns:
+        The hex encoded SHA-256 digest of the sorted arguments
+    """
+    digest = hashlib.sha256()
+    for name in sorted(arguments):
+        for value in arguments[name]:
+            name_bytes = name.encode("utf-8")
+            digest.update(len(name_bytes).to_bytes(4, "big") + name_bytes)
+            digest.update(len(value).to_bytes(4, "big") + value)
+    return digest.hexdigest()
+
+
+class LaunchCache:
+    """
+    Short-lived record of successful launches, keyed by the digest of the launch
+    request, so that duplicates of a launch, e.g. from a double click or a reloaded
+    iframe, can be redirected without logging the user in again.
+
+    Launches are remembered for `ttl` seconds. At most `max_size` launches are
+    remembered, the oldest ones are forgotten first.
+
+    Args:
+        ttl: time in seconds a launch is remembered, 0 disables the cache
+        max_size: maximum number of launches remembered
+    """
+
+    def __init__(self, ttl: float = 10, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._launches: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, digest: str, now: Optional[float] = None
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Return the name of the user logged in by the launch with `digest` and the URL
+        they were redirected to, or None if the launch is unknown or expired.
+        """
+        launch = self._launches.get(digest)
+        if launch is None:
+            return None
+        if now is None:
+            now = time.time()
+        user_name, next_url, expires_at = launch
+        return (user_name, next_url) if expires_at > now else None
+
+    def put(
+        self, digest: str, user_name: str, next_url: str, now: Optional[float] = None
+    ) -> None:
+        """Remember that the launch with `digest` logged in a user and redirected them."""
+        if self.ttl <= 0:
+            return
+        if now is None:
+            now = time.time()
+        with self._lock:
+            while self._launches and (
+                len(self._launches) >= self.max_size
+                or next(iter(self._launches.values()))[2] <= now
+            ):
+                self._launches.popitem(last=False)
+            self._launches[digest] = (user_name, next_url, now + self.ttl)
+
+
+async def redirect_duplicate_launch(handler: RequestHandler, digest: str) -> bool:
+    """
+    Redirect a duplicate of a successful launch to the URL the original launch was
+    redirected to, if the browser is still logged in as the user of that launch.
+
+    Args:
+        handler: the JupyterHub handler of the launch request
+        digest: the digest of the launch request, see `digest_launch_request`
+
+    Returns:
+        True if the request has been redirected, False if it must be handled as a
+        new launch
+    """
+    launch = handler.authenticator.launch_cache.get(digest)
+    if launch is None:
+        return False
+    user_name, next_url = launch
+    user = await handler.get_current_user()
+    if user is None or user.name != user_name:
+        return False
+    handler.log.debug(f"Redirecting duplicate launch of user {user_name} to {next_url}")
+    handler.redirect(next_url)
+    return True
+
+
+async def call_store(store: Any, func: Callable[..., Any], *args) -> Any:
+    """
+    Call `func`, which accesses `store`, in a thread of the event loop's default
+    executor if the store may block, e.g. waiting for a lock on a database held by
+    another process. Otherwise `func` is called directly.
+
+    Args:
+        store: the store accessed by `func`, blocking if its `blocking` attribute is set
+        func: function to call with `args`
+
+    Returns:
+        The return value of `func`
+    """
+    if getattr(store, "blocking", False):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    return func(*args)
+
+
+class CoalescedLoginMixin:
+    """
+    Mixin for JupyterHub handlers that persists concurrent logins of the same user
+    only once.
+
+    When a user opens several identical launches at the same time, e.g. by reloading
+    a tab, the first launch updates the user in the database while the others wait
+    for it and then reuse its result. Launches with another auth_state or other user
+    data, e.g. from another course, wait for the pending login and are then persisted
+    on their own. Pending logins are tracked per username and are removed as soon as
+    they complete.
+    """
+
+    # logins in progress and the digest of their user model by username, shared by
+    # all handlers of the hub process
+    _pending_logins: Dict[str, Tuple["asyncio.Future[Any]", str]] = {}
+
+    async def auth_to_user(self, authenticated, user=None):
+        if user is not None:
+            # refreshing a given user is not coalesced
+            return await super().auth_to_user(authenticated, user)
+        name = (
+            authenticated if isinstance(authenticated, str) else authenticated["name"]
+        )
+        digest = self._digest_login(authenticated)
+        pending_logins = CoalescedLoginMixin._pending_logins
+        while name in pending_logins:
+            login, login_digest = pending_logins[name]
+            if login.done():
+                break
+            if login_digest == digest:
+                self.log.debug(f"Waiting for the concurrent login of user {name}")
+                # a cancelled launch must not cancel the login other launches wait for
+                return await asyncio.shield(login)
+            self.log.debug(f"Waiting for a different concurrent login of user {name}")
+            await asyncio.wait([login])
+
+        login = asyncio.ensure_future(super().auth_to_user(authenticated))
+        pending_logins[name] = (login, digest)
+
+        def remove_login(_):
+            if pending_logins.get(name, (None,))[0] is login:
+                del pending_logins[name]
+
+        login.add_done_callback(remove_login)
+        return await asyncio.shield(login)
+
+    def _digest_login(self, authenticated) -> str:
+        if isinstance(authenticated, str):
+            return digest_auth_state(authenticated)
+        model = {k: v for k, v in authenticated.items() if k != "auth_state"}
+        model["auth_state"] = self.authenticator.digest_auth_state(
+            authenticated.get("auth_state")
+        )
+        return digest_auth_state(model)
+
+
+def digest_auth_state(auth_state: Any, ignored_keys: Iterable[str] = ()) -> str:
+    """
+    Compute a stable digest of an auth_state, which does not depend on the order of
+    its keys.
+
+    Args:
+        auth_state: the auth_state returned by an authenticator
+        ignored_keys: top-level keys left out of the digest, e.g. claims that change
+          with every launch
+
+    Returns:
+        The hex encoded SHA-256 digest of the auth_state
+    """
+    if isinstance(auth_state, dict) and ignored_keys:
+        ignored_keys = set(ignored_keys)
+        auth_state = {k: v for k, v in auth_state.items() if k not in ignored_keys}
+    serialized = json.dumps(
+        auth_state, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class AuthStateDigests:
+    """
+    Digests of the auth_state last saved for each user, so that saving an unchanged
+    auth_state again can be skipped. Only the digests of the `max_size` most
+    recently logged in users are kept.
+
+    A digest is recorded together with the cookie id of the user it was saved for.
+    Unlike their name and database id, it is not reused by another user created
+    under the same name later on.
+
+    Args:
+        max_size: maximum number of users whose digest is kept, 0 disables it
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._digests: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
+    def get(self, name: str) -> Optional[Tuple[str, str]]:
+        """
+        Return the cookie id of user `name` and the digest of the auth_state last saved
+        for them, if known.
+        """
+        recorded = self._digests.get(name)
+        if recorded is not None:
+            self._digests.move_to_end(name)
+        return recorded
+
+    def put(self, name: str, cookie_id: str, digest: str) -> None:
+        """Record the digest of the auth_state saved for user `name` with `cookie_id`."""
+        if self.max_size <= 0:
+            return
+        self._digests[name] = (cookie_id, digest)
+        self._digests.move_to_end(name)
+        while len(self._digests) > self.max_size:
+            self._digests.popitem(last=False)
+
+    def discard(self, name: str) -> None:
+        """Forget the digest of user `name`."""
+        self._digests.pop(name, None)
+
+
+class AuthStateDigestMixin:
+    """
+    Mixin for JupyterHub handlers that skips persisting a user at login if their
+    auth_state is unchanged since their last login and nothing else would be updated,
+    i.e. the login does not carry `user_info`, an `admin` flag differing from the
+    user's, or groups and roles managed by the authenticator. The default roles are
+    assigned like at every login.
+
+    The digest of the auth_state is computed by the authenticator's
+    `digest_auth_state` and the digests are kept in its `auth_state_digests`.
+    """
+
+    async def auth_to_user(self, authenticated, user=None):
+        authenticator = self.authenticator
+        if (
+            user is not None
+            or not isinstance(authenticated, dict)
+            or getattr(authenticator, "manage_groups", False)
+            or getattr(authenticator, "manage_roles", False)
+        ):
+            if isinstance(authenticated, dict) and "name" in authenticated:
+                authenticator.auth_state_digests.discard(authenticated["name"])
+            return await super().auth_to_user(authenticated, user)
+
+        name = authenticated["name"]
+        # like JupyterHub, save no auth_state if it is disabled
+        auth_state = (
+            authenticated.get("auth_state") if authenticator.enable_auth_state else None
+        )
+        digest = authenticator.digest_auth_state(auth_state)
+        admin = authenticated.get("admin")
+        recorded = authenticator.auth_state_digests.get(name)
+        if recorded is not None and recorded[1] == digest:
+            existing_user = self.find_user(name)
+            if existing_user is None or existing_user.cookie_id != recorded[0]:
+                # the user has been deleted, and possibly created again, since
+                authenticator.auth_state_digests.discard(name)
+            elif authenticated.get("user_info") is None and (
+                admin is None or admin == existing_user.admin
+            ):
+                if assign_default_roles is not None:
+                    assign_default_roles(self.db, entity=existing_user)
+                self.log.debug(f"Skipping unchanged auth_state of user {name}")
+                return existing_user
+
+        user = await super().auth_to_user(authenticated)
+        authenticator.auth_state_digests.put(name, user.cookie_id, digest)
+        return user
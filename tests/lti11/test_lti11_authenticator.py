@@ -1,12 +1,16 @@
 import json
+import threading
 from unittest.mock import Mock, patch
 
 import pytest
 from tornado.httputil import HTTPServerRequest
 from tornado.web import HTTPError, RequestHandler
+from traitlets.config import Config
 
 import ltiauthenticator.lti11.auth
 from ltiauthenticator.lti11.auth import LTI11Authenticator
+from ltiauthenticator.lti11.consumers import FileConsumerRegistry
+from ltiauthenticator.lti11.replay import MemoryReplayStore, SQLiteReplayStore
 from ltiauthenticator.lti11.validator import LTI11LaunchValidator
 
 from .mocking import MockLTI11Authenticator
@@ -40,6 +44,64 @@ async def test_authenticator_returns_manually_specified_uri_scheme(scheme):
     assert authenticator.get_uri_scheme("") == scheme
 
 
+async def test_authenticator_uses_memory_replay_store_by_default():
+    authenticator = LTI11Authenticator()
+    assert isinstance(authenticator.replay_store, MemoryReplayStore)
+
+
+async def test_authenticator_uses_configured_replay_store_class(tmp_path):
+    config = Config()
+    config.LTI11Authenticator.replay_store_class = (
+        "ltiauthenticator.lti11.replay.SQLiteReplayStore"
+    )
+    config.SQLiteReplayStore.path = str(tmp_path / "nonces.sqlite")
+
+    authenticator = LTI11Authenticator(config=config)
+
+    assert isinstance(authenticator.replay_store, SQLiteReplayStore)
+    assert authenticator.replay_store.path == config.SQLiteReplayStore.path
+
+
+async def test_authenticator_reuses_validator_until_consumers_change():
+    authenticator = LTI11Authenticator(consumers={"key": "secret"})
+    validator = authenticator.get_validator()
+    assert authenticator.get_validator() is validator
+
+    authenticator.consumers = {"other_key": "other_secret"}
+
+    new_validator = authenticator.get_validator()
+    assert new_validator is not validator
+    assert new_validator.consumers == {"other_key": "other_secret"}
+    assert new_validator.replay_store is authenticator.replay_store
+
+
+async def test_authenticator_rebuilds_signer_when_consumers_change():
+    authenticator = LTI11Authenticator(consumers={"key": "secret"})
+    signer = authenticator.get_signer(authenticator.get_consumers())
+    assert authenticator.get_signer(authenticator.get_consumers()) is signer
+
+    authenticator.consumers = {"other_key": "other_secret"}
+
+    other_signer = authenticator.get_signer(authenticator.get_consumers())
+    assert other_signer is not signer
+    assert other_signer.consumers == {"other_key": "other_secret"}
+
+
+async def test_authenticator_uses_configured_consumer_registry(tmp_path):
+    path = tmp_path / "consumers.json"
+    path.write_text(json.dumps({"key": "secret"}))
+    config = Config()
+    config.LTI11Authenticator.consumer_registry_class = (
+        "ltiauthenticator.lti11.consumers.FileConsumerRegistry"
+    )
+    config.FileConsumerRegistry.path = str(path)
+
+    authenticator = LTI11Authenticator(config=config, consumers={"other": "secret"})
+
+    assert isinstance(authenticator.consumer_registry, FileConsumerRegistry)
+    assert authenticator.get_consumers() == {"key": "secret"}
+
+
 async def test_authenticator_uses_lti11validator(
     auth_args,
 ):
@@ -65,6 +127,35 @@ async def test_authenticator_uses_lti11validator(
         assert mock_validator.called
 
 
+async def test_authenticator_validates_in_thread_with_sqlite_replay_store(
+    tmp_path, auth_args
+):
+    """
+    Ensure that launch requests are validated outside of the event loop if the replay
+    store may block.
+    """
+    threads = []
+
+    def validate_launch_request(*args):
+        threads.append(threading.current_thread())
+        return True
+
+    with patch.object(
+        LTI11LaunchValidator,
+        "validate_launch_request",
+        side_effect=validate_launch_request,
+    ):
+        authenticator = MockLTI11Authenticator(
+            replay_store=SQLiteReplayStore(path=str(tmp_path / "nonces.sqlite"))
+        )
+        handler = Mock(spec=RequestHandler)
+        handler.request = HTTPServerRequest(method="POST", connection=Mock())
+        handler.request.arguments = auth_args
+
+        await authenticator.authenticate(handler, None)
+    assert threads and threads[0] is not threading.current_thread()
+
+
 async def test_authenticator_returns_auth_dict_when_custom_canvas_user_id_is_empty(
     auth_args,
 ):
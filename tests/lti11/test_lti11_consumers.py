@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+
+from ltiauthenticator.lti11.consumers import (
+    FileConsumerRegistry,
+    SQLiteConsumerRegistry,
+)
+
+
+def write_consumers(path, consumers):
+    """Replace the consumers file atomically."""
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(consumers))
+    os.replace(tmp_path, path)
+
+
+def test_file_consumer_registry_loads_consumers(tmp_path):
+    path = tmp_path / "consumers.json"
+    write_consumers(path, {"key": "secret"})
+
+    registry = FileConsumerRegistry(path=str(path))
+
+    assert registry.get_consumers() == {"key": "secret"}
+
+
+def test_file_consumer_registry_reloads_changed_file(tmp_path):
+    path = tmp_path / "consumers.json"
+    write_consumers(path, {"key": "secret"})
+    registry = FileConsumerRegistry(path=str(path), reload_interval=0)
+    consumers = registry.get_consumers()
+    # unchanged file is not loaded again
+    assert registry.get_consumers() is consumers
+
+    write_consumers(path, {"key": "secret", "new_key": "new_secret"})
+
+    assert registry.get_consumers() == {"key": "secret", "new_key": "new_secret"}
+
+
+def test_file_consumer_registry_checks_file_at_most_once_per_interval(tmp_path):
+    path = tmp_path / "consumers.json"
+    write_consumers(path, {"key": "secret"})
+    registry = FileConsumerRegistry(path=str(path), reload_interval=3600)
+    registry.get_consumers()
+
+    write_consumers(path, {"new_key": "new_secret"})
+
+    assert registry.get_consumers() == {"key": "secret"}
+
+
+def test_file_consumer_registry_keeps_consumers_on_invalid_file(tmp_path):
+    path = tmp_path / "consumers.json"
+    write_consumers(path, {"key": "secret"})
+    registry = FileConsumerRegistry(path=str(path), reload_interval=0)
+    registry.get_consumers()
+
+    write_consumers(path, ["not", "a", "mapping"])
+    assert registry.get_consumers() == {"key": "secret"}
+    os.remove(path)
+    assert registry.get_consumers() == {"key": "secret"}
+
+
+def test_sqlite_consumer_registry_reloads_changed_database(tmp_path):
+    path = str(tmp_path / "consumers.sqlite")
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE lti11_consumers (consumer_key TEXT PRIMARY KEY, secret TEXT)"
+        )
+        connection.execute("INSERT INTO lti11_consumers VALUES ('key', 'secret')")
+    registry = SQLiteConsumerRegistry(path=path, reload_interval=0)
+    assert registry.get_consumers() == {"key": "secret"}
+
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "INSERT INTO lti11_consumers VALUES ('new_key', 'new_secret')"
+        )
+
+    assert registry.get_consumers() == {"key": "secret", "new_key": "new_secret"}
+    registry.close()
@@ -1,6 +1,6 @@
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
-from ltiauthenticator.lti11.handlers import LTI11AuthenticateHandler
+from ltiauthenticator.lti11.handlers import LTI11AuthenticateHandler, LTI11ConfigHandler
 
 from .mocking import MockLTI11Authenticator
 
@@ -11,7 +11,9 @@ async def test_lti_11_authenticate_handler_invokes_redirect_method(
     """
     Does the LTI11AuthenticateHandler call the redirect function?
     """
-    local_handler = req_handler(LTI11AuthenticateHandler)
+    local_handler = req_handler(
+        LTI11AuthenticateHandler, authenticator=MockLTI11Authenticator()
+    )
     with patch.object(
         LTI11AuthenticateHandler, "redirect", return_value=None
     ) as mock_redirect:
@@ -28,7 +30,9 @@ async def test_lti_11_authenticate_handler_invokes_login_user_method(
     """
     Does the LTI11AuthenticateHandler call the login_user function?
     """
-    local_handler = req_handler(LTI11AuthenticateHandler)
+    local_handler = req_handler(
+        LTI11AuthenticateHandler, authenticator=MockLTI11Authenticator()
+    )
     with patch.object(LTI11AuthenticateHandler, "redirect", return_value=None):
         with patch.object(
             LTI11AuthenticateHandler, "login_user", return_value=None
@@ -45,3 +49,94 @@ async def test_lti_11_handler_paths(app):
     handlers = auth.get_handlers(app)
     assert handlers[0][0] == "/lti/launch"
     assert handlers[1][0] == "/lti11/config"
+
+
+def get_config(req_handler, authenticator, headers=None):
+    """Request the LTI 1.1 XML config and return the finished handler."""
+    local_handler = req_handler(
+        LTI11ConfigHandler,
+        uri="https://hub.example.com/hub/lti11/config",
+        method="GET",
+        authenticator=authenticator,
+        base_url="/",
+    )
+    local_handler.request.headers.update(headers or {})
+    local_handler.request.host = "hub.example.com"
+    handler = LTI11ConfigHandler(local_handler.application, local_handler.request)
+    handler._transforms = []
+    with patch.object(handler, "flush"):
+        handler.get()
+        handler.finish()
+    return handler
+
+
+async def test_lti_11_config_handler_caches_config(req_handler):
+    authenticator = MockLTI11Authenticator(uri_scheme="https", config_cache_max_age=60)
+
+    handler = get_config(req_handler, authenticator)
+
+    assert handler.get_status() == 200
+    assert handler._headers["Cache-Control"] == "max-age=60"
+    body = b"".join(handler._write_buffer)
+    assert b"https://hub.example.com/hub/lti/launch" in body
+    with patch.object(LTI11ConfigHandler, "_render_config") as mock_render_config:
+        assert b"".join(get_config(req_handler, authenticator)._write_buffer) == body
+        assert not mock_render_config.called
+
+
+async def test_lti_11_config_handler_responds_not_modified_for_matching_etag(
+    req_handler,
+):
+    authenticator = MockLTI11Authenticator(uri_scheme="https")
+    etag = get_config(req_handler, authenticator)._headers["Etag"]
+
+    handler = get_config(req_handler, authenticator, {"If-None-Match": etag})
+
+    assert handler.get_status() == 304
+
+
+async def test_lti_11_config_handler_renders_config_again_when_traits_change(
+    req_handler,
+):
+    authenticator = MockLTI11Authenticator(uri_scheme="https")
+    etag = get_config(req_handler, authenticator)._headers["Etag"]
+
+    authenticator.config_title = "Other title"
+    handler = get_config(req_handler, authenticator, {"If-None-Match": etag})
+
+    assert handler.get_status() == 200
+    assert b"Other title" in b"".join(handler._write_buffer)
+
+
+async def test_lti_11_authenticate_handler_redirects_duplicate_launch(req_handler):
+    authenticator = MockLTI11Authenticator()
+    user = Mock()
+    user.name = "somebody"
+    local_handler = req_handler(
+        LTI11AuthenticateHandler,
+        uri="https://hub.example.com/hub/lti/launch?oauth_nonce=nonce",
+        authenticator=authenticator,
+    )
+
+    mocks = []
+    for _ in range(2):
+        handler = LTI11AuthenticateHandler(
+            local_handler.application, local_handler.request
+        )
+        with patch.object(
+            handler, "login_user", return_value=user
+        ) as mock_login_user, patch.object(
+            handler, "get_current_user", return_value=user
+        ), patch.object(
+            handler, "get_next_url", return_value="/hub/home"
+        ), patch.object(
+            handler, "redirect"
+        ) as mock_redirect:
+            await handler.post()
+        mocks.append((mock_login_user, mock_redirect))
+
+    (first_login_user, first_redirect), (second_login_user, second_redirect) = mocks
+    first_login_user.assert_called_once()
+    second_login_user.assert_not_called()
+    first_redirect.assert_called_once_with("/hub/home")
+    second_redirect.assert_called_once_with("/hub/home")
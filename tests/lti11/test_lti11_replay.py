@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from ltiauthenticator.lti11.replay import NonceRing, ReplayStoreFull, SQLiteReplayStore
+
+NOW = 1700000000
+
+
+def test_nonce_ring_rejects_replayed_nonce():
+    store = NonceRing(window=30)
+
+    assert store.check_and_add(NOW, "nonce", now=NOW)
+    assert not store.check_and_add(NOW, "nonce", now=NOW + 10)
+    assert store.check_and_add(NOW + 1, "nonce", now=NOW + 10)
+
+
+def test_nonce_ring_accepts_out_of_order_timestamps():
+    store = NonceRing(window=30)
+
+    assert store.check_and_add(NOW + 20, "a", now=NOW)
+    assert store.check_and_add(NOW - 20, "b", now=NOW)
+    # an older timestamp does not evict the bucket of a newer one
+    assert not store.check_and_add(NOW + 20, "a", now=NOW)
+
+
+def test_nonce_ring_reuses_buckets_outside_of_window():
+    store = NonceRing(window=30)
+    store.check_and_add(NOW, "nonce", now=NOW)
+
+    # NOW + 61 maps onto the bucket of NOW, which has left the window
+    assert store.check_and_add(NOW + 61, "nonce", now=NOW + 61)
+    assert len(store._buckets[NOW % 61]) == 1
+
+
+def test_nonce_ring_rejects_timestamp_outside_of_window():
+    with pytest.raises(ValueError):
+        NonceRing(window=30).check_and_add(NOW - 31, "nonce", now=NOW)
+
+
+def test_nonce_ring_caps_nonces_per_second():
+    store = NonceRing(window=30, max_nonces_per_second=2)
+    store.check_and_add(NOW, "a", now=NOW)
+    store.check_and_add(NOW, "b", now=NOW)
+
+    with pytest.raises(ReplayStoreFull):
+        store.check_and_add(NOW, "c", now=NOW)
+    # known nonces are still detected as replays
+    assert not store.check_and_add(NOW, "a", now=NOW)
+    assert store.check_and_add(NOW + 1, "c", now=NOW)
+
+
+def test_nonce_ring_is_thread_safe():
+    store = NonceRing(window=30)
+    results = []
+
+    def add():
+        results.append(store.check_and_add(NOW, "nonce", now=NOW))
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * 7 + [True]
+
+
+def test_sqlite_replay_store_is_shared(tmp_path):
+    path = str(tmp_path / "nonces.sqlite")
+    store = SQLiteReplayStore(path=path)
+    other_store = SQLiteReplayStore(path=path)
+
+    assert store.check_and_insert(NOW, "nonce", now=NOW)
+    assert not other_store.check_and_insert(NOW, "nonce", now=NOW + 10)
+    assert other_store.check_and_insert(NOW + 1, "nonce", now=NOW + 10)
+
+
+def test_sqlite_replay_store_reuses_expired_records(tmp_path):
+    store = SQLiteReplayStore(path=str(tmp_path / "nonces.sqlite"), window=30)
+
+    assert store.check_and_insert(NOW, "nonce", now=NOW)
+    assert store.check_and_insert(NOW, "nonce", now=NOW + 31)
+
+
+def test_sqlite_replay_store_deletes_expired_records(tmp_path):
+    store = SQLiteReplayStore(path=str(tmp_path / "nonces.sqlite"), window=30)
+    store.check_and_insert(NOW, "a", now=NOW)
+    store.check_and_insert(NOW + 100, "b", now=NOW + 100)
+
+    nonces = store._connection.execute("SELECT nonce FROM nonces").fetchall()
+    assert nonces == [(f"{NOW + 100}:b",)]
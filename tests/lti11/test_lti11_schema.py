@@ -0,0 +1,54 @@
+import pytest
+
+from ltiauthenticator.lti11.schema import LTI11_LAUNCH_ARGS_SCHEMA, LaunchArgsSchema
+
+
+def test_schema_accepts_launch_args(get_launch_args):
+    _, _, args = get_launch_args()
+
+    result = LTI11_LAUNCH_ARGS_SCHEMA.validate(args)
+
+    assert result.is_valid
+    assert result.timestamp == int(args["oauth_timestamp"])
+
+
+def test_schema_reports_all_violations(get_launch_args):
+    _, _, args = get_launch_args()
+    del args["oauth_nonce"]
+    args["oauth_version"] = ""
+    del args["user_id"]
+    args["resource_link_id"] = ""
+
+    result = LTI11_LAUNCH_ARGS_SCHEMA.validate(args)
+
+    assert not result.is_valid
+    assert result.missing_oauth == ("oauth_nonce",)
+    assert result.empty_oauth == ("oauth_version",)
+    assert result.missing == ("user_id",)
+    assert result.empty == ("resource_link_id",)
+
+
+def test_schema_checks_oauth_args_once():
+    schema = LaunchArgsSchema(["oauth_nonce"], ["user_id", "oauth_nonce"])
+
+    result = schema.validate({})
+
+    assert result.missing_oauth == ("oauth_nonce",)
+    assert result.missing == ("user_id",)
+
+
+@pytest.mark.parametrize(
+    "timestamp,error",
+    [
+        ("not-a-number", "Timestamp must be an integer."),
+        ("123", "Invalid timestamp format."),
+    ],
+)
+def test_schema_reports_invalid_timestamp(get_launch_args, timestamp, error):
+    _, _, args = get_launch_args()
+    args["oauth_timestamp"] = timestamp
+
+    result = LTI11_LAUNCH_ARGS_SCHEMA.validate(args)
+
+    assert result.timestamp is None
+    assert result.timestamp_error == error
@@ -0,0 +1,81 @@
+from typing import Dict
+
+import pytest
+from oauthlib.oauth1.rfc5849 import Client, signature
+
+from ltiauthenticator.lti11.signer import HMACSHA1Signer
+
+CONSUMERS = {
+    "my_consumer_key": "my_shared_secret",
+    "unicode_consumer_key": "s€cret with spaces & symbols~*+",
+    "empty_secret_consumer_key": "",
+}
+
+
+def sign_with_oauthlib(
+    consumer_key: str, launch_url: str, headers: Dict[str, str], args: Dict[str, str]
+) -> str:
+    """Reference implementation, the signature as computed by oauthlib."""
+    base_string = signature.signature_base_string(
+        "POST",
+        signature.base_string_uri(launch_url),
+        signature.normalize_parameters(
+            signature.collect_parameters(body=list(args.items()), headers=headers)
+        ),
+    )
+    return signature.sign_hmac_sha1_with_client(
+        base_string,
+        Client(client_key=consumer_key, client_secret=CONSUMERS[consumer_key]),
+    )
+
+
+@pytest.mark.parametrize("consumer_key", CONSUMERS)
+@pytest.mark.parametrize(
+    "launch_url",
+    [
+        "http://jupyterhub/hub/lti/launch",
+        "https://Hub.Example.COM:443/hub/lti/launch?next=/hub/home",
+        "http://hub.example.com:8000/hub/lti/launch",
+    ],
+)
+@pytest.mark.parametrize(
+    "extra_args",
+    [
+        {},
+        {"custom_name": "Jöhn Dœ", "lis_person_name_full": "Jöhn Dœ"},
+        {"custom_reserved": "a b+c&d=e/f?g#h%i*j~k'l(m)n!o"},
+        {"a": "1", "a-b": "2", "a.b": "3", "a_b": "4", "a~b": "5", "A": "6"},
+        {"custom_empty": "", "custom_emoji": "🚀"},
+        {"oauth_callback": "https%3A%2F%2Fconsumer.example.com%2Fcallback"},
+    ],
+)
+def test_signer_matches_oauthlib(get_launch_args, consumer_key, launch_url, extra_args):
+    _, headers, args = get_launch_args(oauth_consumer_key=consumer_key)
+    args.update(extra_args)
+
+    signer = HMACSHA1Signer(CONSUMERS)
+
+    assert signer.sign(consumer_key, launch_url, headers, args) == sign_with_oauthlib(
+        consumer_key, launch_url, headers, args
+    )
+
+
+def test_signer_includes_authorization_header(get_launch_args):
+    launch_url, _, args = get_launch_args()
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Authorization": 'OAuth realm="Example", oauth_token="token%20value"',
+    }
+
+    signer = HMACSHA1Signer(CONSUMERS)
+
+    assert signer.sign("my_consumer_key", launch_url, headers, args) == (
+        sign_with_oauthlib("my_consumer_key", launch_url, headers, args)
+    )
+
+
+def test_signer_rejects_unknown_consumer(get_launch_args):
+    launch_url, headers, args = get_launch_args()
+
+    with pytest.raises(KeyError):
+        HMACSHA1Signer(CONSUMERS).sign("unknown", launch_url, headers, args)
@@ -1,8 +1,10 @@
 from typing import Dict, Tuple
+from unittest.mock import patch
 
 import pytest
 from tornado.web import HTTPError
 
+from ltiauthenticator.lti11.replay import MemoryReplayStore, SQLiteReplayStore
 from ltiauthenticator.lti11.validator import LTI11LaunchValidator
 
 
@@ -61,6 +63,18 @@ def test_launch_with_missing_oauth_timestamp_key(get_launch_args):
         validator.validate_launch_request(launch_url, headers, args)
 
 
+def test_launch_with_non_integer_oauth_timestamp(get_launch_args):
+    """
+    Is a launch request with a non-integer oauth_timestamp rejected as unauthorized?
+    """
+    validator, launch_url, headers, args = args_test_setup(get_launch_args)
+    args["oauth_timestamp"] = "not-a-number"
+
+    with pytest.raises(HTTPError) as e:
+        validator.validate_launch_request(launch_url, headers, args)
+    assert e.value.status_code == 401
+
+
 def test_launch_with_missing_oauth_consumer_key_key(
     get_launch_args,
 ):
@@ -341,3 +355,74 @@ def test_launch_with_same_oauth_nonce_different_oauth_timestamp(
     with pytest.raises(HTTPError):
         args["oauth_timestamp"] = "0123456789"
         validator.validate_launch_request(launch_url, headers, args)
+
+
+def test_launch_with_full_replay_store(get_launch_args):
+    """
+    Is a launch request rejected if its nonce cannot be recorded?
+    """
+    validator, launch_url, headers, args = args_test_setup(get_launch_args)
+    validator.replay_store = MemoryReplayStore(max_nonces_per_second=0)
+
+    with pytest.raises(HTTPError) as e:
+        validator.validate_launch_request(launch_url, headers, args)
+    assert e.value.status_code == 429
+
+
+def test_launch_replayed_on_other_hub(tmp_path, get_launch_args):
+    """
+    Is a launch request rejected if it has already been accepted by another hub
+    sharing the replay store?
+    """
+    validator, launch_url, headers, args = args_test_setup(get_launch_args)
+    path = str(tmp_path / "nonces.sqlite")
+    validator.replay_store = SQLiteReplayStore(path=path)
+    assert validator.validate_launch_request(launch_url, headers, args)
+
+    other_validator = LTI11LaunchValidator(
+        validator.consumers, SQLiteReplayStore(path=path)
+    )
+    with pytest.raises(HTTPError) as e:
+        other_validator.validate_launch_request(launch_url, headers, args)
+    assert e.value.status_code == 401
+
+
+def test_launch_with_invalid_signature_does_not_use_up_nonce(get_launch_args):
+    """
+    Is the nonce of a launch request with an invalid signature left unused?
+    """
+    validator, launch_url, headers, args = args_test_setup(get_launch_args)
+    validator.replay_store = MemoryReplayStore()
+    signature = args["oauth_signature"]
+
+    with pytest.raises(HTTPError) as e:
+        args["oauth_signature"] = "invalid"
+        validator.validate_launch_request(launch_url, headers, args)
+    assert e.value.status_code == 401
+
+    args["oauth_signature"] = signature
+    assert validator.validate_launch_request(launch_url, headers, args)
+
+
+@pytest.mark.parametrize("replay_store_class", [MemoryReplayStore, SQLiteReplayStore])
+def test_launch_outside_of_replay_store_window(
+    tmp_path, get_launch_args, replay_store_class
+):
+    """
+    Is a launch request rejected, rather than accepted twice or failing, if its
+    timestamp is outside of the window of a replay store with a non-default window?
+    """
+    validator, launch_url, headers, args = args_test_setup(get_launch_args)
+    if replay_store_class is SQLiteReplayStore:
+        validator.replay_store = SQLiteReplayStore(
+            window=10, path=str(tmp_path / "nonces.sqlite")
+        )
+    else:
+        validator.replay_store = MemoryReplayStore(window=10)
+
+    with patch("time.time", return_value=int(args["oauth_timestamp"]) + 20):
+        for _ in range(2):
+            with pytest.raises(HTTPError) as e:
+                validator.validate_launch_request(launch_url, headers, args)
+            assert e.value.status_code == 401
+            assert "Timestamp given is invalid" in e.value.log_message
@@ -1,9 +1,9 @@
 from unittest.mock import patch
 
-import jwt
 from traitlets import List, Set, Unicode
 
 from ltiauthenticator.lti13.auth import LTI13Authenticator
+from ltiauthenticator.lti13.jwks import JWKSCache
 
 
 class MockLTI13Authenticator(LTI13Authenticator):
@@ -25,5 +25,5 @@ class MockLTI13Authenticator(LTI13Authenticator):
     issuer = Unicode("https://my.platform.domain")
 
 
-def patched_jwk_client(response):
-    return patch.object(jwt.PyJWKClient, "fetch_data", return_value=response)
+def patched_jwk_client(response, headers=None):
+    return patch.object(JWKSCache, "fetch", return_value=(response, headers or {}))
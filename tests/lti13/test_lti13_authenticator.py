@@ -10,11 +10,14 @@ from unittest.mock import patch
 
 import pytest
 from tornado.web import RequestHandler
+from traitlets.config import Config
 
 import ltiauthenticator.lti13.auth
 from ltiauthenticator.lti13.auth import LTI13Authenticator
 from ltiauthenticator.lti13.constants import LTI13_CUSTOM_CLAIM
 from ltiauthenticator.lti13.error import LoginError
+from ltiauthenticator.lti13.executor import BoundedExecutor
+from ltiauthenticator.lti13.state import SQLiteStateStore
 
 
 async def test_authenticator_uri_scheme_defaults_to_auto():
@@ -22,6 +25,76 @@ async def test_authenticator_uri_scheme_defaults_to_auto():
     assert authenticator.uri_scheme == "auto"
 
 
+async def test_authenticator_verifies_on_event_loop_by_default():
+    authenticator = LTI13Authenticator()
+    assert authenticator.verify_executor is None
+
+
+async def test_authenticator_creates_verify_executor():
+    authenticator = LTI13Authenticator(verify_in_executor=True)
+    executor = authenticator.verify_executor
+    assert isinstance(executor, BoundedExecutor)
+    assert authenticator.verify_executor is executor
+    executor.shutdown()
+
+
+async def test_authenticator_reuses_validator_until_config_changes():
+    authenticator = LTI13Authenticator()
+    validator = authenticator.get_validator()
+    assert authenticator.get_validator() is validator
+
+    config = Config()
+    config.LTI13LaunchValidator.time_leeway = 30
+    authenticator.config = config
+
+    new_validator = authenticator.get_validator()
+    assert new_validator is not validator
+    assert new_validator.time_leeway == 30
+
+
+async def test_authenticator_keeps_replay_cache_when_config_changes():
+    authenticator = LTI13Authenticator()
+    replay_cache = authenticator.replay_cache
+    replay_cache.consume("https://platform.example.com", "nonce")
+
+    config = Config()
+    config.LTI13LaunchValidator.time_leeway = 30
+    config.LTI13LaunchValidator.replay_cache_size = 10
+    authenticator.config = config
+    authenticator.get_validator()
+
+    assert authenticator.replay_cache is replay_cache
+    assert replay_cache.is_consumed("https://platform.example.com", "nonce")
+    assert replay_cache.ttl == 660
+    assert replay_cache.max_size == 10
+
+
+async def test_authenticator_creates_configured_state_store(tmp_path):
+    assert LTI13Authenticator().state_store is None
+
+    config = Config()
+    config.LTI13Authenticator.state_store_class = (
+        "ltiauthenticator.lti13.state.SQLiteStateStore"
+    )
+    config.SQLiteStateStore.path = str(tmp_path / "states.sqlite")
+    authenticator = LTI13Authenticator(config=config)
+
+    assert isinstance(authenticator.state_store, SQLiteStateStore)
+    authenticator.state_store.close()
+
+
+async def test_authenticator_auth_state_digest_ignores_per_launch_claims():
+    authenticator = LTI13Authenticator()
+    auth_state = {"sub": "1", "nonce": "a", "iat": 1, "exp": 2}
+
+    assert authenticator.digest_auth_state(auth_state) == (
+        authenticator.digest_auth_state({"sub": "1", "nonce": "b", "iat": 3, "exp": 4})
+    )
+    assert authenticator.digest_auth_state(auth_state) != (
+        authenticator.digest_auth_state({"sub": "2", "nonce": "a", "iat": 1, "exp": 2})
+    )
+
+
 async def test_authenticator_uri_scheme_setter_is_case_insenstive():
     authenticator = LTI13Authenticator()
     authenticator.uri_scheme = "Https"
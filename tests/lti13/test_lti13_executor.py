@@ -0,0 +1,29 @@
+import asyncio
+import threading
+
+from ltiauthenticator.lti13.executor import BoundedExecutor
+
+
+async def test_bounded_executor_runs_in_thread_pool():
+    executor = BoundedExecutor(max_workers=1, queue_depth=0)
+    thread = await executor.run(threading.current_thread)
+    assert thread is not threading.current_thread()
+    executor.shutdown()
+
+
+async def test_bounded_executor_runs_inline_when_saturated():
+    executor = BoundedExecutor(max_workers=1, queue_depth=0)
+    release = threading.Event()
+    pending = asyncio.ensure_future(executor.run(release.wait))
+    try:
+        await asyncio.sleep(0)
+        thread = await executor.run(threading.current_thread)
+        assert thread is threading.current_thread()
+    finally:
+        release.set()
+    assert await pending is True
+    # the slot is released once the pending call is done
+    assert (
+        await executor.run(threading.current_thread) is not threading.current_thread()
+    )
+    executor.shutdown()
@@ -1,23 +1,39 @@
-from unittest.mock import patch
+import json
+import os
+import threading
+from unittest.mock import Mock, patch
 
 import pytest
+from jupyterhub import orm, roles  # type: ignore
+from jupyterhub.crypto import CryptKeeper  # type: ignore
+from jupyterhub.user import User, UserDict  # type: ignore
 from tornado.httputil import HTTPServerRequest
-from tornado.web import HTTPError
+from tornado.web import Application, HTTPError
 
 import ltiauthenticator.lti13.handlers
+from ltiauthenticator.lti13.auth import LTI13Authenticator
 from ltiauthenticator.lti13.error import InvalidAudienceError
 from ltiauthenticator.lti13.handlers import (
+    LAUNCH_STATE_COOKIE_NAME,
     NONCE_STATE_COOKIE_NAME,
     STATE_COOKIE_NAME,
     LTI13CallbackHandler,
+    LTI13ConfigHandler,
     LTI13LoginInitHandler,
     _deserialize_state,
     _serialize_state,
     get_nonce,
     make_nonce_state,
 )
+from ltiauthenticator.lti13.replay import ReplayCacheFull
+from ltiauthenticator.lti13.state import (
+    LaunchState,
+    MemoryStateStore,
+    SQLiteStateStore,
+    StateStoreError,
+)
 from ltiauthenticator.lti13.validator import LTI13LaunchValidator
-from ltiauthenticator.utils import convert_request_to_dict
+from ltiauthenticator.utils import convert_request_to_dict, digest_launch_request
 
 from .mocking import MockLTI13Authenticator
 
@@ -33,7 +49,9 @@ async def test_lti_13_serialization_roundtrip():
 async def test_lti_13_handler_paths(app):
     """Test if all handlers are correctly set with the LTI13Authenticator."""
     auth = MockLTI13Authenticator()
-    handlers = auth.get_handlers(app)
+    with patch.object(auth.jwks_cache, "start_background_refresh") as mock_start:
+        handlers = auth.get_handlers(app)
+    mock_start.assert_called_once_with(auth.jwks_endpoint)
     handler_paths = [route[0] for route in handlers]
     assert "lti13/config" in handler_paths
     assert "lti13/oauth_login" in handler_paths
@@ -73,9 +91,9 @@ async def test_lti13_login_init_handler_invocation(method, req_handler):
         ltiauthenticator.lti13.handlers, "get_nonce", return_value=nonce
     ):
         if method == "GET":
-            handler.get()
+            await handler.get()
         elif method == "POST":
-            handler.post()
+            await handler.post()
         mock_validate_login_request.assert_called_once()
         mock_get_state.assert_called_once()
         mock_set_state_cookie.assert_called_once()
@@ -142,7 +160,8 @@ async def test_lti13_callback_handler_post_invocation(req_handler):
     """Test invokation of parameter, token and state validation."""
     authenticator = MockLTI13Authenticator()
     decoded_jwt = "decoded_abc"
-    username = "somebody"
+    user = Mock()
+    user.name = "somebody"
     handler = req_handler(
         LTI13CallbackHandler,
         uri="https://hub.example.com/",
@@ -152,14 +171,14 @@ async def test_lti13_callback_handler_post_invocation(req_handler):
     with patch.object(
         handler, "decode_and_validate_launch_request", return_value=decoded_jwt
     ) as mock_validate, patch.object(
-        handler, "login_user", return_value=username
+        handler, "login_user", return_value=user
     ) as mock_login_user, patch.object(
-        handler, "redirect_to_next_url"
+        handler, "redirect_to_next_url", return_value="/hub/home"
     ) as mock_redirect_to_next_url:
         await handler.post()
         mock_validate.assert_called_once()
         mock_login_user.assert_called_once_with(decoded_jwt)
-        mock_redirect_to_next_url.assert_called_once_with(username)
+        mock_redirect_to_next_url.assert_called_once_with(user)
 
 
 async def test_lti13_callback_handler_post_raises_403_on_non_user(req_handler):
@@ -222,7 +241,7 @@ async def test_lti13_callback_handler_decode_and_validate_launch_request_invocat
     ) as mock_validate_azp_claim, patch.object(
         handler, "check_nonce"
     ) as mock_check_nonce:
-        handler.decode_and_validate_launch_request()
+        await handler.decode_and_validate_launch_request()
 
         mock_validate_auth_response.assert_called_once()
         mock_check_state.assert_called_once()
@@ -232,6 +251,9 @@ async def test_lti13_callback_handler_decode_and_validate_launch_request_invocat
             audience=authenticator.client_id,
             jwks_endpoint=authenticator.jwks_endpoint,
             jwks_algorithms=authenticator.jwks_algorithms,
+            jwks_cache=authenticator.jwks_cache,
+            executor=authenticator.verify_executor,
+            replay_cache=authenticator.replay_cache,
         )
         mock_validate_id_token.assert_called_once_with(decoded_jwt)
         mock_validate_azp_claim.assert_called_once_with(
@@ -416,3 +438,361 @@ async def test_lti13_callback_handler_get_next_url_returns_user_default_url(
     ):
         next_url = handler.get_next_url("some user")
     assert next_url == "some user"
+
+
+async def get_config(req_handler, authenticator, headers=None):
+    """Request the LTI 1.3 JSON config and return the finished handler."""
+    handler = req_handler(LTI13ConfigHandler, authenticator=authenticator)
+    handler.request.headers.update(headers or {})
+    with patch.object(handler, "flush"):
+        await handler.get()
+        handler.finish()
+    return handler
+
+
+async def test_lti13_config_handler_caches_config(req_handler):
+    authenticator = MockLTI13Authenticator(uri_scheme="https", config_cache_max_age=60)
+
+    handler = await get_config(req_handler, authenticator)
+
+    assert handler.get_status() == 200
+    assert handler._headers["Cache-Control"] == "max-age=60"
+    body = b"".join(handler._write_buffer)
+    config = json.loads(body)
+    assert config["title"] == "JupyterHub"
+    assert config["oidc_initiation_url"].startswith("https://")
+    with patch.object(LTI13ConfigHandler, "_render_config") as mock_render_config:
+        handler = await get_config(req_handler, authenticator)
+        assert b"".join(handler._write_buffer) == body
+        assert not mock_render_config.called
+
+
+async def test_lti13_config_handler_responds_not_modified_for_matching_etag(
+    req_handler,
+):
+    authenticator = MockLTI13Authenticator(uri_scheme="https", config_cache_max_age=0)
+    handler = await get_config(req_handler, authenticator)
+    assert handler._headers["Cache-Control"] == "no-cache"
+
+    handler = await get_config(
+        req_handler, authenticator, {"If-None-Match": handler._headers["Etag"]}
+    )
+
+    assert handler.get_status() == 304
+
+
+async def test_lti13_config_handler_renders_config_again_when_traits_change(
+    req_handler,
+):
+    authenticator = MockLTI13Authenticator(uri_scheme="https")
+    etag = (await get_config(req_handler, authenticator))._headers["Etag"]
+
+    authenticator.tool_name = "Other tool"
+    handler = await get_config(req_handler, authenticator, {"If-None-Match": etag})
+
+    assert handler.get_status() == 200
+    assert json.loads(b"".join(handler._write_buffer))["title"] == "Other tool"
+
+
+async def login(req_handler, authenticator, next_url):
+    """Initiate a login and return the OAuth state, nonce and cookies set."""
+    handler = req_handler(
+        LTI13LoginInitHandler,
+        uri=(
+            "https://hub.example.com/?iss=https://platform.example.com"
+            f"&login_hint=hint&target_link_uri=https://hub.example.com&next={next_url}"
+        ),
+        authenticator=authenticator,
+    )
+    with patch.object(handler, "authorize_redirect") as mock_authorize_redirect:
+        with patch.object(handler, "_set_oauth_cookie") as mock_set_oauth_cookie:
+            await handler.post()
+    kwargs = mock_authorize_redirect.call_args.kwargs
+    cookies = dict(call.args for call in mock_set_oauth_cookie.call_args_list)
+    return kwargs["state"], kwargs["nonce"], cookies
+
+
+async def test_lti13_compact_state_cookie_roundtrip(req_handler):
+    authenticator = MockLTI13Authenticator(compact_state_cookie=True)
+    state, nonce, cookies = await login(
+        req_handler, authenticator, "/hub/user-redirect/lab"
+    )
+    assert list(cookies) == [LAUNCH_STATE_COOKIE_NAME]
+
+    handler = req_handler(LTI13CallbackHandler, authenticator=authenticator)
+    with patch.object(
+        handler,
+        "get_secure_cookie",
+        return_value=cookies[LAUNCH_STATE_COOKIE_NAME].encode(),
+    ) as mock_get_cookie, patch.object(
+        handler, "_get_state_from_url", return_value=state
+    ):
+        handler.check_state()
+        handler.check_nonce({"nonce": nonce})
+        assert handler.get_next_url() == "/hub/user-redirect/lab"
+    mock_get_cookie.assert_called_once_with(LAUNCH_STATE_COOKIE_NAME)
+
+
+async def test_lti13_compact_state_cookie_drops_next_url_beyond_max_size(
+    req_handler,
+):
+    authenticator = MockLTI13Authenticator(
+        compact_state_cookie=True, state_cookie_max_size=100
+    )
+
+    _, _, cookies = await login(req_handler, authenticator, "/hub/" + "a" * 100)
+
+    assert LaunchState.decode(cookies[LAUNCH_STATE_COOKIE_NAME]).next_url is None
+
+
+async def test_lti13_compact_state_cookie_check_state_raises_400_if_cookie_invalid(
+    req_handler,
+):
+    authenticator = MockLTI13Authenticator(compact_state_cookie=True)
+    handler = req_handler(LTI13CallbackHandler, authenticator=authenticator)
+
+    with patch.object(
+        handler, "get_secure_cookie", return_value=b"invalid"
+    ), pytest.raises(HTTPError) as e:
+        handler.check_state()
+    assert str(e.value) == "HTTP 400: Bad Request (OAuth state missing from cookies)"
+
+
+async def test_lti13_state_store_roundtrip(req_handler):
+    authenticator = MockLTI13Authenticator(state_store=MemoryStateStore())
+    state, nonce, cookies = await login(
+        req_handler, authenticator, "/hub/user-redirect/lab"
+    )
+    assert cookies == {}
+
+    handler = req_handler(LTI13CallbackHandler, authenticator=authenticator)
+    with patch.object(handler, "get_secure_cookie") as mock_get_cookie, patch.object(
+        handler, "_get_state_from_url", return_value=state
+    ):
+        handler.check_state()
+        handler.check_nonce({"nonce": nonce})
+        assert handler.get_next_url() == "/hub/user-redirect/lab"
+    assert not mock_get_cookie.called
+
+    # the state can only be used once
+    handler = req_handler(LTI13CallbackHandler, authenticator=authenticator)
+    with patch.object(
+        handler, "_get_state_from_url", return_value=state
+    ), pytest.raises(HTTPError) as e:
+        handler.check_state()
+    assert str(e.value) == "HTTP 400: Bad Request (OAuth state unknown or expired)"
+
+
+async def test_lti13_sqlite_state_store_is_accessed_in_thread(req_handler, tmp_path):
+    state_store = SQLiteStateStore(path=str(tmp_path / "states.sqlite"))
+    authenticator = MockLTI13Authenticator(state_store=state_store)
+    threads = []
+
+    def record_thread(method):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    with patch.object(state_store, "put", record_thread(state_store.put)), patch.object(
+        state_store, "pop", record_thread(state_store.pop)
+    ):
+        state, nonce, _ = await login(
+            req_handler, authenticator, "/hub/user-redirect/lab"
+        )
+        handler = req_handler(LTI13CallbackHandler, authenticator=authenticator)
+        with patch.object(handler, "_get_state_from_url", return_value=state):
+            await handler.load_launch_state()
+            handler.check_state()
+            handler.check_nonce({"nonce": nonce})
+            assert handler.get_next_url() == "/hub/user-redirect/lab"
+
+    assert len(threads) == 2
+    assert threading.current_thread() not in threads
+    state_store.close()
+
+
+async def test_lti13_state_store_errors_raise_503(req_handler):
+    state_store = MemoryStateStore()
+    authenticator = MockLTI13Authenticator(state_store=state_store)
+    handler = req_handler(LTI13CallbackHandler, authenticator=authenticator)
+
+    with patch.object(
+        state_store, "pop", side_effect=StateStoreError("database is locked")
+    ), patch.object(
+        handler, "_get_state_from_url", return_value="state"
+    ), pytest.raises(
+        HTTPError
+    ) as e:
+        handler.check_state()
+    assert e.value.status_code == 503
+
+
+async def test_lti13_callback_handler_post_raises_429_if_replay_cache_is_full(
+    req_handler,
+):
+    handler = req_handler(LTI13CallbackHandler, authenticator=MockLTI13Authenticator())
+
+    with patch.object(
+        handler,
+        "decode_and_validate_launch_request",
+        side_effect=ReplayCacheFull("full"),
+    ), pytest.raises(HTTPError) as e:
+        await handler.post()
+    assert e.value.status_code == 429
+
+
+async def test_lti13_callback_handler_redirects_duplicate_launch(req_handler):
+    authenticator = MockLTI13Authenticator()
+    user = Mock()
+    user.name = "somebody"
+
+    handlers = []
+    for _ in range(2):
+        handler = req_handler(
+            LTI13CallbackHandler,
+            uri="https://hub.example.com/?id_token=token&state=state",
+            method="POST",
+            authenticator=authenticator,
+        )
+        with patch.object(
+            handler, "decode_and_validate_launch_request", return_value={}
+        ) as mock_validate, patch.object(
+            handler, "login_user", return_value=user
+        ), patch.object(
+            handler, "get_current_user", return_value=user
+        ), patch.object(
+            handler, "get_next_url", return_value="/hub/user-redirect/lab"
+        ), patch.object(
+            handler, "redirect"
+        ) as mock_redirect:
+            await handler.post()
+        handlers.append((mock_validate, mock_redirect))
+
+    (first_validate, first_redirect), (second_validate, second_redirect) = handlers
+    first_validate.assert_called_once()
+    second_validate.assert_not_called()
+    first_redirect.assert_called_once_with("/hub/user-redirect/lab")
+    second_redirect.assert_called_once_with("/hub/user-redirect/lab")
+
+
+async def test_lti13_callback_handler_validates_duplicate_launch_of_other_user(
+    req_handler,
+):
+    authenticator = MockLTI13Authenticator()
+    authenticator.launch_cache.put(
+        digest_launch_request({"id_token": [b"token"]}), "somebody", "/hub/home"
+    )
+    other_user = Mock()
+    other_user.name = "somebody_else"
+    handler = req_handler(
+        LTI13CallbackHandler,
+        uri="https://hub.example.com/?id_token=token",
+        method="POST",
+        authenticator=authenticator,
+    )
+
+    with patch.object(
+        handler, "get_current_user", return_value=other_user
+    ), patch.object(
+        handler, "decode_and_validate_launch_request", side_effect=HTTPError(400)
+    ) as mock_validate, pytest.raises(
+        HTTPError
+    ):
+        await handler.post()
+    mock_validate.assert_called_once()
+
+
+@pytest.fixture
+def hub_login():
+    """
+    Log users in with JupyterHub's `login_user` and a database in memory, recording
+    the auth_states saved.
+    """
+    session_factory = orm.new_session_factory("sqlite://")
+    db = session_factory()
+    for role in roles.get_default_roles():
+        roles.create_role(db, role)
+    authenticator = LTI13Authenticator(allow_all=True, enable_auth_state=True)
+    settings = dict(
+        db=db,
+        authenticator=authenticator,
+        cookie_secret=os.urandom(32),
+        hub=Mock(base_url="/hub/"),
+    )
+    settings["users"] = UserDict(lambda: db, settings)
+    application = Application(**settings)
+    saved = []
+    save_auth_state = User.save_auth_state
+
+    async def record_auth_state(user, auth_state):
+        saved.append(auth_state)
+        await save_auth_state(user, auth_state)
+
+    async def _hub_login(auth_state, admin_users=frozenset(), groups=None):
+        authenticator.admin_users = set(admin_users)
+        authenticator.manage_groups = groups is not None
+        handler = LTI13CallbackHandler(
+            application, HTTPServerRequest(method="POST", uri="/", connection=Mock())
+        )
+        with patch.object(handler, "set_login_cookie"), patch.object(
+            authenticator,
+            "authenticate",
+            return_value={
+                "name": "student",
+                "auth_state": auth_state,
+                **({"groups": groups} if groups is not None else {}),
+            },
+        ):
+            return await handler.login_user()
+
+    crypt_keeper = CryptKeeper.instance()
+    keys, crypt_keeper.keys = crypt_keeper.keys, [os.urandom(32)]
+    with patch.object(User, "save_auth_state", record_auth_state):
+        yield _hub_login, saved, settings["users"], db
+    crypt_keeper.keys = keys
+    db.close()
+
+
+async def test_lti13_login_skips_saving_unchanged_auth_state(hub_login):
+    login, saved, _, _ = hub_login
+    user = await login({"sub": "1", "nonce": "a", "iat": 1})
+    same_user = await login({"sub": "1", "nonce": "b", "iat": 2})
+
+    assert same_user is user
+    assert saved == [{"sub": "1", "nonce": "a", "iat": 1}]
+    assert "user" in [role.name for role in user.roles]
+
+    await login({"sub": "1", "email": "student@example.com", "nonce": "c"})
+    assert len(saved) == 2
+
+
+async def test_lti13_login_saves_auth_state_if_admin_changes(hub_login):
+    login, saved, _, _ = hub_login
+    await login({"sub": "1"})
+    user = await login({"sub": "1"}, admin_users={"student"})
+
+    assert len(saved) == 2
+    assert user.admin
+    assert "admin" in [role.name for role in user.roles]
+
+
+async def test_lti13_login_saves_auth_state_of_recreated_user(hub_login):
+    login, saved, users, db = hub_login
+    user = await login({"sub": "1"})
+    users.delete(user)
+    db.add(orm.User(name="student"))
+    db.commit()
+
+    await login({"sub": "1"})
+    assert len(saved) == 2
+
+
+async def test_lti13_login_saves_auth_state_with_managed_groups(hub_login):
+    login, saved, _, _ = hub_login
+    await login({"sub": "1"}, groups=["course"])
+    user = await login({"sub": "1"}, groups=["course", "other_course"])
+
+    assert len(saved) == 2
+    assert sorted(group.name for group in user.groups) == ["course", "other_course"]
@@ -0,0 +1,490 @@
+import asyncio
+import json
+import os
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
+import jwt
+import pytest
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.httputil import HTTPHeaders
+
+from ltiauthenticator.lti13.error import TokenError
+from ltiauthenticator.lti13.jwks import (
+    CachedKeySet,
+    JWKSCache,
+    get_cache_lifetime,
+    get_jwk_thumbprint,
+    main,
+)
+from ltiauthenticator.lti13.validator import LTI13LaunchValidator
+
+from .mocking import MockLTI13Authenticator, patched_jwk_client
+
+JWKS_ENDPOINT = "https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json"
+
+
+@pytest.mark.parametrize(
+    "headers,expected",
+    [
+        ({}, None),
+        ({"Cache-Control": "public, max-age=3600"}, 3600),
+        ({"Cache-Control": "s-maxage=10, max-age=120"}, 120),
+        ({"Cache-Control": "no-store"}, 0),
+        ({"Cache-Control": "no-cache, max-age=3600"}, 0),
+        (
+            {
+                "Date": "Wed, 21 Oct 2026 07:00:00 GMT",
+                "Expires": "Wed, 21 Oct 2026 07:28:00 GMT",
+            },
+            1680,
+        ),
+        ({"Expires": "0"}, 0),
+        (
+            {
+                "Cache-Control": "max-age=60",
+                "Date": "Wed, 21 Oct 2026 07:00:00 GMT",
+                "Expires": "Wed, 21 Oct 2026 07:28:00 GMT",
+            },
+            60,
+        ),
+    ],
+)
+def test_get_cache_lifetime(headers, expected):
+    assert get_cache_lifetime(headers) == expected
+
+
+async def test_jwks_cache_does_not_refetch_known_kid(jwks_endpoint_response):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache()
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        first = await cache.get_signing_key(JWKS_ENDPOINT, kid)
+        second = await cache.get_signing_key(JWKS_ENDPOINT, kid)
+    mock_fetch.assert_called_once_with(JWKS_ENDPOINT)
+    assert first.key_id == second.key_id == kid
+
+
+async def test_jwks_cache_refetches_expired_key_set(jwks_endpoint_response):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache(min_ttl=0, max_stale=0)
+    with patched_jwk_client(
+        jwks_endpoint_response, {"Cache-Control": "max-age=0"}
+    ) as mock_fetch:
+        await cache.get_signing_key(JWKS_ENDPOINT, kid)
+        await cache.get_signing_key(JWKS_ENDPOINT, kid)
+    assert mock_fetch.call_count == 2
+
+
+async def test_jwks_cache_ttl_is_bounded(jwks_endpoint_response):
+    cache = JWKSCache(min_ttl=30, max_ttl=600)
+    with patched_jwk_client(jwks_endpoint_response, {"Cache-Control": "no-store"}):
+        key_set = await cache.refresh(JWKS_ENDPOINT)
+    assert key_set.expires_at - key_set.fetched_at == 30
+    with patched_jwk_client(jwks_endpoint_response, {"Cache-Control": "max-age=86400"}):
+        key_set = await cache.refresh(JWKS_ENDPOINT)
+    assert key_set.expires_at - key_set.fetched_at == 600
+
+
+async def test_jwks_cache_refetches_on_unknown_kid(jwks_endpoint_response):
+    cache = JWKSCache()
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch, pytest.raises(
+        TokenError
+    ):
+        await cache.get_signing_key(JWKS_ENDPOINT, "unknown-kid")
+    mock_fetch.assert_called_once()
+
+
+async def test_jwks_cache_rejects_non_string_kid(jwks_endpoint_response):
+    cache = JWKSCache()
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch, pytest.raises(
+        TokenError, match="must be a string"
+    ):
+        await cache.get_signing_key(JWKS_ENDPOINT, ["x"])
+    mock_fetch.assert_not_called()
+
+
+def test_cached_key_set_skips_unusable_keys(jwks_endpoint_response):
+    jwk = jwks_endpoint_response["keys"][0]
+    key_set = CachedKeySet(
+        {
+            "keys": [
+                jwk,
+                {**jwk, "kid": "unknown-kty", "kty": "XYZ"},
+                {**jwk, "kid": "list-kty", "kty": ["RSA"]},
+                {**jwk, "kid": ["list-kid"]},
+                "not a key",
+            ]
+        },
+        0,
+        0,
+    )
+    assert list(key_set.keys) == [jwk["kid"]]
+
+
+async def test_jwks_cache_raises_token_error_for_malformed_key(
+    jwks_endpoint_response,
+):
+    jwk = {**jwks_endpoint_response["keys"][0], "kid": "malformed", "n": "!"}
+    cache = JWKSCache()
+    with patched_jwk_client({"keys": [jwk]}), pytest.raises(
+        TokenError, match="Unable to use the signing key malformed"
+    ):
+        await cache.get_signing_key(JWKS_ENDPOINT, "malformed")
+
+
+async def test_jwks_cache_is_shared_by_launches(
+    launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
+):
+    authenticator = MockLTI13Authenticator()
+    assert authenticator.jwks_cache is authenticator.jwks_cache
+
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        for _ in range(3):
+            await LTI13LaunchValidator().verify_and_decode_jwt(
+                encoded_jwt=launch_req_jwt,
+                issuer=launch_req_jwt_decoded["iss"],
+                audience={launch_req_jwt_decoded["aud"]},
+                jwks_endpoint=JWKS_ENDPOINT,
+                jwks_algorithms=["RS256"],
+                jwks_cache=authenticator.jwks_cache,
+            )
+    mock_fetch.assert_called_once()
+
+
+async def test_jwks_cache_fetch_uses_async_http_client_with_timeouts(
+    jwks_endpoint_response,
+):
+    cache = JWKSCache(connect_timeout=1.5, request_timeout=3)
+    response = Mock(
+        body=json.dumps(jwks_endpoint_response).encode(),
+        headers=HTTPHeaders({"Cache-Control": "max-age=120"}),
+    )
+    with patch.object(
+        AsyncHTTPClient, "fetch", new=AsyncMock(return_value=response)
+    ) as mock_fetch:
+        jwks, headers = await cache.fetch(JWKS_ENDPOINT)
+
+    assert jwks == jwks_endpoint_response
+    assert get_cache_lifetime(headers) == 120
+    assert mock_fetch.call_args.args == (JWKS_ENDPOINT,)
+    assert mock_fetch.call_args.kwargs["connect_timeout"] == 1.5
+    assert mock_fetch.call_args.kwargs["request_timeout"] == 3
+
+
+async def test_jwks_cache_fetch_raises_token_error_on_timeout():
+    cache = JWKSCache()
+    with patch.object(
+        AsyncHTTPClient,
+        "fetch",
+        new=AsyncMock(side_effect=HTTPClientError(599, "Timeout")),
+    ), pytest.raises(TokenError):
+        await cache.fetch(JWKS_ENDPOINT)
+
+
+async def test_jwks_cache_coalesces_concurrent_refreshes(jwks_endpoint_response):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache()
+
+    async def slow_fetch(jwks_endpoint):
+        await asyncio.sleep(0.01)
+        return jwks_endpoint_response, {}
+
+    with patch.object(cache, "fetch", side_effect=slow_fetch) as mock_fetch:
+        keys = await asyncio.gather(
+            *(cache.get_signing_key(JWKS_ENDPOINT, kid) for _ in range(10))
+        )
+    mock_fetch.assert_called_once_with(JWKS_ENDPOINT)
+    assert {key.key_id for key in keys} == {kid}
+
+
+async def test_jwks_cache_shares_refresh_errors_with_all_waiters():
+    cache = JWKSCache()
+
+    async def failing_fetch(jwks_endpoint):
+        await asyncio.sleep(0.01)
+        raise TokenError("JWKS endpoint unavailable")
+
+    with patch.object(cache, "fetch", side_effect=failing_fetch) as mock_fetch:
+        results = await asyncio.gather(
+            *(cache.get_signing_key(JWKS_ENDPOINT, "kid") for _ in range(3)),
+            return_exceptions=True,
+        )
+    mock_fetch.assert_called_once()
+    assert all(isinstance(r, TokenError) for r in results)
+
+
+async def test_jwks_cache_limits_pending_refreshes(jwks_endpoint_response):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache(max_pending_refreshes=2)
+
+    async def slow_fetch(jwks_endpoint):
+        await asyncio.sleep(0.01)
+        return jwks_endpoint_response, {}
+
+    with patch.object(cache, "fetch", side_effect=slow_fetch):
+        results = await asyncio.gather(
+            *(cache.get_signing_key(JWKS_ENDPOINT, kid) for _ in range(3)),
+            return_exceptions=True,
+        )
+    assert sum(isinstance(r, TokenError) for r in results) == 1
+    # the limit only applies while a refresh is pending
+    assert (await cache.get_signing_key(JWKS_ENDPOINT, kid)).key_id == kid
+
+
+async def test_jwks_cache_prefetches_and_refreshes_in_background(
+    jwks_endpoint_response,
+):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache()
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch, patch.object(
+        cache, "get_refresh_delay", return_value=0.05
+    ):
+        cache.start_background_refresh(JWKS_ENDPOINT)
+        # starting twice does not spawn a second task
+        cache.start_background_refresh(JWKS_ENDPOINT)
+        await asyncio.sleep(0.01)
+        mock_fetch.assert_called_once_with(JWKS_ENDPOINT)
+
+        # a launch finds the key without fetching it
+        await cache.get_signing_key(JWKS_ENDPOINT, kid)
+        mock_fetch.assert_called_once()
+
+        await asyncio.sleep(0.1)
+        assert mock_fetch.call_count >= 2
+        cache.stop_background_refresh()
+
+
+def test_jwks_cache_does_not_refresh_without_running_loop():
+    cache = JWKSCache()
+    cache.start_background_refresh(JWKS_ENDPOINT)
+    assert not cache._refresh_tasks
+
+
+@pytest.mark.parametrize(
+    "ttl,refresh_interval,expected",
+    [(600, 0, 570), (600, 120, 120), (10, 0, 1)],
+)
+def test_jwks_cache_refresh_delay(ttl, refresh_interval, expected):
+    cache = JWKSCache(
+        refresh_before_expiry=30, refresh_interval=refresh_interval, refresh_jitter=0
+    )
+    key_set = CachedKeySet({"keys": []}, 0, time.time() + ttl)
+    assert cache.get_refresh_delay(key_set) == pytest.approx(expected, abs=1)
+
+
+async def test_jwks_cache_snapshot_is_loaded_at_startup(
+    tmp_path, jwks_endpoint_response
+):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    snapshot_path = str(tmp_path / "jwks.json")
+    with patched_jwk_client(jwks_endpoint_response):
+        await JWKSCache(snapshot_path=snapshot_path).refresh(JWKS_ENDPOINT)
+
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        cache = JWKSCache(snapshot_path=snapshot_path)
+        key = await cache.get_signing_key(JWKS_ENDPOINT, kid)
+    mock_fetch.assert_not_called()
+    assert key.key_id == kid
+
+
+async def test_jwks_cache_ignores_expired_snapshot(tmp_path, jwks_endpoint_response):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    snapshot_path = tmp_path / "jwks.json"
+    key_set = CachedKeySet(jwks_endpoint_response, 0, time.time() - 1)
+    snapshot_path.write_text(
+        json.dumps({"key_sets": {JWKS_ENDPOINT: key_set.to_dict()}})
+    )
+
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        cache = JWKSCache(snapshot_path=str(snapshot_path))
+        await cache.get_signing_key(JWKS_ENDPOINT, kid)
+    mock_fetch.assert_called_once()
+    # the snapshot has been replaced with the fresh key set
+    snapshot = json.loads(snapshot_path.read_text())
+    assert snapshot["key_sets"][JWKS_ENDPOINT]["expires_at"] > time.time()
+
+
+async def test_jwks_cache_ignores_corrupt_snapshot(tmp_path, jwks_endpoint_response):
+    snapshot_path = tmp_path / "jwks.json"
+    snapshot_path.write_text("{not json")
+    cache = JWKSCache(snapshot_path=str(snapshot_path))
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        await cache.refresh(JWKS_ENDPOINT)
+    mock_fetch.assert_called_once()
+
+
+async def test_jwks_cache_snapshot_is_shared_between_hubs(
+    tmp_path, jwks_endpoint_response
+):
+    snapshot_path = str(tmp_path / "jwks.json")
+    hub1 = JWKSCache(snapshot_path=snapshot_path)
+    hub2 = JWKSCache(snapshot_path=snapshot_path)
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        await hub1.refresh(JWKS_ENDPOINT)
+        await hub2.refresh(JWKS_ENDPOINT)
+    mock_fetch.assert_called_once()
+
+
+async def test_jwks_cache_fetches_rotated_key_missing_from_snapshot(
+    tmp_path, jwks_endpoint_response
+):
+    snapshot_path = tmp_path / "jwks.json"
+    cache = JWKSCache(snapshot_path=str(snapshot_path), min_refresh_interval=0)
+    with patched_jwk_client(jwks_endpoint_response):
+        key_set = await cache.refresh(JWKS_ENDPOINT)
+
+    # another hub wrote a newer snapshot before the platform rotated its keys
+    newer_key_set = CachedKeySet(
+        jwks_endpoint_response, key_set.fetched_at + 1, key_set.expires_at + 1
+    )
+    snapshot_path.write_text(
+        json.dumps({"key_sets": {JWKS_ENDPOINT: newer_key_set.to_dict()}})
+    )
+    os.utime(snapshot_path, (time.time() + 1, time.time() + 1))
+
+    rotated = {"keys": [{**jwks_endpoint_response["keys"][0], "kid": "new"}]}
+    with patched_jwk_client(rotated) as mock_fetch:
+        key = await cache.get_signing_key(JWKS_ENDPOINT, "new")
+    mock_fetch.assert_called_once()
+    assert key.key_id == "new"
+
+
+def test_prefetch_jwks_command_writes_snapshot(
+    tmp_path, capsys, jwks_endpoint_response
+):
+    snapshot_path = tmp_path / "jwks.json"
+    with patched_jwk_client(jwks_endpoint_response):
+        assert main([JWKS_ENDPOINT, "--snapshot-path", str(snapshot_path)]) == 0
+    snapshot = json.loads(snapshot_path.read_text())
+    assert JWKS_ENDPOINT in snapshot["key_sets"]
+    assert f"{JWKS_ENDPOINT}: 1 keys" in capsys.readouterr().out
+
+
+def test_prefetch_jwks_command_fails_on_fetch_error(tmp_path):
+    with patch.object(JWKSCache, "fetch", side_effect=TokenError("unavailable")):
+        assert main([JWKS_ENDPOINT, "--snapshot-path", str(tmp_path / "x")]) == 1
+
+
+def test_get_jwk_thumbprint():
+    """Example of RFC 7638 section 3.1."""
+    jwk = {
+        "kty": "RSA",
+        "n": "0vx7agoebGcQSuuPiLJXZptN9nndrQmbXEps2aiAFbWhM78LhWx4cbbfAAtVT86zwu1RK7aPFFxuhDR1L6tSoc_BJECPebWKRXjBZCiFV4n3oknjhMstn64tZ_2W-5JsGY4Hc5n9yBXArwl93lqt7_RN5w6Cf0h4QyQ5v-65YGjQR0_FDW2QvzqY368QQMicAtaSqzs8KJZgnYb9c7d0zgdAZHzu6qMQvRL5hajrn1n91CbOpbISD08qNLyrdkt-bFTWhAI4vMQFh6WeZu0fM4lFd2NcRwr3XPksINHaQ-G_xBniIqbw0Ls1jF44-csFCur-kEgU8awapJzKnqDKgw",
+        "e": "AQAB",
+        "alg": "RS256",
+        "kid": "2011-04-29",
+    }
+    assert get_jwk_thumbprint(jwk) == "NzbLsXh8uDCcd-6MNwXF4W_7noWXFZAfHkxZsRGC9Xs"
+
+
+async def test_jwks_cache_parses_public_key_once(jwks_endpoint_response):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache()
+    with patched_jwk_client(jwks_endpoint_response), patch.object(
+        jwt, "PyJWK", wraps=jwt.PyJWK
+    ) as mock_pyjwk:
+        first = await cache.get_signing_key(JWKS_ENDPOINT, kid)
+        # a refreshed key set with the same key material reuses the parsed key
+        await cache.refresh(JWKS_ENDPOINT)
+        second = await cache.get_signing_key(JWKS_ENDPOINT, kid)
+    mock_pyjwk.assert_called_once()
+    assert first is second
+
+
+async def test_jwks_cache_bounds_parsed_public_keys(jwks_endpoint_response):
+    jwk = jwks_endpoint_response["keys"][0]
+    jwks = {"keys": [{**jwk, "kid": "a"}, {**jwk, "kid": "b", "alg": "RS512"}]}
+    cache = JWKSCache(key_cache_size=1)
+    with patched_jwk_client(jwks):
+        await cache.get_signing_key(JWKS_ENDPOINT, "a")
+        await cache.get_signing_key(JWKS_ENDPOINT, "b")
+    assert len(cache._public_keys) == 1
+
+
+async def test_jwks_cache_remembers_unknown_kid(jwks_endpoint_response):
+    cache = JWKSCache(min_refresh_interval=0)
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        for _ in range(3):
+            with pytest.raises(TokenError):
+                await cache.get_signing_key(JWKS_ENDPOINT, "forged-kid")
+    mock_fetch.assert_called_once()
+
+
+async def test_jwks_cache_rate_limits_refreshes_for_unknown_kids(
+    jwks_endpoint_response,
+):
+    cache = JWKSCache(min_refresh_interval=60)
+    with patched_jwk_client(jwks_endpoint_response) as mock_fetch:
+        await cache.refresh(JWKS_ENDPOINT)
+        for i in range(3):
+            with pytest.raises(TokenError):
+                await cache.get_signing_key(JWKS_ENDPOINT, f"forged-kid-{i}")
+    mock_fetch.assert_called_once()
+
+
+async def test_jwks_cache_refreshes_for_rotated_kid(jwks_endpoint_response):
+    jwk = jwks_endpoint_response["keys"][0]
+    cache = JWKSCache(min_refresh_interval=60)
+    with patched_jwk_client({"keys": [{**jwk, "kid": "old"}]}):
+        await cache.refresh(JWKS_ENDPOINT)
+    # the last refresh is longer ago than min_refresh_interval
+    cache._key_sets[JWKS_ENDPOINT].fetched_at -= 60
+    with patched_jwk_client({"keys": [{**jwk, "kid": "new"}]}) as mock_fetch:
+        key = await cache.get_signing_key(JWKS_ENDPOINT, "new")
+    mock_fetch.assert_called_once()
+    assert key.key_id == "new"
+
+
+async def test_jwks_cache_serves_stale_key_set_while_revalidating(
+    jwks_endpoint_response,
+):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache(min_ttl=0, max_stale=300)
+    with patched_jwk_client(jwks_endpoint_response, {"Cache-Control": "max-age=0"}):
+        await cache.refresh(JWKS_ENDPOINT)
+    with patch.object(
+        cache, "fetch", side_effect=TokenError("JWKS endpoint unavailable")
+    ) as mock_fetch:
+        for _ in range(3):
+            assert (await cache.get_signing_key(JWKS_ENDPOINT, kid)).key_id == kid
+        await asyncio.sleep(0.01)
+    # the failed revalidation backs off instead of querying for every launch
+    mock_fetch.assert_called_once()
+
+
+async def test_jwks_cache_does_not_serve_key_set_beyond_max_stale(
+    jwks_endpoint_response,
+):
+    kid = jwks_endpoint_response["keys"][0]["kid"]
+    cache = JWKSCache(min_ttl=0, max_stale=300)
+    with patched_jwk_client(jwks_endpoint_response, {"Cache-Control": "max-age=0"}):
+        await cache.refresh(JWKS_ENDPOINT)
+    cache._key_sets[JWKS_ENDPOINT].expires_at -= 300
+    with patch.object(
+        cache, "fetch", side_effect=TokenError("JWKS endpoint unavailable")
+    ), pytest.raises(TokenError):
+        await cache.get_signing_key(JWKS_ENDPOINT, kid)
+
+
+async def test_jwks_cache_backs_off_failing_endpoint(jwks_endpoint_response):
+    cache = JWKSCache(backoff_base=10, backoff_max=15)
+    with patch.object(
+        cache, "fetch", side_effect=TokenError("JWKS endpoint unavailable")
+    ) as mock_fetch:
+        for _ in range(3):
+            with pytest.raises(TokenError):
+                await cache.refresh(JWKS_ENDPOINT)
+        mock_fetch.assert_called_once()
+        assert cache._retry_at[JWKS_ENDPOINT] - time.time() == pytest.approx(10, 1)
+
+        # the backoff doubles with every consecutive failure, up to backoff_max
+        cache._retry_at[JWKS_ENDPOINT] = 0
+        with pytest.raises(TokenError):
+            await cache.refresh(JWKS_ENDPOINT)
+        assert cache._retry_at[JWKS_ENDPOINT] - time.time() == pytest.approx(15, 1)
+
+    cache._retry_at[JWKS_ENDPOINT] = 0
+    with patched_jwk_client(jwks_endpoint_response):
+        await cache.refresh(JWKS_ENDPOINT)
+    assert JWKS_ENDPOINT not in cache._failures
+    assert JWKS_ENDPOINT not in cache._retry_at
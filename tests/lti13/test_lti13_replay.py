@@ -0,0 +1,31 @@
+import pytest
+
+from ltiauthenticator.lti13.replay import IdTokenReplayCache, ReplayCacheFull
+
+
+def test_replay_cache_rejects_consumed_id_token():
+    cache = IdTokenReplayCache(ttl=600, max_size=10)
+
+    assert cache.consume("iss", "nonce", now=1000)
+    assert cache.is_consumed("iss", "nonce", now=1001)
+    assert not cache.consume("iss", "nonce", now=1001)
+    # the same nonce of another issuer is a different id_token
+    assert cache.consume("other_iss", "nonce", now=1001)
+
+
+def test_replay_cache_forgets_expired_id_tokens():
+    cache = IdTokenReplayCache(ttl=600, max_size=1)
+    cache.consume("iss", "nonce", now=1000)
+
+    assert not cache.is_consumed("iss", "nonce", now=1600)
+    assert cache.consume("iss", "other_nonce", now=1600)
+
+
+def test_replay_cache_rejects_id_tokens_when_full():
+    cache = IdTokenReplayCache(ttl=600, max_size=2)
+    cache.consume("iss", "nonce1", now=1000)
+    cache.consume("iss", "nonce2", now=1000)
+
+    with pytest.raises(ReplayCacheFull):
+        cache.consume("iss", "nonce3", now=1001)
+    assert cache.is_consumed("iss", "nonce1", now=1001)
@@ -0,0 +1,100 @@
+import pytest
+
+from ltiauthenticator.lti13.state import (
+    LaunchState,
+    MemoryStateStore,
+    SQLiteStateStore,
+    StateStoreError,
+)
+
+
+@pytest.mark.parametrize("next_url", [None, "/hub/user-redirect/git-pull?repo=ä"])
+def test_launch_state_roundtrip(next_url):
+    launch_state = LaunchState.create(next_url)
+
+    assert LaunchState.decode(launch_state.encode()) == launch_state
+
+
+def test_launch_state_is_compact():
+    launch_state = LaunchState.create("/hub/home")
+
+    # version byte, 16 bytes state id, 32 bytes nonce seed and next_url in base64
+    assert len(launch_state.encode()) == 78
+    assert len(launch_state.state) == 32
+
+
+def test_launch_states_are_unique():
+    first, second = LaunchState.create(), LaunchState.create()
+
+    assert first.state != second.state
+    assert first.nonce_state != second.nonce_state
+
+
+@pytest.mark.parametrize(
+    "encoded",
+    ["", "not base64!", LaunchState.create().encode()[:20], "AgAA" * 20],
+)
+def test_launch_state_decode_raises_value_error_on_invalid_state(encoded):
+    with pytest.raises(ValueError):
+        LaunchState.decode(encoded)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state_store(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryStateStore(ttl=60)
+    else:
+        store = SQLiteStateStore(path=str(tmp_path / "states.sqlite"), ttl=60)
+        yield store
+        store.close()
+
+
+def test_state_store_returns_launch_state_once(state_store):
+    launch_state = LaunchState.create("/hub/home")
+    state_store.put(launch_state, now=1000)
+
+    assert state_store.pop(launch_state.state, now=1001) == launch_state
+    assert state_store.pop(launch_state.state, now=1001) is None
+
+
+def test_state_store_forgets_expired_launch_state(state_store):
+    launch_state = LaunchState.create()
+    state_store.put(launch_state, now=1000)
+
+    assert state_store.pop(launch_state.state, now=1060) is None
+
+
+def test_state_store_returns_none_for_unknown_state(state_store):
+    assert state_store.pop(LaunchState.create().state) is None
+
+
+def test_memory_state_store_evicts_oldest_launch_state():
+    state_store = MemoryStateStore(max_size=2)
+    launch_states = [LaunchState.create() for _ in range(3)]
+    for launch_state in launch_states:
+        state_store.put(launch_state)
+
+    assert state_store.pop(launch_states[0].state) is None
+    assert state_store.pop(launch_states[1].state) == launch_states[1]
+    assert state_store.pop(launch_states[2].state) == launch_states[2]
+
+
+def test_sqlite_state_store_is_shared_by_hubs(tmp_path):
+    path = str(tmp_path / "states.sqlite")
+    store, other_store = SQLiteStateStore(path=path), SQLiteStateStore(path=path)
+    launch_state = LaunchState.create("/hub/home")
+
+    store.put(launch_state)
+
+    assert other_store.pop(launch_state.state) == launch_state
+    assert store.pop(launch_state.state) is None
+    store.close()
+    other_store.close()
+
+
+def test_sqlite_state_store_raises_state_store_error(tmp_path):
+    store = SQLiteStateStore(path=str(tmp_path / "states.sqlite"))
+    store.close()
+
+    with pytest.raises(StateStoreError):
+        store.pop(LaunchState.create().state)
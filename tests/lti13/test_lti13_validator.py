@@ -1,11 +1,20 @@
+import base64
+import json
+from unittest.mock import patch
+
 import pytest
 
 from ltiauthenticator.lti13.error import (
+    ClaimsValidationError,
     IncorrectValueError,
     InvalidAudienceError,
     MissingRequiredArgumentError,
+    ReplayedTokenError,
     TokenError,
 )
+from ltiauthenticator.lti13.executor import BoundedExecutor
+from ltiauthenticator.lti13.id_token import EncodedIdToken
+from ltiauthenticator.lti13.jwks import JWKSCache
 from ltiauthenticator.lti13.validator import LTI13LaunchValidator
 
 from .mocking import patched_jwk_client
@@ -22,13 +31,13 @@ def test_validate_login_request_with_invalid_data():
 
 # Tests of verify_and_decode_jwt()
 # -------------------------------------------------------------------------------
-def test_validate_verify_and_decode_jwt(
+async def test_validate_verify_and_decode_jwt(
     launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
 ):
     validator = LTI13LaunchValidator()
 
     with patched_jwk_client(jwks_endpoint_response):
-        result = validator.verify_and_decode_jwt(
+        result = await validator.verify_and_decode_jwt(
             encoded_jwt=launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"],
             audience={launch_req_jwt_decoded["aud"], "something_else"},
@@ -38,13 +47,114 @@ def test_validate_verify_and_decode_jwt(
     assert result == launch_req_jwt_decoded
 
 
-def test_validate_verify_and_decode_jwt_rejects_unsigned_jwt(
+async def test_validate_verify_and_decode_jwt_in_executor(
+    launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
+):
+    validator = LTI13LaunchValidator()
+    executor = BoundedExecutor(max_workers=1, queue_depth=0)
+
+    with patched_jwk_client(jwks_endpoint_response), patch.object(
+        executor, "run", wraps=executor.run
+    ) as mock_run:
+        result = await validator.verify_and_decode_jwt(
+            encoded_jwt=launch_req_jwt,
+            issuer=launch_req_jwt_decoded["iss"],
+            audience={launch_req_jwt_decoded["aud"]},
+            jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+            jwks_algorithms=["RS256"],
+            executor=executor,
+        )
+    executor.shutdown()
+    mock_run.assert_called_once()
+    assert result == launch_req_jwt_decoded
+
+
+async def test_validate_verify_and_decode_jwt_rejects_replayed_jwt_before_verification(
+    launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
+):
+    validator = LTI13LaunchValidator()
+    kwargs = dict(
+        encoded_jwt=launch_req_jwt,
+        issuer=launch_req_jwt_decoded["iss"],
+        audience={launch_req_jwt_decoded["aud"]},
+        jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+        jwks_algorithms=["RS256"],
+    )
+    with patched_jwk_client(jwks_endpoint_response):
+        await validator.verify_and_decode_jwt(**kwargs)
+
+        with patch.object(
+            EncodedIdToken, "verify_signature"
+        ) as mock_verify_signature, pytest.raises(ReplayedTokenError) as e:
+            await validator.verify_and_decode_jwt(**kwargs)
+    assert str(e.value) == "The id_token has already been used"
+    assert not mock_verify_signature.called
+
+
+async def test_validate_verify_and_decode_jwt_rejects_replay_of_jwt_issued_in_future(
+    launch_req_jwt_decoded, encode, jwks_endpoint_response, now
+):
+    """
+    Is an id_token whose iat is within time_leeway in the future remembered for as
+    long as it can be accepted?
+    """
+    launch_req_jwt_decoded["iat"] = now + 30
+    launch_req_jwt_decoded["exp"] = now + 3600
+    validator = LTI13LaunchValidator(max_age=600, time_leeway=30)
+    kwargs = dict(
+        encoded_jwt=encode(launch_req_jwt_decoded),
+        issuer=launch_req_jwt_decoded["iss"],
+        audience={launch_req_jwt_decoded["aud"]},
+        jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+        jwks_algorithms=["RS256"],
+    )
+    with patched_jwk_client(jwks_endpoint_response):
+        with patch("ltiauthenticator.lti13.validator.now", return_value=now), patch(
+            "time.time", return_value=now
+        ):
+            await validator.verify_and_decode_jwt(**kwargs)
+
+        # the id_token is still accepted by its iat 645 seconds later
+        with patch(
+            "ltiauthenticator.lti13.validator.now", return_value=now + 645
+        ), patch("time.time", return_value=now + 645), pytest.raises(
+            ReplayedTokenError
+        ):
+            await validator.verify_and_decode_jwt(**kwargs)
+
+
+async def test_validate_verify_and_decode_jwt_does_not_record_forged_jwt(
+    launch_req_jwt,
+    unsecured_launch_req_jwt,
+    launch_req_jwt_decoded,
+    jwks_endpoint_response,
+):
+    validator = LTI13LaunchValidator()
+    kwargs = dict(
+        issuer=launch_req_jwt_decoded["iss"],
+        audience={launch_req_jwt_decoded["aud"]},
+        jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+        jwks_algorithms=["RS256"],
+    )
+    with patched_jwk_client(jwks_endpoint_response):
+        with pytest.raises(TokenError):
+            await validator.verify_and_decode_jwt(
+                encoded_jwt=unsecured_launch_req_jwt, **kwargs
+            )
+
+        result = await validator.verify_and_decode_jwt(
+            encoded_jwt=launch_req_jwt, **kwargs
+        )
+    assert result == launch_req_jwt_decoded
+
+
+async def test_validate_verify_and_decode_jwt_rejects_unsigned_jwt(
     unsecured_launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
 ):
     validator = LTI13LaunchValidator()
 
     with patched_jwk_client(jwks_endpoint_response), pytest.raises(TokenError) as e:
-        validator.verify_and_decode_jwt(
+        await validator.verify_and_decode_jwt(
             encoded_jwt=unsecured_launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"],
             audience={launch_req_jwt_decoded["aud"]},
@@ -54,13 +164,13 @@ def test_validate_verify_and_decode_jwt_rejects_unsigned_jwt(
     assert str(e.value) == "Signature verification failed"
 
 
-def test_validate_verify_and_decode_jwt_accept_unsigned_jwt_with_no_endpoint(
+async def test_validate_verify_and_decode_jwt_accept_unsigned_jwt_with_no_endpoint(
     unsecured_launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
 ):
     validator = LTI13LaunchValidator()
 
     with patched_jwk_client(jwks_endpoint_response):
-        result = validator.verify_and_decode_jwt(
+        result = await validator.verify_and_decode_jwt(
             encoded_jwt=unsecured_launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"],
             audience={launch_req_jwt_decoded["aud"]},
@@ -71,12 +181,12 @@ def test_validate_verify_and_decode_jwt_accept_unsigned_jwt_with_no_endpoint(
     assert result == launch_req_jwt_decoded
 
 
-def test_verify_and_decode_jwt_fails_on_incorrect_iss(
+async def test_verify_and_decode_jwt_fails_on_incorrect_iss(
     launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
 ):
     validator = LTI13LaunchValidator()
     with patched_jwk_client(jwks_endpoint_response), pytest.raises(TokenError) as e:
-        validator.verify_and_decode_jwt(
+        await validator.verify_and_decode_jwt(
             encoded_jwt=launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"] + "/something_wrong",
             audience={launch_req_jwt_decoded["aud"]},
@@ -86,7 +196,7 @@ def test_verify_and_decode_jwt_fails_on_incorrect_iss(
     assert str(e.value) == "Invalid issuer"
 
 
-def test_verify_and_decode_jwt_fails_on_passed_exp(
+async def test_verify_and_decode_jwt_fails_on_passed_exp(
     launch_req_jwt_decoded, encode, jwks_endpoint_response
 ):
     # make request expired, `iat` is close to "now"
@@ -95,7 +205,7 @@ def test_verify_and_decode_jwt_fails_on_passed_exp(
 
     validator = LTI13LaunchValidator()
     with patched_jwk_client(jwks_endpoint_response), pytest.raises(TokenError) as e:
-        validator.verify_and_decode_jwt(
+        await validator.verify_and_decode_jwt(
             encoded_jwt=launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"],
             audience={launch_req_jwt_decoded["aud"]},
@@ -105,7 +215,7 @@ def test_verify_and_decode_jwt_fails_on_passed_exp(
     assert str(e.value) == "Signature has expired"
 
 
-def test_verify_and_decode_jwt_fails_on_iat_in_the_future(
+async def test_verify_and_decode_jwt_fails_on_iat_in_the_future(
     launch_req_jwt_decoded, encode, jwks_endpoint_response
 ):
     # make request issued in the future
@@ -114,7 +224,7 @@ def test_verify_and_decode_jwt_fails_on_iat_in_the_future(
 
     validator = LTI13LaunchValidator()
     with patched_jwk_client(jwks_endpoint_response), pytest.raises(TokenError) as e:
-        validator.verify_and_decode_jwt(
+        await validator.verify_and_decode_jwt(
             encoded_jwt=launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"],
             audience={launch_req_jwt_decoded["aud"]},
@@ -124,14 +234,14 @@ def test_verify_and_decode_jwt_fails_on_iat_in_the_future(
     assert str(e.value) == "The token is not yet valid (iat)"
 
 
-def test_verify_and_decode_jwt_fails_on_incorrect_aud(
+async def test_verify_and_decode_jwt_fails_on_incorrect_aud(
     launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
 ):
     validator = LTI13LaunchValidator()
     with patched_jwk_client(jwks_endpoint_response), pytest.raises(
         InvalidAudienceError
     ) as e:
-        validator.verify_and_decode_jwt(
+        await validator.verify_and_decode_jwt(
             encoded_jwt=launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"],
             audience={"client1" + "_something_wrong", "something_else"},
@@ -141,14 +251,14 @@ def test_verify_and_decode_jwt_fails_on_incorrect_aud(
     assert str(e.value) == "Audience doesn't match"
 
 
-def test_verify_and_decode_jwt_fails_on_missing_aud(
+async def test_verify_and_decode_jwt_fails_on_missing_aud(
     launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
 ):
     validator = LTI13LaunchValidator()
     with patched_jwk_client(jwks_endpoint_response), pytest.raises(
         InvalidAudienceError
     ) as e:
-        validator.verify_and_decode_jwt(
+        await validator.verify_and_decode_jwt(
             encoded_jwt=launch_req_jwt,
             issuer=launch_req_jwt_decoded["iss"],
             audience=None,
@@ -158,6 +268,93 @@ def test_verify_and_decode_jwt_fails_on_missing_aud(
     assert str(e.value) == "Invalid audience"
 
 
+async def test_verify_and_decode_jwt_rejects_before_fetching_keys(
+    launch_req_jwt_decoded, encode, jwks_endpoint_response
+):
+    launch_req_jwt_decoded["exp"] = launch_req_jwt_decoded["iat"] - 300
+    launch_req_jwt = encode(launch_req_jwt_decoded)
+
+    validator = LTI13LaunchValidator()
+    with patch.object(JWKSCache, "get_signing_key") as mock_get_signing_key:
+        with pytest.raises(TokenError, match="Signature has expired"):
+            await validator.verify_and_decode_jwt(
+                encoded_jwt=launch_req_jwt,
+                issuer=launch_req_jwt_decoded["iss"],
+                audience={launch_req_jwt_decoded["aud"]},
+                jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+                jwks_algorithms=["RS256"],
+            )
+        with pytest.raises(TokenError, match="alg value is not allowed"):
+            await validator.verify_and_decode_jwt(
+                encoded_jwt=launch_req_jwt,
+                issuer=launch_req_jwt_decoded["iss"],
+                audience={launch_req_jwt_decoded["aud"]},
+                jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+                jwks_algorithms=["ES256"],
+            )
+    mock_get_signing_key.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "encoded_jwt,message",
+    [
+        (b"garbage", "Not enough segments"),
+        (b"e30.e30!.", "Invalid payload padding"),
+        (b"W10.e30.", "Invalid header string: must be a json object"),
+    ],
+)
+async def test_verify_and_decode_jwt_rejects_malformed_jwt(encoded_jwt, message):
+    validator = LTI13LaunchValidator()
+    with pytest.raises(TokenError) as e:
+        await validator.verify_and_decode_jwt(
+            encoded_jwt=encoded_jwt,
+            issuer="https://platform.example.com",
+            audience={"client1"},
+            jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+            jwks_algorithms=["RS256"],
+        )
+    assert str(e.value) == message
+
+
+async def test_verify_and_decode_jwt_rejects_tampered_claims(
+    launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
+):
+    header, _, signature = launch_req_jwt.split(b".")
+    claims = {**launch_req_jwt_decoded, "email": "someone.else@example.com"}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b"=")
+
+    validator = LTI13LaunchValidator()
+    with patched_jwk_client(jwks_endpoint_response), pytest.raises(TokenError) as e:
+        await validator.verify_and_decode_jwt(
+            encoded_jwt=b".".join([header, payload, signature]),
+            issuer=launch_req_jwt_decoded["iss"],
+            audience={launch_req_jwt_decoded["aud"]},
+            jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+            jwks_algorithms=["RS256"],
+        )
+    assert str(e.value) == "Signature verification failed"
+
+
+async def test_verify_and_decode_jwt_rejects_non_string_kid(
+    launch_req_jwt, launch_req_jwt_decoded, jwks_endpoint_response
+):
+    _, payload, signature = launch_req_jwt.split(b".")
+    header = base64.urlsafe_b64encode(
+        json.dumps({"alg": "RS256", "kid": ["x"]}).encode()
+    ).rstrip(b"=")
+
+    validator = LTI13LaunchValidator()
+    with patched_jwk_client(jwks_endpoint_response), pytest.raises(TokenError) as e:
+        await validator.verify_and_decode_jwt(
+            encoded_jwt=b".".join([header, payload, signature]),
+            issuer=launch_req_jwt_decoded["iss"],
+            audience={launch_req_jwt_decoded["aud"]},
+            jwks_endpoint="https://lti-ri.imsglobal.org/platforms/3691/platform_keys/3396.json",
+            jwks_algorithms=["RS256"],
+        )
+    assert str(e.value) == "Key ID header parameter must be a string"
+
+
 # Tests of validate_launch_request()
 # -------------------------------------------------------------------------------
 def test_validate_minimal_launch_request(minimal_launch_req_jwt_decoded):
@@ -243,6 +440,26 @@ def test_alidate_launch_request_fails_on_too_old_iat(launch_req_jwt_decoded):
         validator.validate_id_token(launch_req_jwt_decoded)
 
 
+def test_validate_launch_request_reports_all_violations(launch_req_jwt_decoded):
+    validator = LTI13LaunchValidator()
+    launch_req_jwt_decoded["https://purl.imsglobal.org/spec/lti/claim/version"] = (
+        "1.0.0"
+    )
+    del launch_req_jwt_decoded["https://purl.imsglobal.org/spec/lti/claim/roles"]
+    launch_req_jwt_decoded["https://purl.imsglobal.org/spec/lti/claim/resource_link"][
+        "id"
+    ] = ""
+
+    with pytest.raises(ClaimsValidationError) as e:
+        validator.validate_id_token(launch_req_jwt_decoded)
+    assert [type(error) for error in e.value.errors] == [
+        IncorrectValueError,
+        MissingRequiredArgumentError,
+        MissingRequiredArgumentError,
+    ]
+    assert "resource_link claim's id can't be empty" in str(e.value)
+
+
 def test_validate_launch_request_with_priv(
     launch_req_jwt_decoded_priv,
 ):
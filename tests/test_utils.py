@@ -1,6 +1,20 @@
+import asyncio
+import logging
+import threading
+import time
 from unittest.mock import Mock
 
-from ltiauthenticator.utils import convert_request_to_dict, get_browser_protocol
+from ltiauthenticator.utils import (
+    AuthStateDigests,
+    CoalescedLoginMixin,
+    LaunchCache,
+    ResponseCache,
+    call_store,
+    convert_request_to_dict,
+    digest_auth_state,
+    digest_launch_request,
+    get_browser_protocol,
+)
 
 
 def test_get_protocol_with_more_than_one_value():
@@ -34,3 +48,187 @@ def test_convert_request_arguments_with_encoded_items_to_dict():
     result = convert_request_to_dict(arguments)
 
     assert expected == result
+
+
+def test_response_cache_renders_each_key_once():
+    cache = ResponseCache()
+    render = Mock(return_value="<config/>")
+
+    response = cache.get(("https", "hub.example.com", "/"), render)
+
+    assert cache.get(("https", "hub.example.com", "/"), render) is response
+    assert render.call_count == 1
+    assert response.body == b"<config/>"
+    assert response.etag.startswith('"') and response.etag.endswith('"')
+
+
+def test_response_cache_evicts_least_recently_used_response():
+    cache = ResponseCache(maxsize=2)
+    first = cache.get("first", lambda: "first")
+    cache.get("second", lambda: "second")
+    cache.get("first", lambda: "first")
+
+    cache.get("third", lambda: "third")
+
+    assert cache.get("first", lambda: "other") is first
+    assert cache.get("second", lambda: "other").body == b"other"
+
+
+def test_digest_launch_request_identifies_duplicates():
+    arguments = {"oauth_nonce": [b"nonce"], "user_id": [b"1"]}
+
+    digest = digest_launch_request(arguments)
+
+    assert digest_launch_request(dict(reversed(list(arguments.items())))) == digest
+    assert digest_launch_request({**arguments, "user_id": [b"2"]}) != digest
+    assert digest_launch_request({"a": [b"bc"]}) != digest_launch_request(
+        {"ab": [b"c"]}
+    )
+
+
+def test_launch_cache_forgets_expired_launches():
+    cache = LaunchCache(ttl=10)
+    cache.put("digest", "somebody", "/hub/home", now=1000)
+
+    assert cache.get("digest", now=1009) == ("somebody", "/hub/home")
+    assert cache.get("digest", now=1010) is None
+
+
+def test_launch_cache_is_bounded():
+    cache = LaunchCache(ttl=10, max_size=1)
+    cache.put("digest", "somebody", "/hub/home")
+    cache.put("other_digest", "somebody", "/hub/home")
+
+    assert cache.get("digest") is None
+    assert cache.get("other_digest") == ("somebody", "/hub/home")
+
+
+def test_launch_cache_can_be_disabled():
+    cache = LaunchCache(ttl=0)
+    cache.put("digest", "somebody", "/hub/home")
+
+    assert cache.get("digest") is None
+
+
+class DigestAuthenticator:
+    """Stand-in for an authenticator digesting auth_states."""
+
+    def digest_auth_state(self, auth_state):
+        return digest_auth_state(auth_state)
+
+
+class LoginHandler:
+    """Stand-in for JupyterHub's BaseHandler persisting users slowly."""
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, calls, authenticator=None):
+        self.calls = calls
+        self.authenticator = authenticator or DigestAuthenticator()
+        self.persisted = []
+
+    async def auth_to_user(self, authenticated, user=None):
+        self.calls.append(authenticated["name"])
+        await asyncio.sleep(0.01)
+        self.persisted.append(authenticated.get("auth_state"))
+        if authenticated.get("fail"):
+            raise ValueError("login failed")
+        return f"user {authenticated['name']}"
+
+
+class CoalescedLoginHandler(CoalescedLoginMixin, LoginHandler):
+    pass
+
+
+async def test_coalesced_login_persists_concurrent_logins_of_a_user_once():
+    calls = []
+
+    users = await asyncio.gather(
+        CoalescedLoginHandler(calls).auth_to_user({"name": "student"}),
+        CoalescedLoginHandler(calls).auth_to_user({"name": "student"}),
+        CoalescedLoginHandler(calls).auth_to_user({"name": "other_student"}),
+    )
+
+    assert users == ["user student", "user student", "user other_student"]
+    assert sorted(calls) == ["other_student", "student"]
+    await asyncio.sleep(0)
+    assert CoalescedLoginMixin._pending_logins == {}
+
+    await CoalescedLoginHandler(calls).auth_to_user({"name": "student"})
+    assert calls.count("student") == 2
+
+
+async def test_coalesced_login_shares_errors():
+    calls = []
+
+    results = await asyncio.gather(
+        CoalescedLoginHandler(calls).auth_to_user({"name": "student", "fail": True}),
+        CoalescedLoginHandler(calls).auth_to_user({"name": "student", "fail": True}),
+        return_exceptions=True,
+    )
+
+    assert calls == ["student"]
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+async def test_coalesced_login_persists_different_logins_one_after_the_other():
+    calls = []
+    handlers = [CoalescedLoginHandler(calls), CoalescedLoginHandler(calls)]
+
+    started_at = time.monotonic()
+    users = await asyncio.gather(
+        handlers[0].auth_to_user({"name": "student", "auth_state": {"course": "A"}}),
+        handlers[1].auth_to_user({"name": "student", "auth_state": {"course": "B"}}),
+    )
+
+    assert users == ["user student", "user student"]
+    assert calls == ["student", "student"]
+    # the second login waited for the first one
+    assert time.monotonic() - started_at >= 0.02
+    assert handlers[0].persisted == [{"course": "A"}]
+    assert handlers[1].persisted == [{"course": "B"}]
+    await asyncio.sleep(0)
+    assert CoalescedLoginMixin._pending_logins == {}
+
+
+def test_digest_auth_state_ignores_key_order_and_ignored_keys():
+    digest = digest_auth_state({"sub": "1", "name": "Student", "nonce": "a"}, ["nonce"])
+
+    assert digest == digest_auth_state({"name": "Student", "sub": "1"})
+    assert digest == digest_auth_state(
+        {"nonce": "b", "name": "Student", "sub": "1"}, ["nonce"]
+    )
+    assert digest != digest_auth_state({"name": "Teacher", "sub": "1"})
+
+
+def test_auth_state_digests_evicts_least_recently_used_user():
+    digests = AuthStateDigests(max_size=2)
+    digests.put("student", "1", "a")
+    digests.put("teacher", "2", "b")
+    digests.get("student")
+    digests.put("admin", "3", "c")
+
+    assert digests.get("student") == ("1", "a")
+    assert digests.get("teacher") is None
+    assert digests.get("admin") == ("3", "c")
+
+
+def test_auth_state_digests_can_be_disabled():
+    digests = AuthStateDigests(max_size=0)
+    digests.put("student", "1", "a")
+
+    assert digests.get("student") is None
+
+
+class Store:
+    def __init__(self, blocking):
+        self.blocking = blocking
+
+
+async def test_call_store_runs_blocking_calls_in_thread():
+    assert await call_store(Store(False), threading.current_thread) is (
+        threading.current_thread()
+    )
+    assert await call_store(Store(True), threading.current_thread) is not (
+        threading.current_thread()
+    )